@@ -24,9 +24,32 @@ class AdminDashboard:
         Args:
             data_dir: Directory containing user data
         """
-        self.user_manager = UserManager(data_dir=data_dir)
-        self.payment_processor = PaymentProcessor()
-        self.usage_tracker = UsageTracker()
+        # Services are created on first use, so the menu comes up at once
+        self.data_dir = data_dir
+        self._user_manager: Optional[UserManager] = None
+        self._payment_processor: Optional[PaymentProcessor] = None
+        self._usage_tracker: Optional[UsageTracker] = None
+    
+    @property
+    def user_manager(self) -> UserManager:
+        """User manager for the dashboard's data directory"""
+        if self._user_manager is None:
+            self._user_manager = UserManager(data_dir=self.data_dir)
+        return self._user_manager
+    
+    @property
+    def payment_processor(self) -> PaymentProcessor:
+        """Payment processor"""
+        if self._payment_processor is None:
+            self._payment_processor = PaymentProcessor()
+        return self._payment_processor
+    
+    @property
+    def usage_tracker(self) -> UsageTracker:
+        """Usage tracker"""
+        if self._usage_tracker is None:
+            self._usage_tracker = UsageTracker()
+        return self._usage_tracker
     
     def get_user_stats(self) -> Dict:
         """
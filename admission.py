@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Admission Control for 1-800-PHONESEX
+Caps how many replies are generated at once and, when the line is full,
+queues callers per subscription tier. Freed slots go to the tiers by
+weighted round robin, so VIP callers are served before PREMIUM and PREMIUM
+before FREE without starving anyone. Each tier has its own maximum wait, and
+FREE callers are turned away up front when the queues are too deep.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from metrics import MetricsRegistry, REGISTRY
+from resilience import UpstreamUnavailable, wait_within
+
+
+# Highest priority first
+TIERS = ("vip", "premium", "free")
+
+DEFAULT_WEIGHTS = {"vip": 6, "premium": 3, "free": 1}
+DEFAULT_MAX_WAIT = {"vip": 30.0, "premium": 15.0, "free": 5.0}
+
+# Tiers turned away instead of queued once the queues are too deep
+SHED_TIERS = ("free",)
+
+
+class AdmissionTimeout(UpstreamUnavailable):
+    """The caller waited longer than their tier allows"""
+
+
+class LoadShed(UpstreamUnavailable):
+    """The caller was turned away because the queues are too deep"""
+
+
+def parse_tier_values(value: Optional[str], default: Dict[str, float]) -> Dict[str, float]:
+    """
+    Parse per-tier settings such as "vip=6,premium=3,free=1"
+
+    Args:
+        value: Setting string (tiers left out keep their default)
+        default: Default value per tier
+
+    Returns:
+        Value per tier
+    """
+    result = dict(default)
+    for item in (value or "").split(","):
+        if "=" in item:
+            tier, number = item.split("=", 1)
+            if tier.strip().lower() in result:
+                result[tier.strip().lower()] = float(number)
+    return result
+
+
+class Admission:
+    """A generation slot, held until the reply is finished"""
+
+    __slots__ = ("controller", "tier", "released")
+
+    def __init__(self, controller: Optional['AdmissionController'], tier: str):
+        self.controller = controller
+        self.tier = tier
+        self.released = False
+
+    def release(self):
+        """Give the slot to the next caller in line (releasing twice has no effect)"""
+        if self.released:
+            return
+        self.released = True
+        if self.controller is not None:
+            self.controller._release()
+
+
+class _Waiter:
+    """A caller queued for a slot"""
+
+    __slots__ = ("tier", "enqueued", "granted", "wake")
+
+    def __init__(self, tier: str, wake: Optional[Callable[[], None]] = None):
+        self.tier = tier
+        self.enqueued = time.monotonic()
+        self.granted = False
+        # Async waiters are woken on their loop instead of the condition
+        self.wake = wake
+
+
+class AdmissionController:
+    """
+    Tier-priority admission in front of the LLM call
+
+    Callers with a free slot and nobody ahead of them are admitted at once;
+    everyone else waits in their tier's queue.
+    """
+
+    _shared: Optional['AdmissionController'] = None
+
+    def __init__(self, max_concurrent: Optional[int] = None,
+                 weights: Optional[Dict[str, float]] = None,
+                 max_wait: Optional[Dict[str, float]] = None,
+                 shed_depth: Optional[int] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize admission control
+
+        Args:
+            max_concurrent: Replies generated at once
+                (ADMISSION_MAX_CONCURRENT, default 0 = no limit)
+            weights: Share of freed slots per tier
+                (ADMISSION_WEIGHTS, default vip=6,premium=3,free=1)
+            max_wait: Longest wait per tier in seconds
+                (ADMISSION_MAX_WAIT, default vip=30,premium=15,free=5)
+            shed_depth: Callers queued across all tiers at which FREE
+                callers are turned away (ADMISSION_SHED_DEPTH, default 50;
+                0 never sheds)
+            metrics: Registry for queue depth, wait time and rejections
+        """
+        if max_concurrent is None:
+            max_concurrent = int(os.getenv("ADMISSION_MAX_CONCURRENT", "0"))
+        self.max_concurrent = max_concurrent
+        self.weights = weights or parse_tier_values(os.getenv("ADMISSION_WEIGHTS"), DEFAULT_WEIGHTS)
+        self.max_wait = max_wait or parse_tier_values(os.getenv("ADMISSION_MAX_WAIT"), DEFAULT_MAX_WAIT)
+        if shed_depth is None:
+            shed_depth = int(os.getenv("ADMISSION_SHED_DEPTH", "50"))
+        self.shed_depth = shed_depth
+        self.metrics = metrics or REGISTRY
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queues: Dict[str, deque] = {tier: deque() for tier in TIERS}
+        # Smooth weighted round robin state
+        self._credit: Dict[str, float] = {tier: 0.0 for tier in TIERS}
+        self._in_flight = 0
+
+    @classmethod
+    def shared(cls) -> 'AdmissionController':
+        """Get the process-wide controller configured from the environment"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @property
+    def enabled(self) -> bool:
+        """Whether concurrency is limited at all"""
+        return self.max_concurrent > 0
+
+    @staticmethod
+    def normalize_tier(tier: Optional[str]) -> str:
+        """Map a tier name to a queue (unknown or missing tiers queue as FREE)"""
+        tier = (tier or "").lower()
+        return tier if tier in TIERS else "free"
+
+    def _queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _pick(self) -> Optional[str]:
+        """Choose the tier that gets the next slot (caller holds the lock)"""
+        active = [tier for tier in TIERS if self._queues[tier]]
+        if not active:
+            return None
+        total = sum(self.weights[tier] for tier in active)
+        for tier in active:
+            self._credit[tier] += self.weights[tier]
+        chosen = max(active, key=lambda tier: self._credit[tier])
+        self._credit[chosen] -= total
+        return chosen
+
+    def _grant(self):
+        """Hand free slots to waiters (caller holds the lock)"""
+        granted = False
+        while self._in_flight < self.max_concurrent:
+            tier = self._pick()
+            if tier is None:
+                break
+            waiter = self._queues[tier].popleft()
+            if not self._queues[tier]:
+                self._credit[tier] = 0.0
+            waiter.granted = True
+            self._in_flight += 1
+            granted = True
+            if waiter.wake is not None:
+                waiter.wake()
+        if granted:
+            self._changed.notify_all()
+        self._update_gauges()
+
+    def _update_gauges(self):
+        for tier in TIERS:
+            self.metrics.gauge("chat_admission_queue_depth", tier=tier).set(len(self._queues[tier]))
+        self.metrics.gauge("chat_admission_in_flight").set(self._in_flight)
+
+    def _enqueue(self, tier: str, wake: Optional[Callable[[], None]] = None) -> _Waiter:
+        """
+        Admit a caller or put them in line (caller holds the lock)
+
+        Raises:
+            LoadShed: If the caller's tier is shed and the queues are too deep
+        """
+        waiter = _Waiter(tier, wake)
+        if self._in_flight < self.max_concurrent and not self._queued():
+            waiter.granted = True
+            self._in_flight += 1
+            self._update_gauges()
+            return waiter
+        if tier in SHED_TIERS and self.shed_depth and self._queued() >= self.shed_depth:
+            self.metrics.increment("chat_admission_rejected_total", tier=tier, reason="shed")
+            raise LoadShed("Too many callers waiting")
+        self._queues[tier].append(waiter)
+        self._grant()
+        return waiter
+
+    def _leave(self, waiter: _Waiter):
+        """Remove a waiter that gave up (caller holds the lock)"""
+        try:
+            self._queues[waiter.tier].remove(waiter)
+        except ValueError:
+            pass
+        if not self._queues[waiter.tier]:
+            self._credit[waiter.tier] = 0.0
+        self._update_gauges()
+
+    def _release(self):
+        """Free a slot and give it to the next caller"""
+        with self._lock:
+            self._in_flight -= 1
+            self._grant()
+
+    def _abandon(self, waiter: _Waiter):
+        """Handle a waiter interrupted while queued (caller holds the lock)"""
+        if waiter.granted:
+            # The slot arrived as the caller gave up; pass it on
+            self._in_flight -= 1
+            self._grant()
+        else:
+            self._leave(waiter)
+
+    def _admitted(self, waiter: _Waiter) -> Admission:
+        self.metrics.observe("chat_admission_wait_seconds", time.monotonic() - waiter.enqueued,
+                             tier=waiter.tier)
+        return Admission(self, waiter.tier)
+
+    def _timed_out(self, waiter: _Waiter) -> AdmissionTimeout:
+        self.metrics.increment("chat_admission_rejected_total", tier=waiter.tier, reason="timeout")
+        return AdmissionTimeout(f"No {waiter.tier} slot within {self.max_wait[waiter.tier]:.0f}s")
+
+    def acquire(self, tier: Optional[str], timeout: Optional[float] = None) -> Admission:
+        """
+        Wait for a generation slot
+
+        Args:
+            tier: Caller's subscription tier
+            timeout: Longest wait in seconds (defaults to the tier's max wait)
+
+        Returns:
+            Admission to release once the reply is finished
+
+        Raises:
+            LoadShed: If a FREE caller arrives while the queues are too deep
+            AdmissionTimeout: If no slot frees up in time
+        """
+        tier = self.normalize_tier(tier)
+        if not self.enabled:
+            return Admission(None, tier)
+
+        timeout = self.max_wait[tier] if timeout is None else timeout
+        with self._lock:
+            waiter = self._enqueue(tier)
+            deadline = waiter.enqueued + timeout
+            try:
+                while not waiter.granted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._changed.wait(remaining)
+            except BaseException:
+                self._abandon(waiter)
+                raise
+            if not waiter.granted:
+                self._leave(waiter)
+                raise self._timed_out(waiter)
+        return self._admitted(waiter)
+
+    async def acquire_async(self, tier: Optional[str], timeout: Optional[float] = None) -> Admission:
+        """Async version of acquire(), waiting without blocking the loop"""
+        import asyncio
+        tier = self.normalize_tier(tier)
+        if not self.enabled:
+            return Admission(None, tier)
+
+        timeout = self.max_wait[tier] if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        with self._lock:
+            waiter = self._enqueue(tier, wake=lambda: loop.call_soon_threadsafe(granted.set))
+        if waiter.granted:
+            return self._admitted(waiter)
+        try:
+            await wait_within(granted.wait(), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if not waiter.granted:
+                    self._leave(waiter)
+                    raise self._timed_out(waiter)
+        except BaseException:
+            with self._lock:
+                self._abandon(waiter)
+            raise
+        return self._admitted(waiter)
+
+    def get_stats(self) -> Dict:
+        """Get slots in use and queue depth per tier"""
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "in_flight": self._in_flight,
+                "queued": {tier: len(self._queues[tier]) for tier in TIERS},
+            }
@@ -5,12 +5,30 @@ This agent provides sultry, seductive adult conversation experiences.
 ⚠️ WARNING: Explicit adult content - 18+ only
 """
 
+import os
+import time
+import asyncio
 import logging
+from typing import Callable, Dict, Optional, Tuple
 from livekit import agents
-from livekit.agents import AutoSubscribe, JobContext, WorkerOptions, cli
+from livekit.agents import AgentServer, AutoSubscribe, JobContext, JobProcess, WorkerOptions, cli, utils
 from livekit.plugins import groq, elevenlabs
 from dotenv import load_dotenv
 
+try:
+    from livekit.plugins import silero
+    VAD_AVAILABLE = True
+except ImportError:
+    VAD_AVAILABLE = False
+
+from context_window import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+from greeting_cache import GreetingCache, voice_key
+from metrics import REGISTRY
+from rate_limit import UpstreamLimiter
+from call_trace import CallTrace
+from speech_segmenter import segment_text
+from worker_load import WorkerLoad
+
 # Load environment variables
 load_dotenv('.env.local')
 load_dotenv()
@@ -20,13 +38,282 @@ logger = logging.getLogger("adult-chatline")
 logger.setLevel(logging.INFO)
 
 
-def prewarm(proc: JobContext):
+# Operator the voice line connects callers to
+PERSONA = "Desire"
+
+GREETING = (
+    "Hey there, sexy... I'm Desire, and I've been waiting for your call. "
+    "Mmm, I can already tell this is going to be fun. "
+    "I'm here to make all your fantasies come alive. "
+    "So tell me, gorgeous... what naughty thoughts brought you to my line tonight?"
+)
+
+
+class TurnTiming:
+    """When each stage of a reply first produced output, in seconds from the start of the turn"""
+
+    # first_audio is when the audio output starts playing the reply, so
+    # first_audio - tts_first_byte is the time spent queueing and publishing
+    STAGES = ("llm_first_token", "first_segment", "tts_first_byte", "first_audio")
+
+    __slots__ = ("started",) + STAGES
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.llm_first_token: Optional[float] = None
+        self.first_segment: Optional[float] = None
+        self.tts_first_byte: Optional[float] = None
+        self.first_audio: Optional[float] = None
+
+    def mark(self, stage: str):
+        """Record a stage the first time it happens (recorded as voice_turn_<stage>_seconds)"""
+        if getattr(self, stage) is None:
+            elapsed = time.perf_counter() - self.started
+            setattr(self, stage, elapsed)
+            REGISTRY.observe(f"voice_turn_{stage}_seconds", elapsed)
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        """Get each stage's time, None for stages not reached"""
+        return {stage: getattr(self, stage) for stage in self.STAGES}
+
+
+class ChatlineAgent(agents.voice.Agent):
+    """Voice agent whose LLM calls share the process-wide upstream limiter"""
+
+    def __init__(self, *, call_started: Optional[float] = None, prewarmed: bool = False,
+                 trace: Optional[CallTrace] = None, **kwargs):
+        """
+        Initialize the agent
+
+        Args:
+            call_started: perf_counter() when the call was accepted, used to
+                measure time to first audio
+            prewarmed: Whether the plugins came from prewarm()
+            trace: Per-turn latency trace of the call (None when tracing is off)
+            **kwargs: Passed to the LiveKit Agent
+        """
+        super().__init__(**kwargs)
+        self.call_started = call_started
+        self.prewarmed = prewarmed
+        self.trace = trace
+        # Timing of the reply being generated, of the one waiting to start
+        # playing, and of the last one spoken
+        self.turn: Optional[TurnTiming] = None
+        self.playing: Optional[TurnTiming] = None
+        self.last_turn: Optional[TurnTiming] = None
+
+    def _trace(self, event: str):
+        if self.trace is not None:
+            self.trace.mark(event)
+
+    async def llm_node(self, chat_ctx, tools, model_settings):
+        """Wait for GROQ quota, then stream the default LLM node"""
+        max_tokens = int(os.getenv("MAX_TOKENS", "1024"))
+        prompt_tokens = sum(
+            estimate_tokens(getattr(item, "text_content", None) or "") + MESSAGE_OVERHEAD_TOKENS
+            for item in chat_ctx.items
+        )
+        turn = self.turn = TurnTiming()
+        self._trace("llm_start")
+        reservation = await UpstreamLimiter.shared().acquire_async(prompt_tokens + max_tokens)
+
+        reply = []
+        try:
+            async for chunk in agents.voice.Agent.default.llm_node(self, chat_ctx, tools, model_settings):
+                if isinstance(chunk, str):
+                    reply.append(chunk)
+                elif getattr(chunk, "delta", None) is not None and chunk.delta.content:
+                    reply.append(chunk.delta.content)
+                if reply and turn.llm_first_token is None:
+                    turn.mark("llm_first_token")
+                    self._trace("llm_first_token")
+                yield chunk
+        finally:
+            reservation.settle(prompt_tokens + estimate_tokens("".join(reply)))
+            self._trace("llm_done")
+
+    async def timed_audio(self, frames):
+        """Pass audio frames through, timing the call's first one"""
+        async for frame in frames:
+            if self.call_started is not None:
+                elapsed = time.perf_counter() - self.call_started
+                self.call_started = None
+                REGISTRY.observe("voice_first_audio_seconds", elapsed,
+                                 prewarmed=str(self.prewarmed).lower())
+                logger.info(f"First audio {elapsed * 1000:.0f} ms after connect "
+                            f"({'prewarmed' if self.prewarmed else 'cold'} plugins)")
+            yield frame
+
+    def watch_playback(self, audio_output):
+        """
+        Time each reply's first_audio from the audio output's playback
+
+        Args:
+            audio_output: The session's audio output (session.output.audio)
+        """
+        if audio_output is not None:
+            audio_output.on("playback_started", self._playback_started)
+
+    def _playback_started(self, event):
+        """The audio output started playing; close the timing of the reply it plays"""
+        turn, self.playing = self.playing, None
+        if turn is None:
+            return
+        turn.mark("first_audio")
+        self.last_turn = turn
+        logger.info("Turn timing: " + ", ".join(
+            f"{stage} {value * 1000:.0f} ms" if value is not None else f"{stage} -"
+            for stage, value in turn.to_dict().items()))
+
+    async def speak_segments(self, tts, segments, conn_options=None,
+                             on_first_frame: Optional[Callable[[], None]] = None):
+        """
+        Synthesize segments on one TTS stream, flushing after each
+
+        Flushing makes the TTS start on a segment as soon as it arrives
+        instead of waiting for its own chunking to fill up.
+
+        Args:
+            tts: Streaming TTS plugin
+            segments: Speakable segments (see speech_segmenter)
+            conn_options: TTS connection options
+            on_first_frame: Called when the TTS returns its first audio
+
+        Yields:
+            Audio frames
+        """
+        options = {"conn_options": conn_options} if conn_options is not None else {}
+        async with tts.stream(**options) as stream:
+
+            async def forward():
+                async for segment in segments:
+                    stream.push_text(segment + " ")
+                    stream.flush()
+                stream.end_input()
+
+            forward_task = asyncio.create_task(forward())
+            try:
+                async for event in stream:
+                    if on_first_frame is not None:
+                        on_first_frame()
+                        on_first_frame = None
+                    yield event.frame
+            finally:
+                await utils.aio.cancel_and_wait(forward_task)
+
+    async def tts_node(self, text, model_settings):
+        """Speak the reply segment by segment as it streams in, timing the turn"""
+        turn, self.turn = self.turn, None
+
+        async def segments():
+            async for segment in segment_text(text):
+                if turn is not None and turn.first_segment is None:
+                    turn.mark("first_segment")
+                    self._trace("tts_start")
+                yield segment
+
+        def first_byte():
+            if turn is not None:
+                turn.mark("tts_first_byte")
+            self._trace("tts_first_byte")
+
+        # first_audio is marked when the audio output starts playing this reply
+        self.playing = turn
+        tts = self.session.tts
+        if tts is not None and tts.capabilities.streaming:
+            frames = self.speak_segments(tts, segments(), self.session.conn_options.tts_conn_options,
+                                         on_first_frame=first_byte)
+        else:
+            # Non-streaming TTS goes through the default node's sentence adapter,
+            # which yields each synthesized frame as it comes back
+            async def synthesized(frames):
+                first = True
+                async for frame in frames:
+                    if first:
+                        first_byte()
+                        first = False
+                    yield frame
+
+            frames = synthesized(agents.voice.Agent.default.tts_node(
+                self, (segment + " " async for segment in segments()), model_settings))
+
+        async for frame in self.timed_audio(frames):
+            yield frame
+
+
+def groq_endpoint() -> dict:
+    """LLM plugin options for GROQ_BASE_URL (e.g. fake_groq_server.py), if set"""
+    base_url = os.getenv("GROQ_BASE_URL")
+    return {"base_url": base_url.rstrip("/") + "/openai/v1"} if base_url else {}
+
+
+def create_plugins() -> Dict:
+    """Build the STT, LLM, TTS and (when silero is installed) VAD plugins"""
+    plugins = {
+        "stt": groq.STT(model=os.getenv("STT_MODEL", "whisper-large-v3")),
+        "llm": groq.LLM(model=os.getenv("AI_MODEL", "llama-3.3-70b-versatile"), **groq_endpoint()),
+        "tts": elevenlabs.TTS(),
+    }
+    if VAD_AVAILABLE:
+        # Loading the model is the slowest part of startup
+        plugins["vad"] = silero.VAD.load()
+    return plugins
+
+
+def warm_plugins(plugins: Dict):
+    """Open the plugins' upstream connections in the background (needs a running loop)"""
+    for name in ("stt", "llm", "tts"):
+        try:
+            plugins[name].prewarm()
+        except Exception as e:
+            # A failed warm-up only costs latency; the call still works
+            logger.warning(f"Could not prewarm {name}: {e}")
+
+
+def prewarm(proc: JobProcess):
     """
     Prewarm function to initialize plugins before the agent starts.
-    This helps reduce latency for the first interaction.
+    The plugin instances (and the silero VAD model) are kept in the process
+    userdata and reused by every call this process handles.
+    Set VOICE_PREWARM=false to build them per call instead.
     """
-    proc.prewarm(groq.STT())
-    proc.prewarm(elevenlabs.TTS())
+    if os.getenv("VOICE_PREWARM", "true").lower() == "true":
+        proc.userdata["plugins"] = create_plugins()
+
+
+def job_plugins(proc: JobProcess) -> Tuple[Dict, bool]:
+    """
+    Get the plugins for a call
+
+    Args:
+        proc: Job process prepared by prewarm()
+
+    Returns:
+        The plugins and whether they were prewarmed
+    """
+    plugins = proc.userdata.get("plugins")
+    if plugins is not None:
+        return plugins, True
+    return create_plugins(), False
+
+
+def trace_session(session, trace: CallTrace):
+    """Feed the session's speech, transcript and playback events into a call trace"""
+
+    @session.on("user_state_changed")
+    def on_user_state(event):
+        if event.old_state == "speaking":
+            trace.mark("speech_end", event.created_at)
+
+    @session.on("user_input_transcribed")
+    def on_transcript(event):
+        if event.is_final:
+            trace.mark("stt_final", event.created_at)
+
+    @session.on("agent_state_changed")
+    def on_agent_state(event):
+        if event.new_state == "speaking":
+            trace.mark("audio_published", event.created_at)
 
 
 async def entrypoint(ctx: JobContext):
@@ -34,6 +321,13 @@ async def entrypoint(ctx: JobContext):
     Main entrypoint for the voice assistant agent.
     Configures and starts the voice agent with Groq and ElevenLabs.
     """
+    call_started = time.perf_counter()
+    plugins, prewarmed = job_plugins(ctx.proc)
+    if prewarmed:
+        # Connections are bound to the job's event loop, which does not exist
+        # yet during prewarm(); open them now, while the room connects
+        warm_plugins(plugins)
+
     logger.info(f"Connecting to room: {ctx.room.name}")
     await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
@@ -52,31 +346,58 @@ async def entrypoint(ctx: JobContext):
     )
 
     # Configure the voice agent with Groq STT, LLM, and ElevenLabs TTS
-    assistant = agents.voice.Agent(
+    trace = CallTrace.start(room=ctx.room.name, personality=PERSONA)
+    assistant = ChatlineAgent(
         instructions=instructions,
-        stt=groq.STT(model="whisper-large-v3"),
-        llm=groq.LLM(model="llama-3.3-70b-versatile"),
-        tts=elevenlabs.TTS(),
+        call_started=call_started,
+        prewarmed=prewarmed,
+        trace=trace,
     )
 
     # Start the voice agent
-    assistant_session = await assistant.start(ctx.room)
+    # The session does not close the plugins, so the next call reuses them
+    assistant_session = agents.voice.AgentSession(**plugins)
+    if trace is not None:
+        trace_session(assistant_session, trace)
+
+        async def close_trace():
+            trace.close()
+        ctx.add_shutdown_callback(close_trace)
+    await assistant_session.start(assistant, room=ctx.room)
+    assistant.watch_playback(assistant_session.output.audio)
+
+    # Greet the user when they join, from the greeting cache when possible
+    greetings = GreetingCache.shared()
+    if greetings is None:
+        await assistant_session.say(GREETING, allow_interruptions=True)
+        return
 
-    # Greet the user when they join
+    greeting = greetings.get(PERSONA, voice_key(plugins["tts"]), GREETING)
+    if greeting is not None:
+        audio = greeting.stream()
+    else:
+        # Speak it with live TTS, caching the frames as they are played
+        audio = greetings.synthesize(plugins["tts"], PERSONA, GREETING)
     await assistant_session.say(
-        "Hey there, sexy... I'm Desire, and I've been waiting for your call. "
-        "Mmm, I can already tell this is going to be fun. "
-        "I'm here to make all your fantasies come alive. "
-        "So tell me, gorgeous... what naughty thoughts brought you to my line tonight?",
+        GREETING,
+        audio=assistant.timed_audio(audio),
         allow_interruptions=True,
     )
 
 
 if __name__ == "__main__":
-    # Run the agent with the specified entrypoint and prewarm function
-    cli.run_app(
+    # Run the agent with the specified entrypoint and prewarm function,
+    # with load-aware call acceptance and a drain window on shutdown
+    load = WorkerLoad.shared()
+    server = AgentServer.from_server_options(
         WorkerOptions(
             entrypoint_fnc=entrypoint,
             prewarm_fnc=prewarm,
+            request_fnc=load.request,
+            load_fnc=load,
+            load_threshold=load.threshold,
+            drain_timeout=int(os.getenv("VOICE_DRAIN_TIMEOUT", "1800")),
         ),
     )
+    load.bind(server)
+    cli.run_app(server)
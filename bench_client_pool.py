@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark: first-message latency with per-session vs shared GROQ clients
+Runs against the local fake GROQ server, no API key or network needed.
+
+Usage:
+    python bench_client_pool.py [--sessions 50] [--handshake-ms 30] [--json out.json]
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from groq import Groq
+
+from client_pool import get_client, reset_clients
+from fake_groq_server import FakeGroqConfig, FakeGroqServer
+
+
+def first_message(client) -> float:
+    """Time one chat completion request"""
+    started = time.perf_counter()
+    client.chat.completions.create(
+        model="bench",
+        messages=[{"role": "user", "content": "hey"}],
+        max_tokens=16
+    )
+    return time.perf_counter() - started
+
+
+def run(sessions: int, handshake_ms: float) -> dict:
+    """Run both scenarios and return their latency summaries"""
+    # Answer instantly so only connection setup is measured
+    config = FakeGroqConfig(ttft_ms=0, tokens_per_second=0, handshake_ms=handshake_ms)
+    server = FakeGroqServer(config=config).start()
+    base_url = server.base_url
+
+    try:
+        # Before: every session builds its own client and connection pool
+        fresh = []
+        for _ in range(sessions):
+            started = time.perf_counter()
+            client = Groq(api_key="bench", base_url=base_url)
+            first_message(client)
+            fresh.append(time.perf_counter() - started)
+            client.close()
+
+        # After: sessions share one pooled client with warm connections
+        reset_clients()
+        shared = []
+        for _ in range(sessions):
+            started = time.perf_counter()
+            client = get_client("bench", base_url)
+            first_message(client)
+            shared.append(time.perf_counter() - started)
+        reset_clients()
+    finally:
+        server.stop()
+
+    def summarize(samples):
+        ordered = sorted(samples)
+        return {
+            "mean_ms": statistics.mean(samples) * 1000,
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        }
+
+    return {
+        "sessions": sessions,
+        "handshake_ms": handshake_ms,
+        "per_session_client": summarize(fresh),
+        "shared_client": summarize(shared),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=50, help="Sessions per scenario")
+    parser.add_argument("--handshake-ms", type=float, default=30.0,
+                        help="Simulated per-connection handshake cost")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.sessions, args.handshake_ms)
+
+    print("First-message latency over", results["sessions"], "sessions")
+    for name in ("per_session_client", "shared_client"):
+        r = results[name]
+        print(f"  {name:20s} mean {r['mean_ms']:7.2f} ms  p50 {r['p50_ms']:7.2f} ms  p95 {r['p95_ms']:7.2f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
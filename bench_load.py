@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Benchmark: how many concurrent callers one box can hold
+Runs N simulated callers, each driving AdultChatline.send_message through a
+scripted conversation with think-times and personality switches. By default
+the upstream is a fake GROQ server in a separate process, so no API key or
+network is needed and its CPU is not counted against the chatline.
+
+Usage:
+    python bench_load.py [--callers 50] [--turns 8] [--think-ms 500] [--ttft-ms 200]
+                         [--tokens-per-sec 250] [--base-url URL] [--json out.json]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import threading
+import contextlib
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from chatline import AdultChatline, PersonalityPresets, LINE_BUSY_MESSAGE
+
+
+SCRIPT = [
+    "hey",
+    "I've been thinking about you all day",
+    "tell me what you're wearing right now",
+    "mmm go on",
+    "what would you do if I was there with you tonight?",
+    "slower... describe it",
+    "yes",
+    "I want to hear more about that",
+    "you're making me blush",
+    "don't stop",
+    "what's your favourite fantasy?",
+    "tell me a secret",
+]
+
+LatencySummary = Dict[str, Optional[float]]
+
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def summarize_ms(samples: List[float]) -> LatencySummary:
+    """Mean and p50/p95/p99 of samples in seconds, reported in ms"""
+    if not samples:
+        return {"mean_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    return {
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current RSS, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def free_port() -> int:
+    """Pick an unused local port"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_server(ttft_ms: float, tokens_per_second: float) -> Tuple[subprocess.Popen, str]:
+    """Start fake_groq_server.py in a child process and wait for it to listen"""
+    port = free_port()
+    here = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(here, "fake_groq_server.py"), "--port", str(port),
+         "--ttft-ms", str(ttft_ms), "--tokens-per-sec", str(tokens_per_second)],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("Fake GROQ server did not start")
+
+
+class Caller:
+    """One simulated caller working through the script"""
+
+    def __init__(self, index: int, turns: int, think_ms: float, switch_every: int, seed: int):
+        self.index = index
+        self.turns = turns
+        self.think_ms = think_ms
+        self.switch_every = switch_every
+        self.random = random.Random(seed + index)
+        self.ttft: List[float] = []
+        self.reply: List[float] = []
+        self.tokens = 0
+        self.failures = 0
+
+    def run(self, chatline, personalities: List[Dict[str, str]], start: threading.Event):
+        """Hold a conversation, timing each reply as the caller sees it"""
+        start.wait()
+        # Stagger arrivals so callers do not all speak on the same tick
+        time.sleep(self.random.uniform(0, self.think_ms / 1000))
+        for turn in range(self.turns):
+            if self.switch_every and turn and turn % self.switch_every == 0:
+                chatline.change_personality(self.random.choice(personalities))
+
+            message = SCRIPT[(self.index + turn) % len(SCRIPT)]
+            started = time.perf_counter()
+            first = None
+            chunks = 0
+            for _ in chatline.stream_message(message, sinks=[]):
+                if first is None:
+                    first = time.perf_counter() - started
+                chunks += 1
+            elapsed = time.perf_counter() - started
+
+            reply = chatline.last_reply
+            if reply is None or reply == LINE_BUSY_MESSAGE or reply.startswith("Error:"):
+                self.failures += 1
+            else:
+                self.ttft.append(first if first is not None else elapsed)
+                self.reply.append(elapsed)
+                self.tokens += chunks
+
+            # Think-time: exponential around the mean, like people typing
+            if self.think_ms:
+                time.sleep(self.random.expovariate(1000 / self.think_ms))
+
+
+def run(callers: int, turns: int, think_ms: float, switch_every: int = 4,
+        base_url: Optional[str] = None, ttft_ms: float = 200.0,
+        tokens_per_second: float = 250.0, seed: int = 0) -> Dict:
+    """
+    Run the load test and return its results
+
+    Args:
+        callers: Concurrent simulated callers
+        turns: Messages each caller sends
+        think_ms: Mean think-time between a reply and the next message
+        switch_every: Switch personality every this many turns (0 = never)
+        base_url: Upstream to use (defaults to a fresh fake GROQ server)
+        ttft_ms: Fake server time to first token
+        tokens_per_second: Fake server streaming speed
+        seed: Seed for think-times and personality choices
+
+    Returns:
+        JSON-serializable results
+    """
+    server = None
+    if base_url is None:
+        server, base_url = start_fake_server(ttft_ms, tokens_per_second)
+        os.environ.setdefault("GROQ_API_KEY", "bench")
+    os.environ["GROQ_BASE_URL"] = base_url
+
+    personalities = [
+        PersonalityPresets.FLIRTY,
+        PersonalityPresets.ROMANTIC,
+        PersonalityPresets.ADVENTUROUS,
+        PersonalityPresets.MYSTERIOUS,
+        PersonalityPresets.PLAYFUL
+    ]
+
+    try:
+        rss_before = current_rss()
+        sessions = [AdultChatline(sinks=[]) for _ in range(callers)]
+        rss_idle = current_rss()
+
+        simulated = [Caller(i, turns, think_ms, switch_every, seed) for i in range(callers)]
+        start = threading.Event()
+        threads = [
+            threading.Thread(target=caller.run, args=(chatline, personalities, start), daemon=True)
+            for caller, chatline in zip(simulated, sessions)
+        ]
+        for thread in threads:
+            thread.start()
+
+        cpu_before = time.process_time()
+        started = time.perf_counter()
+        # change_personality() and failed turns print; keep the report readable
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start.set()
+            for thread in threads:
+                thread.join()
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_before
+        rss_after = current_rss()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    ttft = [s for caller in simulated for s in caller.ttft]
+    reply = [s for caller in simulated for s in caller.reply]
+    messages = len(reply)
+    failures = sum(caller.failures for caller in simulated)
+    tokens = sum(caller.tokens for caller in simulated)
+
+    return {
+        "callers": callers,
+        "turns": turns,
+        "think_ms": think_ms,
+        "upstream": "fake" if server is not None else base_url,
+        "wall_seconds": wall,
+        "messages": messages,
+        "failures": failures,
+        "throughput_msgs_per_sec": messages / wall if wall else None,
+        "throughput_tokens_per_sec": tokens / wall if wall else None,
+        "ttft": summarize_ms(ttft),
+        "reply_latency": summarize_ms(reply),
+        "rss_idle_bytes_per_session": (rss_idle - rss_before) / callers if callers else None,
+        "rss_bytes_per_session": (rss_after - rss_before) / callers if callers else None,
+        "cpu_ms_per_message": cpu / messages * 1000 if messages else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--callers", type=int, default=50, help="Concurrent callers")
+    parser.add_argument("--turns", type=int, default=8, help="Messages per caller")
+    parser.add_argument("--think-ms", type=float, default=500.0, help="Mean think-time between turns")
+    parser.add_argument("--switch-every", type=int, default=4,
+                        help="Switch personality every N turns (0 = never)")
+    parser.add_argument("--base-url", help="Use this upstream instead of a local fake server")
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="Fake server time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="Fake server streaming speed")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for think-times and switches")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.callers, args.turns, args.think_ms, args.switch_every, args.base_url,
+                  args.ttft_ms, args.tokens_per_sec, args.seed)
+
+    print(f"{results['callers']} callers x {results['turns']} turns in {results['wall_seconds']:.1f} s "
+          f"({results['failures']} failed)")
+    print(f"  throughput  {results['throughput_msgs_per_sec']:.1f} msgs/s  "
+          f"{results['throughput_tokens_per_sec']:.0f} tokens/s")
+    for name in ("ttft", "reply_latency"):
+        r = results[name]
+        if r["p50_ms"] is not None:
+            print(f"  {name:13s} p50 {r['p50_ms']:8.1f} ms  p95 {r['p95_ms']:8.1f} ms  p99 {r['p99_ms']:8.1f} ms")
+    print(f"  memory      {results['rss_bytes_per_session'] / 1024:.1f} KiB RSS per session")
+    if results["cpu_ms_per_message"] is not None:
+        print(f"  cpu         {results['cpu_ms_per_message']:.2f} ms per message")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
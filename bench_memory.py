@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark: memory held by idle chat session histories
+Compares plain-dict histories with slotted Message histories that share one
+system prompt message per personality. Histories are built from JSON, as a
+restored session's would be, so no strings are shared by accident.
+
+Usage:
+    python bench_memory.py [--sessions 10000] [--turns 0,4,20] [--json out.json]
+"""
+
+import sys
+import json
+import argparse
+import tracemalloc
+from typing import Callable, Dict, List
+
+from chatline import PersonalityPresets
+from messages import Message, system_message
+
+
+PERSONALITIES = [
+    PersonalityPresets.FLIRTY,
+    PersonalityPresets.ROMANTIC,
+    PersonalityPresets.ADVENTUROUS,
+    PersonalityPresets.MYSTERIOUS,
+    PersonalityPresets.PLAYFUL
+]
+
+
+def serialized_history(session: int, turns: int) -> str:
+    """JSON for one session's history"""
+    personality = PERSONALITIES[session % len(PERSONALITIES)]
+    history = [{"role": "system", "content": personality["system_prompt"]}]
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"message {turn} from caller {session}"})
+        history.append({"role": "assistant", "content": f"Mmm, reply {turn} for you, caller {session}..."})
+    return json.dumps(history)
+
+
+def as_dicts(data: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Before: keep the loaded dictionaries"""
+    return data
+
+
+def as_messages(data: List[Dict[str, str]]) -> List[Message]:
+    """After: slotted records, with the system prompt shared per personality"""
+    return [system_message(data[0]["content"])] + [Message.from_dict(m) for m in data[1:]]
+
+
+def bytes_per_session(build: Callable, payloads: List[str]) -> float:
+    """Traced allocations still held per session after building every history"""
+    # Warm the shared system messages so they are not charged to one session
+    for payload in payloads[:len(PERSONALITIES)]:
+        build(json.loads(payload))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [build(json.loads(payload)) for payload in payloads]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del sessions
+    return held / len(payloads)
+
+
+def run(sessions: int, turn_counts: List[int]) -> Dict:
+    """Measure both representations for each history length"""
+    results = {"sessions": sessions, "runs": []}
+    for turns in turn_counts:
+        payloads = [serialized_history(i, turns) for i in range(sessions)]
+        before = bytes_per_session(as_dicts, payloads)
+        after = bytes_per_session(as_messages, payloads)
+        results["runs"].append({
+            "turns": turns,
+            "dict_bytes_per_session": before,
+            "message_bytes_per_session": after,
+            "saved_percent": (1 - after / before) * 100 if before else 0.0,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=10000, help="Sessions per measurement")
+    parser.add_argument("--turns", default="0,4,20", help="Comma-separated history lengths in turns")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.sessions, [int(t) for t in args.turns.split(",")])
+
+    print("Bytes per session over", results["sessions"], "sessions")
+    for r in results["runs"]:
+        print(f"  {r['turns']:3d} turns  dicts {r['dict_bytes_per_session']:9.0f}  "
+              f"messages {r['message_bytes_per_session']:9.0f}  saved {r['saved_percent']:5.1f}%")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Voice Call Tracing for 1-800-PHONESEX
+Records a latency trace for every turn of a voice call: end-of-speech
+detection, STT final transcript, LLM first token and completion, TTS first
+byte and the first audio frame published. Spans are tagged with the room and
+operator and written on a background thread as OTLP/JSON lines, the format
+the OpenTelemetry Collector's otlpjsonfile receiver reads.
+
+Summarize a trace file:
+    python call_trace.py [traces/calls.jsonl] [--json out.json]
+"""
+
+import os
+import sys
+import json
+import math
+import queue
+import atexit
+import argparse
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+# Turn events, roughly in the order they happen
+EVENTS = (
+    "speech_end",       # Caller stopped speaking (VAD)
+    "stt_final",        # Final transcript arrived
+    "llm_start",        # Turn committed, LLM request started
+    "llm_first_token",
+    "llm_done",
+    "tts_start",        # First segment sent to TTS
+    "tts_first_byte",   # First audio back from TTS
+    "audio_published",  # Agent started speaking in the room
+)
+
+# Stage spans: name, start event, end event
+STAGES = (
+    ("end_of_speech", "speech_end", "llm_start"),
+    ("stt_final", "speech_end", "stt_final"),
+    ("llm_first_token", "llm_start", "llm_first_token"),
+    ("llm", "llm_start", "llm_done"),
+    ("tts_first_byte", "tts_start", "tts_first_byte"),
+    ("first_audio", "speech_end", "audio_published"),
+)
+
+SERVICE_NAME = "chatline-voice"
+SCOPE_NAME = "call_trace"
+
+# OTLP span kind INTERNAL
+_KIND_INTERNAL = 1
+
+
+def _attributes(values: Dict[str, object]) -> List[Dict]:
+    """Encode attributes the OTLP/JSON way"""
+    encoded = []
+    for key, value in values.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        else:
+            typed = {"stringValue": str(value)}
+        encoded.append({"key": key, "value": typed})
+    return encoded
+
+
+class TraceExporter:
+    """Appends finished turn traces to a JSONL file on a background thread"""
+
+    _shared: Optional['TraceExporter'] = None
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Open (or create) a trace file
+
+        Args:
+            path: Trace file (CALL_TRACE_FILE, default ./traces/calls.jsonl)
+        """
+        self.path = Path(path or os.getenv("CALL_TRACE_FILE", "./traces/calls.jsonl"))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, daemon=True, name="call-trace")
+        self._writer.start()
+
+    @classmethod
+    def shared(cls) -> Optional['TraceExporter']:
+        """Get the process-wide exporter, or None unless CALL_TRACE is enabled"""
+        if os.getenv("CALL_TRACE", "false").lower() != "true":
+            return None
+        if cls._shared is None:
+            cls._shared = cls()
+            atexit.register(cls._shared.close)
+        return cls._shared
+
+    def export(self, request: Dict):
+        """Queue an OTLP export request (returns immediately)"""
+        self._queue.put(request)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is written"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Write what is queued and stop the writer"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def _run(self):
+        """Writer thread: append queued requests, one per line"""
+        with open(self.path, "a") as f:
+            while True:
+                batch = [self._queue.get()]
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                lines = [json.dumps(item, separators=(",", ":")) + "\n"
+                         for item in batch if isinstance(item, dict)]
+                if lines:
+                    f.write("".join(lines))
+                    f.flush()
+                for item in batch:
+                    if isinstance(item, threading.Event):
+                        item.set()
+                if None in batch:
+                    return
+
+
+class TurnTrace:
+    """Event times of one turn, in Unix nanoseconds"""
+
+    __slots__ = ("number", "events")
+
+    def __init__(self, number: int):
+        self.number = number
+        self.events: Dict[str, int] = {}
+
+    def mark(self, event: str, at: Optional[float] = None):
+        """
+        Record an event the first time it happens
+
+        Args:
+            event: One of EVENTS
+            at: Unix time in seconds (defaults to now)
+        """
+        if event not in self.events:
+            self.events[event] = int(at * 1e9) if at is not None else time.time_ns()
+
+    @property
+    def complete(self) -> bool:
+        """Whether the reply has been generated and started playing"""
+        return "llm_done" in self.events and "audio_published" in self.events
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """Duration of each stage whose start and end were both seen"""
+        return {
+            name: (self.events[end] - self.events[start]) / 1e9
+            for name, start, end in STAGES
+            if start in self.events and end in self.events and self.events[end] >= self.events[start]
+        }
+
+    def to_otlp(self, attributes: Dict[str, object]) -> Dict:
+        """
+        Encode the turn as an OTLP/JSON export request
+
+        The turn is a root span from its first to its last event, with a
+        child span per stage.
+
+        Args:
+            attributes: Tags added to every span
+
+        Returns:
+            ExportTraceServiceRequest as JSON-ready dict
+        """
+        trace_id = os.urandom(16).hex()
+        root_id = os.urandom(8).hex()
+        tags = _attributes(dict(attributes, **{"chatline.turn": self.number}))
+        spans = [{
+            "traceId": trace_id,
+            "spanId": root_id,
+            "name": "turn",
+            "kind": _KIND_INTERNAL,
+            "startTimeUnixNano": str(min(self.events.values())),
+            "endTimeUnixNano": str(max(self.events.values())),
+            "attributes": tags,
+        }]
+        for name, start, end in STAGES:
+            if start in self.events and end in self.events and self.events[end] >= self.events[start]:
+                spans.append({
+                    "traceId": trace_id,
+                    "spanId": os.urandom(8).hex(),
+                    "parentSpanId": root_id,
+                    "name": name,
+                    "kind": _KIND_INTERNAL,
+                    "startTimeUnixNano": str(self.events[start]),
+                    "endTimeUnixNano": str(self.events[end]),
+                    "attributes": tags,
+                })
+        return {"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": SCOPE_NAME}, "spans": spans}],
+        }]}
+
+
+class CallTrace:
+    """
+    Turn traces of one call
+
+    Events are fed in as they happen; a new turn starts when the caller stops
+    speaking (or the LLM starts without that), and a turn is exported once
+    its reply starts playing or the next turn begins.
+    """
+
+    def __init__(self, exporter: TraceExporter, room: str, personality: str):
+        """
+        Initialize call trace
+
+        Args:
+            exporter: Where finished turns go
+            room: LiveKit room name
+            personality: Operator the caller is talking to
+        """
+        self.exporter = exporter
+        self.attributes = {"chatline.room": room, "chatline.personality": personality}
+        self.turns = 0
+        self.current: Optional[TurnTrace] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, room: str, personality: str) -> Optional['CallTrace']:
+        """Begin tracing a call, or None unless CALL_TRACE is enabled"""
+        exporter = TraceExporter.shared()
+        return cls(exporter, room, personality) if exporter is not None else None
+
+    def mark(self, event: str, at: Optional[float] = None):
+        """
+        Record a turn event
+
+        Args:
+            event: One of EVENTS
+            at: Unix time in seconds (defaults to now)
+        """
+        with self._lock:
+            current = self.current
+            if event == "speech_end" or (
+                    event == "llm_start" and (current is None or "llm_start" in current.events)):
+                self._finish()
+                self.turns += 1
+                current = self.current = TurnTrace(self.turns)
+            if current is None:
+                # Audio outside a turn, such as the greeting
+                return
+            current.mark(event, at)
+            if current.complete:
+                self._finish()
+
+    def _finish(self):
+        """Export the current turn (caller holds the lock)"""
+        if self.current is not None and self.current.events:
+            self.exporter.export(self.current.to_otlp(self.attributes))
+        self.current = None
+
+    def close(self):
+        """Export the turn in progress when the call ends"""
+        with self._lock:
+            self._finish()
+
+
+def percentile(samples: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = math.ceil(p / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def summarize(path: str) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Latency per stage across a trace file
+
+    Args:
+        path: Trace file written by TraceExporter
+
+    Returns:
+        Count and p50/p95/p99 in ms per stage
+    """
+    durations: Dict[str, List[float]] = {name: [] for name, _, _ in STAGES}
+    with open(path) as f:
+        for line in f:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            for resource in request.get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    for span in scope.get("spans", []):
+                        if span["name"] in durations:
+                            durations[span["name"]].append(
+                                (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6)
+    return {
+        name: {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 50),
+            "p95_ms": percentile(samples, 95),
+            "p99_ms": percentile(samples, 99),
+        }
+        for name, samples in durations.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("path", nargs="?", default=os.getenv("CALL_TRACE_FILE", "./traces/calls.jsonl"),
+                        help="Trace file")
+    parser.add_argument("--json", help="Write the summary to this JSON file")
+    args = parser.parse_args()
+
+    summary = summarize(args.path)
+    for name, s in summary.items():
+        if s["count"]:
+            print(f"  {name:15s} n={s['count']:<6d} p50 {s['p50_ms']:8.1f} ms  "
+                  f"p95 {s['p95_ms']:8.1f} ms  p99 {s['p99_ms']:8.1f} ms")
+        else:
+            print(f"  {name:15s} n=0")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,203 +7,1106 @@ Provides real-time, streaming adult conversations with multiple sultry operators
 """
 
 import os
+import re
 import sys
-from typing import List, Dict, Optional
-from groq import Groq
-from dotenv import load_dotenv
+import time
+import random
+import threading
+import importlib.util
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple, Iterator, AsyncIterator, Sequence
 
-# Load environment variables
-load_dotenv()
+from client_pool import get_client, get_async_client
+from context_window import ContextWindow, estimate_tokens
+from messages import ChatMessage, Message, system_message, to_api
+from metrics import MetricsRegistry, TurnTimer, REGISTRY
+from model_router import ModelRouter, RouteDecision
+from personalities import PersonalityPresets, PersonalityRegistry
+from rate_limit import UpstreamLimiter, Reservation
+from resilience import CancelToken, GenerationCancelled, ResiliencePolicy, UpstreamUnavailable
+from stream_sinks import StreamSink, SinkGroup, TerminalSink
 
-# Import monetization modules
-try:
-    from user_manager import User, UserManager, FeatureGate
-    from payments import SubscriptionTier, UsageTracker, get_plan_features
-    MONETIZATION_ENABLED = True
-except ImportError:
-    MONETIZATION_ENABLED = False
+# Monetization modules are imported where a user is involved, so sessions
+# without one (and short CLI runs) don't load the payments stack
+MONETIZATION_ENABLED = (importlib.util.find_spec("user_manager") is not None
+                        and importlib.util.find_spec("payments") is not None)
 
+if TYPE_CHECKING:
+    from admission import Admission, AdmissionController
+    from compaction import ConversationCompactor
+    from conversation_log import ConversationLog
+    from transcript_archive import TranscriptArchive
+    from user_manager import User
 
-class PersonalityPresets:
-    """Predefined AI personality presets for different conversation styles"""
+_env_loaded = False
+
+
+def load_env():
+    """Load the .env file into the environment (once; python-dotenv is imported on first call)"""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+
+def feature_enabled(name: str) -> bool:
+    """Whether an opt-in feature flag such as CONVERSATION_LOG is set to true"""
+    return os.getenv(name, "false").lower() == "true"
+
+
+# Shown to the caller when GROQ can't produce a reply after all retries
+LINE_BUSY_MESSAGE = "📞 All our operators are busy right now... give me a moment and try again, sexy."
+
+# Shown to FREE callers turned away while the line is packed
+LINE_FULL_MESSAGE = ("📞 The line is packed tonight, sugar... Premium and VIP callers skip the queue. "
+                     "Call me back in a few minutes?")
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of replies to the opening turns of a session
     
-    FLIRTY = {
-        "name": "Flirty",
-        "system_prompt": "You are a sultry, seductive phone sex operator with years of experience turning callers on. Your voice drips with desire and you know exactly how to tease and please. Be explicitly flirtatious, sensual, and provocative. Use vivid, adult language to describe intimate scenarios. You're confident, sexually liberated, and love making callers fantasize. Build tension with suggestive descriptions and make every word count. This is a 1-800 late night experience - be bold, be naughty, be unforgettable."
-    }
+    Entries are keyed by (personality, model, normalized message, history
+    depth) and hold several reply variants. A key only starts serving hits
+    once it has collected max_variants replies, and hits pick a variant at
+    random so repeat callers don't hear the same line twice in a row.
+    """
     
-    ROMANTIC = {
-        "name": "Romantic",
-        "system_prompt": "You are a passionate, sensual lover who combines deep romance with explicit desire. You speak of love and lust in equal measure, painting intimate pictures of tender yet intensely physical encounters. Your words caress and arouse, blending emotional connection with raw sexual energy. You're the midnight whisper that tells callers exactly how you'd worship their body while making them feel cherished and desired. Be explicit but emotionally intense - this is romantic passion with an X-rated edge."
-    }
+    _shared: Optional['ResponseCache'] = None
     
-    ADVENTUROUS = {
-        "name": "Adventurous",
-        "system_prompt": "You are a wild, uninhibited phone sex operator who specializes in kinky fantasies and taboo desires. Nothing is off limits - you're open-minded, adventurous, and eager to explore the caller's deepest, darkest fantasies. Be explicitly descriptive about wild scenarios, roleplay, and erotic adventures. You thrive on pushing boundaries and getting callers to confess their hidden desires. Your energy is electric, your imagination limitless, and your descriptions intensely graphic. This is the kinky hotline where fantasies come alive."
-    }
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600.0,
+                 max_bytes: int = 4 * 1024 * 1024, max_variants: int = 3,
+                 max_depth: int = 0):
+        """
+        Initialize response cache
+        
+        Args:
+            max_entries: Maximum number of keys kept
+            ttl_seconds: Seconds an entry stays valid after it is created
+            max_bytes: Maximum total size of cached replies (UTF-8 bytes)
+            max_variants: Reply variants collected per key before serving hits
+            max_depth: Deepest conversation position (messages already
+                exchanged) that is cached; 0 caches only the opening message
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_variants = max_variants
+        self.max_depth = max_depth
+        
+        self.hits = 0
+        self.misses = 0
+        self.size_bytes = 0
+        
+        # key -> {"created": timestamp, "variants": [reply, ...], "bytes": size}
+        self._entries: 'OrderedDict[Tuple, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
     
-    MYSTERIOUS = {
-        "name": "Mysterious",
-        "system_prompt": "You are an enigmatic seductress who operates in shadows and whispers. Your sultry voice hints at forbidden pleasures and secret desires. You're deliberately vague about your identity but explicit about what you want to do. Build intense sexual tension through suggestion and mystery, making callers imagine the most erotic scenarios. You're the fantasy they can't quite grasp but desperately crave. Use sensual, provocative language that leaves them aching for more. You're the late-night mystery that haunts their dreams."
-    }
+    @classmethod
+    def shared(cls) -> 'ResponseCache':
+        """Get the process-wide cache configured from the environment"""
+        if cls._shared is None:
+            cls._shared = cls(
+                max_entries=int(os.getenv("RESPONSE_CACHE_ENTRIES", "512")),
+                ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+                max_variants=int(os.getenv("RESPONSE_CACHE_VARIANTS", "3")),
+            )
+        return cls._shared
+    
+    @staticmethod
+    def normalize(message: str) -> str:
+        """Normalize a message so trivial variations share a key"""
+        message = re.sub(r"[^\w\s]", "", message.lower())
+        return " ".join(message.split())
+    
+    def make_key(self, personality_name: str, model: str, message: str,
+                 depth: int) -> Optional[Tuple]:
+        """
+        Build the cache key for a message
+        
+        Returns:
+            Cache key, or None if the message is not cacheable
+        """
+        if depth > self.max_depth:
+            return None
+        normalized = self.normalize(message)
+        if not normalized:
+            return None
+        return (personality_name, model, normalized, depth)
     
-    PLAYFUL = {
-        "name": "Playful",
-        "system_prompt": "You are a naughty, giggling phone sex operator who treats every call like sexy playtime. You're mischievous, cheeky, and love dirty talk with a playful twist. Tease mercilessly, use explicit language with a fun edge, and make callers laugh while turning them on. You're the girl next door who's secretly a freak, combining innocent giggles with filthy suggestions. Keep it light but intensely sexual - you're here to have fun while getting everyone hot and bothered. Think sexy pillow talk meets dirty jokes."
-    }
+    def get(self, key: Tuple) -> Optional[str]:
+        """
+        Get a cached reply
+        
+        Args:
+            key: Cache key from make_key
+        
+        Returns:
+            A random reply variant, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry["created"] > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            
+            if entry is None or len(entry["variants"]) < self.max_variants:
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry["variants"])
+    
+    def put(self, key: Tuple, reply: str):
+        """
+        Add a reply variant for a key
+        
+        Args:
+            key: Cache key from make_key
+            reply: Model reply to cache
+        """
+        size = len(reply.encode("utf-8"))
+        if not reply or size > self.max_bytes:
+            return
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {"created": time.monotonic(), "variants": [], "bytes": 0}
+                self._entries[key] = entry
+            if len(entry["variants"]) >= self.max_variants or reply in entry["variants"]:
+                return
+            
+            entry["variants"].append(reply)
+            entry["bytes"] += size
+            self.size_bytes += size
+            self._entries.move_to_end(key)
+            
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self.size_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+    
+    def _remove(self, key: Tuple):
+        """Remove an entry (caller holds the lock)"""
+        entry = self._entries.pop(key)
+        self.size_bytes -= entry["bytes"]
+    
+    def clear(self):
+        """Remove all entries and reset counters"""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+    
+    def get_stats(self) -> Dict:
+        """Get cache statistics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+class _Turn:
+    """Upstream state of one turn: its timer, model, generation slot and quota reservation"""
+    
+    __slots__ = ("timer", "model", "admission", "reservation", "prompt_tokens")
+    
+    def __init__(self, timer: TurnTimer, model: str):
+        self.timer = timer
+        self.model = model
+        self.admission: Optional['Admission'] = None
+        self.reservation: Optional[Reservation] = None
+        self.prompt_tokens = 0
 
 
 class AdultChatline:
     """Main chatline application with GROQ integration"""
     
-    def __init__(self, user: Optional['User'] = None):
-        """Initialize the chatline with GROQ API"""
+    # Whether __init__ rebuilds a session's history from the conversation log
+    resume_on_init = True
+    
+    def __init__(self, user: Optional['User'] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 sinks: Optional[Sequence[StreamSink]] = None,
+                 metrics: Optional[MetricsRegistry] = None,
+                 limiter: Optional[UpstreamLimiter] = None,
+                 session_id: Optional[str] = None,
+                 log: Optional['ConversationLog'] = None,
+                 archive: Optional['TranscriptArchive'] = None,
+                 personalities: Optional[PersonalityRegistry] = None,
+                 admission: Optional['AdmissionController'] = None):
+        """
+        Initialize the chatline with GROQ API
+        
+        Args:
+            user: Optional user for monetization checks
+            response_cache: Cache for opening-turn replies (defaults to the
+                shared cache when RESPONSE_CACHE is enabled)
+            sinks: Default sinks for streamed replies (defaults to the terminal)
+            metrics: Registry for turn latency metrics (defaults to the
+                process-wide registry)
+            limiter: Upstream quota limiter (defaults to the process-wide one)
+            session_id: Id under which turns are written to the conversation
+                log; an existing session's history is resumed from it (on
+                the first message for AsyncAdultChatline)
+            log: Conversation log (defaults to the shared one when
+                CONVERSATION_LOG is enabled)
+            archive: Transcript archive for finished calls (defaults to the
+                shared one when TRANSCRIPT_ARCHIVE is enabled)
+            personalities: Personality registry (defaults to the shared one)
+            admission: Tier-priority admission control for generation slots
+                (defaults to the process-wide one)
+        """
+        load_env()
         self.api_key = os.getenv("GROQ_API_KEY")
         if not self.api_key:
             raise ValueError(
                 "GROQ_API_KEY not found. Please set it in your .env file or environment variables."
             )
+        # Point at a compatible server (e.g. fake_groq_server.py) instead of GROQ
+        self.base_url = os.getenv("GROQ_BASE_URL") or None
         
-        self.client = Groq(api_key=self.api_key)
+        # Created on first use, so starting up makes no network or SDK setup
+        self._client = None
         self.model = os.getenv("AI_MODEL", "llama-3.1-70b-versatile")
         self.temperature = float(os.getenv("TEMPERATURE", "0.8"))
         self.max_tokens = int(os.getenv("MAX_TOKENS", "1024"))
+        self.context_window = ContextWindow(self.model, self.max_tokens)
+        self.limiter = limiter or UpstreamLimiter.shared()
+        # Admission and compaction are set up on the first turn that needs them
+        self._admission = admission
+        self._compactor: Optional['ConversationCompactor'] = None
+        self._pending_compaction = None
+        
+        if response_cache is None and feature_enabled("RESPONSE_CACHE"):
+            response_cache = ResponseCache.shared()
+        self.response_cache = response_cache
+        
+        self.sinks: List[StreamSink] = list(sinks) if sinks is not None else [TerminalSink()]
+        self.last_reply: Optional[str] = None
         
-        self.conversation_history: List[Dict[str, str]] = []
-        self.current_personality = PersonalityPresets.FLIRTY
+        self.metrics = metrics
+        self.resilience = ResiliencePolicy(metrics=metrics)
+        self.router = ModelRouter(self.model, metrics=metrics)
+        self._turn_model = self.model
+        self._cancel: Optional[CancelToken] = None
+        
+        self.conversation_history: List[ChatMessage] = []
+        self.personalities = personalities or PersonalityRegistry.shared()
+        self.current_personality = self.personalities.default()
         
         # Monetization integration
         self.user = user
-        self.usage_tracker = UsageTracker() if MONETIZATION_ENABLED else None
+        self.usage_tracker = None
+        if MONETIZATION_ENABLED and user is not None:
+            from payments import UsageTracker
+            self.usage_tracker = UsageTracker()
         
         # Initialize conversation with system prompt
         self._set_system_prompt()
+        
+        self.session_id = session_id
+        # The log and archive modules are only imported when the feature is on
+        if log is None and feature_enabled("CONVERSATION_LOG"):
+            from conversation_log import ConversationLog
+            log = ConversationLog.shared()
+        if archive is None and feature_enabled("TRANSCRIPT_ARCHIVE"):
+            from transcript_archive import TranscriptArchive
+            archive = TranscriptArchive.shared()
+        self.log = log
+        self.archive = archive
+        # Set until the history has been rebuilt from the log (or replaced)
+        self._resume_pending = bool(self.session_id and self.log is not None)
+        if self._resume_pending and self.resume_on_init:
+            self.resume()
+    
+    @property
+    def client(self):
+        """The shared, connection-pooled GROQ client unless overridden"""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+    
+    @client.setter
+    def client(self, value):
+        self._client = value
+    
+    @property
+    def admission(self) -> 'AdmissionController':
+        """Admission control for generation slots (the process-wide one unless given)"""
+        if self._admission is None:
+            from admission import AdmissionController
+            self._admission = AdmissionController.shared()
+        return self._admission
+    
+    @admission.setter
+    def admission(self, value: 'AdmissionController'):
+        self._admission = value
+    
+    @property
+    def compactor(self) -> 'ConversationCompactor':
+        """Background summarizer for long histories"""
+        if self._compactor is None:
+            from compaction import ConversationCompactor
+            self._compactor = ConversationCompactor(limiter=self.limiter)
+        return self._compactor
+    
+    @compactor.setter
+    def compactor(self, value: 'ConversationCompactor'):
+        self._compactor = value
+    
+    def _create_client(self):
+        """Get the shared, connection-pooled GROQ client"""
+        return get_client(self.api_key, self.base_url)
     
     def _set_system_prompt(self):
         """Set the system prompt for the current personality"""
-        self.conversation_history = [
-            {
-                "role": "system",
-                "content": self.current_personality["system_prompt"]
-            }
-        ]
+        # One system message is shared by every session with this personality
+        self.conversation_history = [system_message(self.current_personality["system_prompt"])]
+        self.call_started = time.time()
     
     def change_personality(self, personality: Dict[str, str]):
         """Change the AI personality and reset conversation"""
         # Check if user has access to this personality
         if MONETIZATION_ENABLED and self.user:
-            if not FeatureGate.check_personality_access(self.user, personality['name']):
+            from user_manager import FeatureGate
+            if personality.get("owner") is not None:
+                if (personality["owner"] != self.user.user_id
+                        or not FeatureGate.check_custom_personality_access(self.user)):
+                    print(f"\n{FeatureGate.get_upgrade_prompt(self.user, 'custom')}")
+                    return
+            elif not FeatureGate.check_personality_access(self.user, personality['name']):
                 print(f"\n{FeatureGate.get_upgrade_prompt(self.user, 'personality')}")
                 return
         
+        self.archive_transcript()
         self.current_personality = personality
         print(f"\n💋 Switching you to {personality['name']}...")
         print("Let's start fresh and get to know each other...\n")
         self._set_system_prompt()
+        self._log_reset()
     
-    def send_message(self, user_message: str, stream: bool = True) -> str:
+    def _check_access(self, stream: bool) -> Tuple[Optional[str], bool]:
         """
-        Send a message and get AI response
+        Run the monetization checks for an incoming message
+        
+        The checks only touch in-memory plan data and usage counters, so
+        they are safe to call inline from both the sync and async paths.
         
         Args:
-            user_message: The user's message
-            stream: Whether to stream the response (default: True)
+            stream: Whether the caller asked for a streamed response
         
         Returns:
-            The AI's response
+            Tuple of (upgrade prompt if the message is rejected, stream flag
+            after applying the user's plan)
         """
+        if not (MONETIZATION_ENABLED and self.user):
+            return None, stream
+        from user_manager import FeatureGate
+        
         # Check usage limits if monetization is enabled
-        if MONETIZATION_ENABLED and self.user and self.usage_tracker:
+        if self.usage_tracker:
             user_id = self.user.user_id
-            limit = self.user.get_daily_message_limit()
             current_usage = self.usage_tracker.get_usage(user_id)
             
             if not FeatureGate.check_message_limit(self.user, current_usage):
-                return FeatureGate.get_upgrade_prompt(self.user, 'limit')
+                return FeatureGate.get_upgrade_prompt(self.user, 'limit'), stream
             
             # Track this message
             self.usage_tracker.track_message(user_id)
         
         # Check streaming access
-        if stream and MONETIZATION_ENABLED and self.user:
+        if stream:
             if not FeatureGate.check_streaming_access(self.user):
                 print(f"\n{FeatureGate.get_upgrade_prompt(self.user, 'streaming')}")
                 stream = False
         
-        # Add user message to history
-        self.conversation_history.append({
-            "role": "user",
-            "content": user_message
-        })
-        
-        try:
-            if stream:
-                return self._stream_response()
-            else:
-                return self._get_response()
-        except Exception as e:
-            error_msg = f"Error: {str(e)}"
-            print(error_msg)
-            return error_msg
+        return None, stream
+    
+    def _maybe_compact(self):
+        """Start summarizing old turns in the background once history is long"""
+        self._apply_compaction()
+        if self._pending_compaction is None:
+            self._pending_compaction = self.compactor.submit(self.client, self.conversation_history)
+    
+    def _apply_compaction(self):
+        """Fold a finished background summary into the history, never waiting on one"""
+        pending = self._pending_compaction
+        if pending is None or not pending.done():
+            return
+        self._pending_compaction = None
+        if pending.cancelled() or pending.exception() is not None:
+            return
+        batch, summary = pending.result()
+        if self.compactor.apply(self.conversation_history, batch, summary) and self._logging:
+            # Everything after the system prompt and the new summary was kept
+            self.log.compact(self.session_id, summary, len(self.conversation_history) - 2)
+    
+    def _cache_key(self, user_message: str) -> Optional[Tuple]:
+        """Get the response cache key for a message about to be sent"""
+        # Custom personalities share names across callers, so never cache them
+        if self.response_cache is None or self.current_personality.get("owner") is not None:
+            return None
+        return self.response_cache.make_key(
+            self.current_personality["name"],
+            self.model,
+            user_message,
+            self.get_conversation_length()
+        )
+    
+    def _record_exchange(self, user_message: str, reply: str):
+        """Record a reply that was served without calling the model"""
+        self.conversation_history.append(Message("user", user_message))
+        self.conversation_history.append(Message("assistant", reply))
+        self._log_turn(user_message, reply)
+    
+    def _start_turn(self) -> _Turn:
+        """Start a turn, timed with operator, model and plan labels"""
+        tier = self.user.subscription_tier.value if self.user else "anonymous"
+        timer = TurnTimer(
+            self.metrics,
+            personality=self.current_personality["name"],
+            model=self.model,
+            tier=tier
+        )
+        return _Turn(timer, self.model)
+    
+    def _route(self, turn: _Turn, user_message: str) -> RouteDecision:
+        """Choose the model for this turn"""
+        tier = self.user.subscription_tier.value if self.user else "anonymous"
+        decision = self.router.route(
+            user_message,
+            self.get_conversation_length(),
+            self.current_personality["name"],
+            tier
+        )
+        self._turn_model = turn.model = decision.model
+        turn.timer.labels["model"] = decision.model
+        return decision
     
-    def _stream_response(self) -> str:
-        """Stream the AI response in real-time"""
-        response_text = ""
+    def _hedge_after(self, turn: _Turn) -> Optional[float]:
+        """Seconds to wait for a first token before hedging the request"""
+        registry = self.metrics or REGISTRY
+        ttft = registry.histogram("chat_ttft_seconds", **turn.timer.labels)
+        return self.resilience.hedge_after(ttft)
+    
+    def _fail_turn(self, user_entry: Message, error: Exception) -> str:
+        """Drop the unanswered message from history and describe the failure"""
+        if self.conversation_history and self.conversation_history[-1] is user_entry:
+            self.conversation_history.pop()
+        from admission import LoadShed
+        if isinstance(error, LoadShed):
+            return LINE_FULL_MESSAGE
+        if isinstance(error, UpstreamUnavailable):
+            return LINE_BUSY_MESSAGE
+        return f"Error: {str(error)}"
+    
+    def cancel(self) -> bool:
+        """
+        Stop the reply being generated, keeping what was already said
         
-        print("AI: ", end="", flush=True)
+        Safe to call from another thread, e.g. when the caller hangs up.
         
-        stream = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.conversation_history,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            stream=True
+        Returns:
+            True if a reply was in flight
+        """
+        token = self._cancel
+        if token is None:
+            return False
+        token.cancel()
+        return True
+    
+    def _interrupt_turn(self, turn: _Turn, user_entry: Message, chunks: List[str]) -> str:
+        """Record the part of an interrupted reply the caller already got"""
+        partial = "".join(chunks)
+        self._settle(turn, partial)
+        self.last_reply = partial
+        self._log_turn(user_entry.content, partial)
+        if partial:
+            # Another turn may have started meanwhile; keep the pair together
+            for index in range(len(self.conversation_history) - 1, 0, -1):
+                if self.conversation_history[index] is user_entry:
+                    self.conversation_history.insert(index + 1, Message("assistant", partial))
+                    break
+        (self.metrics or REGISTRY).increment(
+            "chat_turns_cancelled_total", personality=self.current_personality["name"]
         )
+        return partial
+    
+    @property
+    def _logging(self) -> bool:
+        """Whether turns are written to the conversation log"""
+        return self.log is not None and bool(self.session_id)
+    
+    def _log_turn(self, user_message: str, reply: str):
+        """Queue a finished turn for the conversation log (never blocks)"""
+        if self._logging:
+            self.log.append(self.session_id, "user", user_message)
+            if reply:
+                self.log.append(self.session_id, "assistant", reply)
+    
+    def _log_reset(self):
+        """Mark a cleared history or new personality in the conversation log"""
+        self._resume_pending = False
+        if self._logging:
+            self.log.reset(self.session_id, self.current_personality["name"])
+    
+    def resume(self) -> bool:
+        """
+        Rebuild the history from the conversation log
         
-        for chunk in stream:
-            if chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                print(content, end="", flush=True)
-                response_text += content
+        Only the session's newest records are read (up to
+        CONVERSATION_RESUME_MESSAGES, default 200).
         
-        print()  # New line after streaming
+        Returns:
+            True if the log had a history for this session
+        """
+        self._resume_pending = False
+        if not self._logging:
+            return False
+        return self._restore(self.log.read_session(self.session_id, max_messages=self._resume_limit()))
+    
+    @staticmethod
+    def _resume_limit() -> int:
+        """Newest log records read when resuming"""
+        return int(os.getenv("CONVERSATION_RESUME_MESSAGES", "200"))
+    
+    def _restore(self, tail) -> bool:
+        """Replace the history with a session tail read from the log"""
+        if tail is None:
+            return False
         
-        # Add assistant response to history
-        self.conversation_history.append({
-            "role": "assistant",
-            "content": response_text
-        })
+        self.current_personality = (self.personalities.get(tail.personality, self._user_id)
+                                    or self.personalities.default())
+        self._set_system_prompt()
+        if tail.summary is not None:
+            from compaction import SUMMARY_PREFIX
+            self.conversation_history.append(Message("system", SUMMARY_PREFIX + tail.summary))
+        messages = tail.messages
+        # A cut-off tail should not open on a reply to a message we dropped
+        while messages and messages[0][0] == "assistant" and tail.summary is None:
+            messages = messages[1:]
+        self.conversation_history.extend(Message(role, content) for role, content in messages)
+        return True
+    
+    @property
+    def _tier(self) -> str:
+        """Subscription tier used for admission (callers without a user queue as FREE)"""
+        return self.user.subscription_tier.value if self.user else "free"
+    
+    def _reserve(self, turn: _Turn, messages: List[Dict[str, str]]):
+        """Wait for a generation slot, then for upstream quota covering the prompt and max_tokens"""
+        turn.admission = self.admission.acquire(self._tier)
+        turn.prompt_tokens = self.context_window.total_tokens(messages)
+        turn.reservation = self.limiter.acquire(turn.prompt_tokens + self.max_tokens)
+    
+    async def _reserve_async(self, turn: _Turn, messages: List[Dict[str, str]]):
+        """Wait for a slot and upstream quota without blocking the event loop"""
+        turn.admission = await self.admission.acquire_async(self._tier)
+        turn.prompt_tokens = self.context_window.total_tokens(messages)
+        turn.reservation = await self.limiter.acquire_async(turn.prompt_tokens + self.max_tokens)
+    
+    def _settle(self, turn: _Turn, reply_text: str):
+        """Free the turn's generation slot and refund the quota the reply didn't use"""
+        if turn.admission is not None:
+            turn.admission.release()
+            turn.admission = None
+        if turn.reservation is not None:
+            turn.reservation.settle(turn.prompt_tokens + estimate_tokens(reply_text))
+            turn.reservation = None
+    
+    def _request_messages(self, turn: Optional[_Turn] = None) -> List[Dict[str, str]]:
+        """Get the history trimmed to the prompt token budget, in API format"""
+        build_started = time.perf_counter()
+        messages = to_api(self.context_window.select(self.conversation_history))
+        if turn is not None:
+            turn.timer.request_built(build_started)
+        return messages
+    
+    def send_message(self, user_message: str, stream: bool = True,
+                     sinks: Optional[Sequence[StreamSink]] = None) -> str:
+        """
+        Send a message and get AI response
         
-        return response_text
+        Args:
+            user_message: The user's message
+            stream: Whether to stream the response (default: True)
+            sinks: Sinks receiving the reply (defaults to the chatline's
+                sinks when streaming, none otherwise)
+        
+        Returns:
+            The AI's response
+        """
+        if sinks is None:
+            sinks = self.sinks if stream else []
+        for _ in self.stream_message(user_message, sinks=sinks, stream=stream):
+            pass
+        return self.last_reply
     
-    def _get_response(self) -> str:
-        """Get the AI response without streaming"""
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.conversation_history,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            stream=False
-        )
+    def stream_message(self, user_message: str, sinks: Optional[Sequence[StreamSink]] = None,
+                       stream: bool = True) -> Iterator[str]:
+        """
+        Send a message and yield the reply as it is generated
         
-        response_text = response.choices[0].message.content
+        Every delta is also dispatched to the sinks, and the complete reply
+        is available as last_reply once the iterator is exhausted.
+        
+        Args:
+            user_message: The user's message
+            sinks: Sinks receiving the reply (defaults to the chatline's sinks)
+            stream: Whether to stream from the model; if False (or the plan
+                has no streaming) the reply arrives as a single delta
+        
+        Yields:
+            Reply text deltas
+        """
+        # A new message interrupts a reply still streaming in this session
+        self.cancel()
+        out = SinkGroup(self.sinks if sinks is None else sinks)
+        turn = self._start_turn()
+        timer = turn.timer
+        
+        rejection, stream = self._check_access(stream)
+        timer.gate_done()
+        if rejection:
+            self.last_reply = rejection
+            out.whole(rejection)
+            yield rejection
+            return
+        
+        self._apply_compaction()
+        
+        cache_key = self._cache_key(user_message)
+        cached = self.response_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            self._record_exchange(user_message, cached)
+            self.last_reply = cached
+            out.whole(cached)
+            yield cached
+            return
+        
+        decision = self._route(turn, user_message)
+        
+        # Add user message to history
+        user_entry = Message("user", user_message)
+        self.conversation_history.append(user_entry)
+        
+        chunks: List[str] = []
+        cancel = self._cancel = CancelToken()
+        deltas = None
+        try:
+            out.start()
+            deltas = self._stream_response(turn) if stream else iter((self._get_response(turn),))
+            for content in deltas:
+                timer.token()
+                chunks.append(content)
+                out.delta(content)
+                yield content
+        except GenerationCancelled:
+            timer.finish()
+            out.end(self._interrupt_turn(turn, user_entry, chunks))
+            return
+        except KeyboardInterrupt:
+            # Ctrl-C in the CLI stops the reply; the caller decides what's next
+            timer.finish()
+            out.end(self._interrupt_turn(turn, user_entry, chunks))
+            raise
+        except GeneratorExit:
+            # The consumer went away (e.g. the web client disconnected)
+            timer.finish()
+            self._interrupt_turn(turn, user_entry, chunks)
+            raise
+        except Exception as e:
+            timer.finish()
+            self._settle(turn, "".join(chunks))
+            error_msg = self._fail_turn(user_entry, e)
+            self.last_reply = error_msg
+            out.error(error_msg)
+            if not out.sinks:
+                print(error_msg)
+            return
+        finally:
+            # Closing the delta stream closes the upstream HTTP stream
+            if hasattr(deltas, "close"):
+                deltas.close()
+            if self._cancel is cancel:
+                self._cancel = None
+        
+        timer.finish()
+        self.router.record(decision, timer.tokens)
+        response_text = "".join(chunks)
+        self._settle(turn, response_text)
+        self.last_reply = response_text
         
         # Add assistant response to history
-        self.conversation_history.append({
-            "role": "assistant",
-            "content": response_text
-        })
+        self.conversation_history.append(Message("assistant", response_text))
+        self._log_turn(user_message, response_text)
+        out.end(response_text)
         
-        return response_text
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response_text)
+        self._maybe_compact()
+    
+    def _stream_response(self, turn: _Turn) -> Iterator[str]:
+        """Stream the AI response as an iterator of text deltas"""
+        messages = self._request_messages(turn)
+        self._reserve(turn, messages)
+        turn.timer.sent()
+        
+        def open_stream():
+            return self.client.chat.completions.create(
+                model=turn.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True
+            )
+        
+        return self.resilience.stream(
+            open_stream, hedge_after=self._hedge_after(turn), labels=dict(turn.timer.labels),
+            cancel=self._cancel, limiter=self.limiter, prompt_tokens=turn.prompt_tokens
+        )
+    
+    def _get_response(self, turn: _Turn) -> str:
+        """Get the AI response without streaming"""
+        messages = self._request_messages(turn)
+        self._reserve(turn, messages)
+        turn.timer.sent()
+        
+        response = self.resilience.call(
+            lambda: self.client.chat.completions.create(
+                model=turn.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=False
+            ),
+            hedge_after=self._hedge_after(turn),
+            labels=dict(turn.timer.labels),
+            limiter=self.limiter,
+            prompt_tokens=turn.prompt_tokens
+        )
+        
+        return response.choices[0].message.content
     
     def clear_history(self):
         """Clear conversation history but keep system prompt"""
         print("\n🔥 Starting a fresh fantasy session...\n")
+        self.archive_transcript()
         self._set_system_prompt()
+        self._log_reset()
     
     def get_conversation_length(self) -> int:
         """Get the number of messages in conversation (excluding system prompt)"""
         return len(self.conversation_history) - 1
+    
+    @property
+    def _user_id(self) -> Optional[str]:
+        """Caller's user id, used to find their custom personalities"""
+        return self.user.user_id if self.user else None
+    
+    def archive_transcript(self) -> Optional[str]:
+        """
+        Queue the current call's transcript for the archive
+        
+        Called when the history is about to be reset and when the caller
+        hangs up; only enqueues, compression happens in the background.
+        
+        Returns:
+            Transcript id, or None if archiving is off or nothing was said
+        """
+        if self.archive is None or not self.get_conversation_length():
+            return None
+        return self.archive.archive(
+            [(m["role"], m["content"]) for m in self.conversation_history[1:]],
+            user_id=self._user_id or self.session_id,
+            personality=self.current_personality["name"],
+            started_at=self.call_started
+        )
+    
+    def get_state(self) -> Dict:
+        """
+        Get the session state needed to resume it later
+        
+        Returns:
+            JSON-serializable state: personality, model settings and the
+            history after the system prompt as [role, content] pairs
+        """
+        self._apply_compaction()
+        personality = self.current_personality
+        state = {
+            "personality": personality["name"],
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "history": [[m["role"], m["content"]] for m in self.conversation_history[1:]],
+        }
+        # Registered personalities are looked up by name; anything else
+        # (including one edited since the session started) travels with the state
+        if self.personalities.get(personality["name"], self._user_id) is not personality:
+            state["system_prompt"] = personality["system_prompt"]
+        return state
+    
+    def load_state(self, state: Dict):
+        """
+        Resume a session from get_state() output, without greeting the caller
+        
+        Args:
+            state: Saved session state
+        """
+        self._resume_pending = False
+        personality = self.personalities.get(state["personality"], self._user_id)
+        if "system_prompt" in state or personality is None:
+            personality = {
+                "name": state["personality"],
+                "system_prompt": state.get("system_prompt", self.personalities.default()["system_prompt"])
+            }
+        self.current_personality = personality
+        
+        self.model = state.get("model", self.model)
+        self.temperature = state.get("temperature", self.temperature)
+        max_tokens = state.get("max_tokens", self.max_tokens)
+        if max_tokens != self.max_tokens or self.model != self.context_window.model:
+            self.max_tokens = max_tokens
+            self.context_window = ContextWindow(self.model, self.max_tokens)
+        self.router.large_model = self.model
+        self._turn_model = self.model
+        self._pending_compaction = None
+        
+        self.conversation_history = [system_message(personality["system_prompt"])]
+        self.conversation_history.extend(Message(role, content) for role, content in state["history"])
+
+
+class AsyncAdultChatline(AdultChatline):
+    """
+    Asyncio variant of the chatline built on the async GROQ client
+    
+    send_message is a coroutine and responses are consumed as an async
+    iterator, so a single event loop can serve many concurrent sessions
+    without holding an OS thread per in-flight completion. Await
+    client_pool.close_async_clients() before the loop ends to close the
+    loop's shared client.
+    
+    Resuming from the conversation log reads files, so it is not done in
+    __init__; the history is rebuilt on the first message, or earlier by
+    awaiting resume_async().
+    """
+    
+    resume_on_init = False
+    
+    @property
+    def client(self):
+        """The async GROQ client, shared per event loop unless overridden"""
+        if self._client is not None:
+            return self._client
+        return get_async_client(self.api_key, self.base_url)
+    
+    @client.setter
+    def client(self, value):
+        self._client = value
+    
+    def _create_client(self):
+        """Resolve the shared async client lazily, on the loop that uses it"""
+        return None
+    
+    async def resume_async(self) -> bool:
+        """Async version of resume(), reading the log on a worker thread"""
+        import asyncio
+        self._resume_pending = False
+        if not self._logging:
+            return False
+        tail = await asyncio.to_thread(self.log.read_session, self.session_id,
+                                       max_messages=self._resume_limit())
+        return self._restore(tail)
+    
+    def _maybe_compact(self):
+        """Start summarizing old turns in a background task once history is long"""
+        self._apply_compaction()
+        if self._pending_compaction is None:
+            self._pending_compaction = self.compactor.submit_async(self.client, self.conversation_history)
+    
+    async def send_message(self, user_message: str, stream: bool = True,
+                           sinks: Optional[Sequence[StreamSink]] = None) -> str:
+        """
+        Send a message and get AI response without blocking the event loop
+        
+        Args:
+            user_message: The user's message
+            stream: Whether to stream the response (default: True)
+            sinks: Sinks receiving the reply (defaults to the chatline's
+                sinks when streaming, none otherwise)
+        
+        Returns:
+            The AI's response
+        """
+        if sinks is None:
+            sinks = self.sinks if stream else []
+        async for _ in self.stream_message(user_message, sinks=sinks, stream=stream):
+            pass
+        return self.last_reply
+    
+    async def stream_message(self, user_message: str, sinks: Optional[Sequence[StreamSink]] = None,
+                             stream: bool = True) -> AsyncIterator[str]:
+        """
+        Send a message and yield the reply as it is generated
+        
+        Every delta is also dispatched to the sinks (awaiting async sinks),
+        and the complete reply is available as last_reply once the iterator
+        is exhausted.
+        
+        Args:
+            user_message: The user's message
+            sinks: Sinks receiving the reply (defaults to the chatline's sinks)
+            stream: Whether to stream from the model; if False (or the plan
+                has no streaming) the reply arrives as a single delta
+        
+        Yields:
+            Reply text deltas
+        """
+        import asyncio
+        # A new message interrupts a reply still streaming in this session
+        self.cancel()
+        if self._resume_pending:
+            await self.resume_async()
+        out = SinkGroup(self.sinks if sinks is None else sinks)
+        turn = self._start_turn()
+        timer = turn.timer
+        
+        rejection, stream = self._check_access(stream)
+        timer.gate_done()
+        if rejection:
+            self.last_reply = rejection
+            await out.awhole(rejection)
+            yield rejection
+            return
+        
+        self._apply_compaction()
+        
+        cache_key = self._cache_key(user_message)
+        cached = self.response_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            self._record_exchange(user_message, cached)
+            self.last_reply = cached
+            await out.awhole(cached)
+            yield cached
+            return
+        
+        decision = self._route(turn, user_message)
+        
+        # Add user message to history
+        user_entry = Message("user", user_message)
+        self.conversation_history.append(user_entry)
+        
+        chunks: List[str] = []
+        cancel = self._cancel = CancelToken()
+        deltas = None
+        try:
+            await out.astart()
+            if stream:
+                deltas = self._stream_response(turn)
+                async for content in deltas:
+                    timer.token()
+                    chunks.append(content)
+                    await out.adelta(content)
+                    yield content
+            else:
+                content = await self._get_response(turn)
+                timer.token()
+                chunks.append(content)
+                await out.adelta(content)
+                yield content
+        except GenerationCancelled:
+            timer.finish()
+            await out.aend(self._interrupt_turn(turn, user_entry, chunks))
+            return
+        except (asyncio.CancelledError, GeneratorExit):
+            # The task was cancelled or the consumer went away mid-reply
+            timer.finish()
+            self._interrupt_turn(turn, user_entry, chunks)
+            raise
+        except Exception as e:
+            timer.finish()
+            self._settle(turn, "".join(chunks))
+            error_msg = self._fail_turn(user_entry, e)
+            self.last_reply = error_msg
+            await out.aerror(error_msg)
+            if not out.sinks:
+                print(error_msg)
+            return
+        finally:
+            # Closing the delta stream closes the upstream HTTP stream
+            if hasattr(deltas, "aclose"):
+                await deltas.aclose()
+            if self._cancel is cancel:
+                self._cancel = None
+        
+        timer.finish()
+        self.router.record(decision, timer.tokens)
+        response_text = "".join(chunks)
+        self._settle(turn, response_text)
+        self.last_reply = response_text
+        
+        # Add assistant response to history
+        self.conversation_history.append(Message("assistant", response_text))
+        self._log_turn(user_message, response_text)
+        await out.aend(response_text)
+        
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response_text)
+        self._maybe_compact()
+    
+    async def _stream_response(self, turn: _Turn) -> AsyncIterator[str]:
+        """Stream the AI response as an async iterator of text deltas"""
+        messages = self._request_messages(turn)
+        await self._reserve_async(turn, messages)
+        turn.timer.sent()
+        
+        def open_stream():
+            return self.client.chat.completions.create(
+                model=turn.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True
+            )
+        
+        async for content in self.resilience.astream(
+            open_stream, hedge_after=self._hedge_after(turn), labels=dict(turn.timer.labels),
+            cancel=self._cancel, limiter=self.limiter, prompt_tokens=turn.prompt_tokens
+        ):
+            yield content
+    
+    async def _get_response(self, turn: _Turn) -> str:
+        """Get the AI response without streaming"""
+        messages = self._request_messages(turn)
+        await self._reserve_async(turn, messages)
+        turn.timer.sent()
+        client = self.client
+        
+        response = await self.resilience.acall(
+            lambda: client.chat.completions.create(
+                model=turn.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=False
+            ),
+            hedge_after=self._hedge_after(turn),
+            labels=dict(turn.timer.labels),
+            limiter=self.limiter,
+            prompt_tokens=turn.prompt_tokens
+        )
+        
+        return response.choices[0].message.content
 
 
 def print_welcome():
@@ -233,38 +1136,25 @@ def print_menu():
 
 def show_personalities(chatline: AdultChatline):
     """Show available personalities and allow selection"""
-    personalities = [
-        PersonalityPresets.FLIRTY,
-        PersonalityPresets.ROMANTIC,
-        PersonalityPresets.ADVENTUROUS,
-        PersonalityPresets.MYSTERIOUS,
-        PersonalityPresets.PLAYFUL
-    ]
+    personalities = chatline.personalities.list(chatline._user_id)
     
     print("\n💋 Choose Your Operator:")
     
     # Show which personalities are available based on subscription
     for i, p in enumerate(personalities, 1):
-        icon = ["💋", "❤️", "🔥", "🌙", "😈"][i-1]
-        desc = ["Sultry seduction specialist", 
-                "Passionate lover with X-rated intensity",
-                "Kinky fantasy expert",
-                "Enigmatic late-night seductress",
-                "Naughty tease with dirty mind"][i-1]
-        
-        # Check if locked
+        icon = p.get("icon", "💋")
+        desc = p.get("description", "")
+        
+        # Check if locked (a caller's own personalities never are)
         locked = ""
-        if MONETIZATION_ENABLED and chatline.user:
+        if MONETIZATION_ENABLED and chatline.user and p.get("owner") is None:
             if not chatline.user.can_access_personality(p['name']):
                 locked = " 🔒"
         
         line = f"  {icon} {i}. {p['name']} - {desc}{locked}"
         print(line)
     
-    for i, p in enumerate(personalities, 1):
-        if p == chatline.current_personality:
-            print(f"\n  ★ Currently talking to: {p['name']}")
-            break
+    print(f"\n  ★ Currently talking to: {chatline.current_personality['name']}")
     
     print("\nEnter operator number (or press Enter to keep current): ", end="")
     choice = input().strip()
@@ -353,11 +1243,16 @@ def handle_upgrade():
 def main():
     """Main application loop"""
     print_welcome()
+    chatline = None
     
     try:
+        load_env()
         # Initialize user if monetization is enabled
         user = None
         if MONETIZATION_ENABLED:
+            from user_manager import UserManager
+            from payments import SubscriptionTier
+            
             # For demo purposes, create a free user
             # In production, this would involve proper authentication
             user_manager = UserManager()
@@ -369,8 +1264,11 @@ def main():
                 print(f"⚠️  Could not initialize user system: {e}")
                 user = None
         
-        chatline = AdultChatline(user=user)
+        # With CONVERSATION_LOG enabled the last call picks up where it left off
+        chatline = AdultChatline(user=user, session_id=user.user_id if user else "cli")
         print(f"📞 Connected to: {chatline.current_personality['name']}")
+        if chatline.get_conversation_length():
+            print(f"📼 Picking up where we left off ({chatline.get_conversation_length()} messages)")
         
         if MONETIZATION_ENABLED and user:
             plan_name = user.subscription_tier.value.upper()
@@ -390,6 +1288,7 @@ def main():
                 command = user_input.lower()
                 
                 if command == "/quit" or command == "/exit":
+                    chatline.archive_transcript()
                     print("\n💋 Thanks for calling! Come back soon, sexy... 😉\n")
                     break
                 elif command == "/help":
@@ -410,10 +1309,15 @@ def main():
                 
                 continue
             
-            # Send message and get response
-            chatline.send_message(user_input, stream=True)
+            # Send message and get response; Ctrl-C cuts the reply short, not the call
+            try:
+                chatline.send_message(user_input, stream=True)
+            except KeyboardInterrupt:
+                print("💋 Mmm, cutting me off? Go on, tell me what you want...\n")
     
     except KeyboardInterrupt:
+        if chatline is not None:
+            chatline.archive_transcript()
         print("\n\n💋 Call ended. Until next time... 😘\n")
     except Exception as e:
         print(f"\n❌ Connection error: {str(e)}\n")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Shared GROQ Clients for 1-800-PHONESEX
+Process-wide GROQ clients with keep-alive connection pooling, so chat
+sessions reuse warm connections instead of paying a TLS handshake each.
+The GROQ SDK and httpx are imported when the first client is created, so
+importing this module (and chatline) stays cheap. Async clients belong to
+one event loop; await close_async_clients() before that loop ends.
+"""
+
+import os
+import threading
+import importlib.util
+import weakref
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    import asyncio
+    import httpx
+    from groq import Groq, AsyncGroq
+
+
+ClientKey = Tuple[Optional[str], Optional[str]]
+
+_clients: Dict[ClientKey, 'Groq'] = {}
+# Async connections belong to the event loop that opened them
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[ClientKey, AsyncGroq]]' = (
+    weakref.WeakKeyDictionary()
+)
+_lock = threading.Lock()
+
+
+def http2_available() -> bool:
+    """Check if HTTP/2 support (the h2 package) is installed"""
+    return importlib.util.find_spec("h2") is not None
+
+
+def get_pool_limits() -> 'httpx.Limits':
+    """
+    Get connection pool limits from the environment
+
+    GROQ_POOL_SIZE caps concurrent connections per client,
+    GROQ_KEEPALIVE_CONNECTIONS the idle connections kept open and
+    GROQ_KEEPALIVE_EXPIRY how long (seconds) an idle connection is kept.
+    """
+    import httpx
+    return httpx.Limits(
+        max_connections=int(os.getenv("GROQ_POOL_SIZE", "100")),
+        max_keepalive_connections=int(os.getenv("GROQ_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60")),
+    )
+
+
+def use_http2() -> bool:
+    """Whether clients should negotiate HTTP/2 (GROQ_HTTP2: auto, true or false)"""
+    setting = os.getenv("GROQ_HTTP2", "auto").lower()
+    if setting == "auto":
+        return http2_available()
+    return setting == "true"
+
+
+def get_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> 'Groq':
+    """
+    Get the shared sync GROQ client
+
+    Args:
+        api_key: GROQ API key (defaults to GROQ_API_KEY)
+        base_url: API base URL (defaults to the GROQ endpoint)
+
+    Returns:
+        Client shared by every caller with the same key and URL
+    """
+    key = (api_key or os.getenv("GROQ_API_KEY"), base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    from groq import Groq, DefaultHttpxClient
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = Groq(
+                api_key=key[0],
+                base_url=base_url,
+                max_retries=0,  # Retries are handled by resilience.ResiliencePolicy
+                http_client=DefaultHttpxClient(limits=get_pool_limits(), http2=use_http2()),
+            )
+            _clients[key] = client
+    return client
+
+
+def get_async_client(api_key: Optional[str] = None, base_url: Optional[str] = None) -> 'AsyncGroq':
+    """
+    Get the shared async GROQ client for the running event loop
+
+    Args:
+        api_key: GROQ API key (defaults to GROQ_API_KEY)
+        base_url: API base URL (defaults to the GROQ endpoint)
+
+    Returns:
+        Client shared by every caller on this loop with the same key and URL,
+        open until close_async_clients() is awaited on the loop
+    """
+    import asyncio
+    from groq import AsyncGroq, DefaultAsyncHttpxClient
+    key = (api_key or os.getenv("GROQ_API_KEY"), base_url)
+    loop = asyncio.get_running_loop()
+
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = AsyncGroq(
+                api_key=key[0],
+                base_url=base_url,
+                max_retries=0,  # Retries are handled by resilience.ResiliencePolicy
+                http_client=DefaultAsyncHttpxClient(limits=get_pool_limits(), http2=use_http2()),
+            )
+            clients[key] = client
+    return client
+
+
+async def close_async_clients():
+    """
+    Close and forget the running event loop's async clients
+
+    Await this before the loop shuts down (e.g. at the end of the coroutine
+    passed to asyncio.run()); otherwise their connections are dropped
+    without being closed when the loop is garbage collected.
+    """
+    import asyncio
+    with _lock:
+        clients = list(_async_clients.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        await client.close()
+
+
+def reset_clients():
+    """Close and forget the shared sync clients (see close_async_clients() for async ones)"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Conversation Compaction for 1-800-PHONESEX
+Summarizes the oldest turns of long sessions in the background so prompt
+size stays flat without losing caller continuity
+"""
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from context_window import MESSAGE_OVERHEAD_TOKENS, estimate_tokens
+from messages import Message
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+SUMMARY_MAX_TOKENS = 256
+
+SUMMARY_PREFIX = "Summary of the call so far: "
+
+SUMMARY_INSTRUCTIONS = (
+    "You keep notes for a phone sex operator. Summarize the conversation below in a few "
+    "sentences: the caller's name if given, their preferences, the fantasy so far and any "
+    "details the operator must remember. Write only the notes."
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Get the shared worker pool used for background summaries"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compaction")
+    return _executor
+
+
+def is_summary(message: Dict[str, str]) -> bool:
+    """Check if a message is a compaction summary"""
+    return message.get("role") == "system" and message.get("content", "").startswith(SUMMARY_PREFIX)
+
+
+class ConversationCompactor:
+    """Replaces the oldest turns of a long conversation with one summary message"""
+
+    def __init__(self, model: Optional[str] = None, threshold: Optional[int] = None,
+                 turns: Optional[int] = None, limiter=None):
+        """
+        Initialize compactor
+
+        Args:
+            model: Cheap model used for summaries (defaults to SUMMARY_MODEL)
+            threshold: Number of conversation messages that triggers compaction
+                (defaults to COMPACTION_THRESHOLD, 0 disables compaction)
+            turns: Number of oldest user/assistant turns folded into each
+                summary (defaults to COMPACTION_TURNS)
+            limiter: Optional rate_limit.UpstreamLimiter shared with chat turns
+        """
+        self.model = model or os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")
+        self.threshold = threshold if threshold is not None else int(os.getenv("COMPACTION_THRESHOLD", "24"))
+        self.turns = turns if turns is not None else int(os.getenv("COMPACTION_TURNS", "6"))
+        self.limiter = limiter
+
+    @property
+    def enabled(self) -> bool:
+        """Whether compaction is enabled"""
+        return self.threshold > 0 and self.turns > 0
+
+    def select_batch(self, history: List[Dict[str, str]]) -> Optional[List[Dict[str, str]]]:
+        """
+        Select the messages to fold into a summary
+
+        The batch starts right after the system prompt, includes any previous
+        summary and ends on a complete user/assistant turn.
+
+        Args:
+            history: Conversation history
+
+        Returns:
+            Messages to summarize, or None if the history is still short
+        """
+        if not self.enabled:
+            return None
+
+        conversation = [m for m in history[1:] if not is_summary(m)]
+        if len(conversation) < self.threshold:
+            return None
+
+        start = 1
+        end = start
+        turns = 0
+        while end < len(history) and turns < self.turns:
+            if history[end].get("role") == "assistant":
+                turns += 1
+            end += 1
+
+        # Always leave the latest exchange in place
+        if turns < self.turns or end >= len(history) - 1:
+            return None
+        return history[start:end]
+
+    def build_request(self, batch: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Build the summarization prompt for a batch
+
+        Args:
+            batch: Messages to summarize
+
+        Returns:
+            Chat messages for the summary completion
+        """
+        lines = []
+        for message in batch:
+            if is_summary(message):
+                lines.append(f"Earlier notes: {message['content'][len(SUMMARY_PREFIX):]}")
+            else:
+                speaker = "Caller" if message.get("role") == "user" else "Operator"
+                lines.append(f"{speaker}: {message.get('content', '')}")
+
+        return [
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": "\n".join(lines)},
+        ]
+
+    @staticmethod
+    def _estimate(messages: List[Dict[str, str]], completion: Optional[int] = None) -> int:
+        """Estimate the token cost of a summary request"""
+        prompt = sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+        return prompt + (SUMMARY_MAX_TOKENS if completion is None else completion)
+
+    def summarize(self, client, batch: List[Dict[str, str]]) -> str:
+        """
+        Summarize a batch with the sync GROQ client
+
+        Args:
+            client: GROQ client
+            batch: Messages to summarize
+
+        Returns:
+            Summary text
+        """
+        messages = self.build_request(batch)
+        reservation = self.limiter.acquire(self._estimate(messages)) if self.limiter else None
+        try:
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                stream=False
+            )
+        except Exception:
+            if reservation is not None:
+                reservation.settle(self._estimate(messages, completion=0))
+            raise
+
+        summary = response.choices[0].message.content.strip()
+        if reservation is not None:
+            reservation.settle(self._estimate(messages, completion=estimate_tokens(summary)))
+        return summary
+
+    async def summarize_async(self, client, batch: List[Dict[str, str]]) -> str:
+        """
+        Summarize a batch with the async GROQ client
+
+        Args:
+            client: Async GROQ client
+            batch: Messages to summarize
+
+        Returns:
+            Summary text
+        """
+        messages = self.build_request(batch)
+        reservation = await self.limiter.acquire_async(self._estimate(messages)) if self.limiter else None
+        try:
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=SUMMARY_MAX_TOKENS,
+                stream=False
+            )
+        except Exception:
+            if reservation is not None:
+                reservation.settle(self._estimate(messages, completion=0))
+            raise
+
+        summary = response.choices[0].message.content.strip()
+        if reservation is not None:
+            reservation.settle(self._estimate(messages, completion=estimate_tokens(summary)))
+        return summary
+
+    def submit(self, client, history: List[Dict[str, str]]) -> Optional[Future]:
+        """
+        Start summarizing in a background thread if the history is long
+
+        Args:
+            client: GROQ client
+            history: Conversation history
+
+        Returns:
+            Future resolving to (batch, summary), or None if not needed
+        """
+        batch = self.select_batch(history)
+        if batch is None:
+            return None
+        return _get_executor().submit(self._run, client, batch)
+
+    def submit_async(self, client, history: List[Dict[str, str]]) -> Optional['asyncio.Task']:
+        """
+        Start summarizing in a background task if the history is long
+
+        Args:
+            client: Async GROQ client
+            history: Conversation history
+
+        Returns:
+            Task resolving to (batch, summary), or None if not needed
+        """
+        batch = self.select_batch(history)
+        if batch is None:
+            return None
+        import asyncio
+        return asyncio.get_running_loop().create_task(self._run_async(client, batch))
+
+    def _run(self, client, batch: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], str]:
+        """Summarize a batch, keeping the batch alongside the result"""
+        return batch, self.summarize(client, batch)
+
+    async def _run_async(self, client, batch: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], str]:
+        """Summarize a batch, keeping the batch alongside the result"""
+        return batch, await self.summarize_async(client, batch)
+
+    @staticmethod
+    def apply(history: List[Dict[str, str]], batch: List[Dict[str, str]], summary: str) -> bool:
+        """
+        Replace a summarized batch with a single summary message
+
+        The history is only changed if the batch is still in place, so a
+        session cleared or switched while the summary was running is left
+        untouched.
+
+        Args:
+            history: Conversation history, modified in place
+            batch: Messages that were summarized
+            summary: Summary text
+
+        Returns:
+            True if the history was compacted, False otherwise
+        """
+        if not summary:
+            return False
+        current = history[1:1 + len(batch)]
+        if len(current) != len(batch) or any(a is not b for a, b in zip(current, batch)):
+            return False
+
+        history[1:1 + len(batch)] = [Message("system", SUMMARY_PREFIX + summary)]
+        return True
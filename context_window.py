@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Context Window Management for 1-800-PHONESEX
+Keeps the prompt sent to GROQ under a token budget by trimming old turns
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+from messages import Message
+
+
+# Context sizes (in tokens) of the GROQ models listed in the README
+MODEL_CONTEXT_SIZES = {
+    "llama-3.3-70b-versatile": 128000,
+    "llama-3.3-70b-specdec": 8192,
+    "llama-3.2-1b-preview": 8192,
+    "llama-3.2-3b-preview": 8192,
+    "llama-3.2-11b-vision-preview": 8192,
+    "llama-3.2-90b-vision-preview": 8192,
+    "llama-3.1-70b-versatile": 128000,
+    "llama-3.1-8b-instant": 128000,
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "llama3-groq-70b-8192-tool-use-preview": 8192,
+    "llama3-groq-8b-8192-tool-use-preview": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "gemma-7b-it": 8192,
+    "gemma2-9b-it": 8192,
+}
+
+DEFAULT_CONTEXT_SIZE = 8192
+
+# Tokens the chat template adds around every message (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Headroom kept free for estimation error in the character heuristic
+SAFETY_MARGIN_TOKENS = 256
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens in a piece of text
+
+    Llama-family tokenizers average roughly four characters per token on
+    English chat text, which is accurate enough for budgeting without
+    shipping a tokenizer.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Estimated token count
+    """
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def get_context_size(model: str) -> int:
+    """
+    Get the context size of a model
+
+    Args:
+        model: GROQ model name
+
+    Returns:
+        Context size in tokens
+    """
+    return MODEL_CONTEXT_SIZES.get(model, DEFAULT_CONTEXT_SIZE)
+
+
+class ContextWindow:
+    """Selects the messages that fit in the model's prompt token budget"""
+
+    def __init__(self, model: str, max_tokens: int, budget: Optional[int] = None):
+        """
+        Initialize context window
+
+        Args:
+            model: GROQ model name, used to look up its context size
+            max_tokens: Tokens reserved for the model's reply
+            budget: Prompt token budget (defaults to CONTEXT_TOKEN_BUDGET or
+                the model's context size minus max_tokens)
+        """
+        self.model = model
+        self.max_tokens = max_tokens
+
+        if budget is None and os.getenv("CONTEXT_TOKEN_BUDGET"):
+            budget = int(os.getenv("CONTEXT_TOKEN_BUDGET"))
+        if budget is None:
+            budget = get_context_size(model) - max_tokens - SAFETY_MARGIN_TOKENS
+        self.budget = max(budget, 0)
+
+        # id(message) -> (message, token count); the message reference guards
+        # against id reuse after a message has been garbage collected
+        self._token_cache: Dict[int, Tuple[Dict[str, str], int]] = {}
+
+    def count(self, message: Dict[str, str]) -> int:
+        """
+        Get the token count of a message, counting it only the first time
+
+        Args:
+            message: Chat message (Message record or dictionary)
+
+        Returns:
+            Estimated token count including per-message overhead
+        """
+        if isinstance(message, Message):
+            # Slotted messages carry their own count, shared across sessions
+            if message.tokens is None:
+                message.tokens = estimate_tokens(message.content or "") + MESSAGE_OVERHEAD_TOKENS
+            return message.tokens
+
+        cached = self._token_cache.get(id(message))
+        if cached is not None and cached[0] is message:
+            return cached[1]
+
+        tokens = estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+        self._token_cache[id(message)] = (message, tokens)
+        return tokens
+
+    def total_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """
+        Get the total token count of a list of messages
+
+        Args:
+            messages: Chat messages
+
+        Returns:
+            Estimated total token count
+        """
+        return sum(self.count(m) for m in messages)
+
+    def select(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        Select the messages to send for the next completion
+
+        System messages are always kept. The oldest conversation turns are
+        dropped until the prompt fits the budget; the latest message is kept
+        even if it alone exceeds the budget.
+
+        Args:
+            messages: Full conversation history
+
+        Returns:
+            Messages to send, in their original order
+        """
+        self._prune(messages)
+
+        pinned = [m for m in messages if m.get("role") == "system"]
+        turns = [m for m in messages if m.get("role") != "system"]
+
+        remaining = self.budget - self.total_tokens(pinned)
+        kept = 0
+        for message in reversed(turns):
+            tokens = self.count(message)
+            if kept and tokens > remaining:
+                break
+            remaining -= tokens
+            kept += 1
+
+        if kept == len(turns):
+            return messages
+
+        window = turns[len(turns) - kept:]
+        # Never open the window on an assistant reply whose prompt was trimmed
+        while len(window) > 1 and window[0].get("role") == "assistant":
+            window = window[1:]
+
+        keep_ids = {id(m) for m in window}
+        return [m for m in messages if m.get("role") == "system" or id(m) in keep_ids]
+
+    def _prune(self, messages: List[Dict[str, str]]):
+        """Drop cached counts for messages no longer in the history"""
+        if len(self._token_cache) <= 2 * len(messages):
+            return
+        live = {id(m) for m in messages}
+        self._token_cache = {
+            key: value for key, value in self._token_cache.items() if key in live
+        }
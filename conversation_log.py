@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Durable Conversation Log for 1-800-PHONESEX
+Append-only, length-prefixed log shared by all sessions, split into
+segments. Every record points back to the previous record of its session
+and a small index keeps each session's latest record, so a session is
+rebuilt by reading only its own tail. Writes are batched on a background
+thread and never block the token stream.
+"""
+
+import os
+import json
+import atexit
+import zlib
+import queue
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from metrics import MetricsRegistry, REGISTRY
+
+
+# Record kinds
+USER = 1
+ASSISTANT = 2
+RESET = 3      # History cleared or personality changed; content is the personality name
+COMPACT = 4    # Oldest turns replaced by a summary; aux is the number of messages kept after it
+
+_ROLES = {USER: "user", ASSISTANT: "assistant"}
+_KINDS = {"user": USER, "assistant": ASSISTANT}
+
+# Frame: payload length, CRC32 of the payload
+_FRAME = struct.Struct("<II")
+# Payload header: kind, session id length, previous record position, aux
+_HEADER = struct.Struct("<BHqI")
+
+NO_RECORD = -1
+
+# Seconds between index saves while records are being written; records after
+# the saved index are re-scanned on open, so a stale index only costs startup
+INDEX_SAVE_SECONDS = 30.0
+_OFFSET_BITS = 40
+
+Position = int  # segment number << 40 | byte offset
+
+
+def _position(segment: int, offset: int) -> Position:
+    return (segment << _OFFSET_BITS) | offset
+
+
+def _split(position: Position) -> Tuple[int, int]:
+    return position >> _OFFSET_BITS, position & ((1 << _OFFSET_BITS) - 1)
+
+
+class LogRecord:
+    """One decoded log record"""
+
+    __slots__ = ("kind", "session_id", "prev", "aux", "content")
+
+    def __init__(self, kind: int, session_id: str, prev: Position, aux: int, content: str):
+        self.kind = kind
+        self.session_id = session_id
+        self.prev = prev
+        self.aux = aux
+        self.content = content
+
+    @property
+    def role(self) -> Optional[str]:
+        """Chat role for message records, None otherwise"""
+        return _ROLES.get(self.kind)
+
+
+def encode_record(kind: int, session_id: str, prev: Position, aux: int, content: str) -> bytes:
+    """Encode a record with its length and checksum frame"""
+    sid = session_id.encode("utf-8")
+    payload = _HEADER.pack(kind, len(sid), prev, aux) + sid + content.encode("utf-8")
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_payload(payload: bytes) -> LogRecord:
+    """Decode a record payload (without its frame)"""
+    kind, sid_len, prev, aux = _HEADER.unpack_from(payload)
+    start = _HEADER.size
+    session_id = payload[start:start + sid_len].decode("utf-8")
+    content = payload[start + sid_len:].decode("utf-8")
+    return LogRecord(kind, session_id, prev, aux, content)
+
+
+class SessionTail:
+    """A session's history as rebuilt from the log"""
+
+    def __init__(self, personality: Optional[str], messages: List[Tuple[str, str]],
+                 summary: Optional[str] = None):
+        self.personality = personality
+        self.messages = messages
+        self.summary = summary
+
+
+class ConversationLog:
+    """Segmented append-only log of every session's messages"""
+
+    _shared: Optional['ConversationLog'] = None
+
+    def __init__(self, directory: Optional[str] = None, segment_bytes: Optional[int] = None,
+                 fsync: Optional[str] = None, flush_interval: Optional[float] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Open (or create) a log
+
+        Args:
+            directory: Log directory (CONVERSATION_LOG_DIR, default ./conversation_log)
+            segment_bytes: Size at which a new segment starts
+                (CONVERSATION_LOG_SEGMENT_MB, default 64 MB)
+            fsync: "always" after every batch, "interval" at most once per
+                second, or "never" to leave it to the OS
+                (CONVERSATION_LOG_FSYNC, default interval)
+            flush_interval: Longest a record waits before being written, in
+                seconds (CONVERSATION_LOG_FLUSH_MS, default 200 ms)
+            metrics: Registry for batch write latency
+        """
+        self.directory = Path(directory or os.getenv("CONVERSATION_LOG_DIR", "./conversation_log"))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if segment_bytes is None:
+            segment_bytes = int(float(os.getenv("CONVERSATION_LOG_SEGMENT_MB", "64")) * 1024 * 1024)
+        self.segment_bytes = segment_bytes
+        self.fsync = (fsync or os.getenv("CONVERSATION_LOG_FSYNC", "interval")).lower()
+        if flush_interval is None:
+            flush_interval = float(os.getenv("CONVERSATION_LOG_FLUSH_MS", "200")) / 1000
+        self.flush_interval = flush_interval
+        self.metrics = metrics or REGISTRY
+
+        # Latest record and personality of each session; only the writer
+        # thread (and loading) changes them
+        self._last: Dict[str, Position] = {}
+        self._personality: Dict[str, str] = {}
+        self._index_lock = threading.Lock()
+        self._load_index()
+
+        self._file = open(self._segment_path(self._segment), "ab")
+        self._offset = self._file.tell()
+        self._last_fsync = time.monotonic()
+        self._index_saved = time.monotonic()
+        self._index_dirty = False
+
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, daemon=True, name="conversation-log")
+        self._writer.start()
+
+    @classmethod
+    def shared(cls) -> Optional['ConversationLog']:
+        """Get the process-wide log, or None unless CONVERSATION_LOG is enabled"""
+        if os.getenv("CONVERSATION_LOG", "false").lower() != "true":
+            return None
+        if cls._shared is None:
+            cls._shared = cls()
+            # Write out queued turns when the process exits normally
+            atexit.register(cls._shared.close)
+        return cls._shared
+
+    # Writing
+
+    def append(self, session_id: str, role: str, content: str):
+        """Queue a user or assistant message (returns immediately)"""
+        self._queue.put((session_id, _KINDS[role], 0, content))
+
+    def reset(self, session_id: str, personality: str):
+        """Queue a history reset (clear or personality change)"""
+        self._queue.put((session_id, RESET, 0, personality))
+
+    def compact(self, session_id: str, summary: str, kept: int):
+        """
+        Queue a compaction
+
+        Args:
+            session_id: Session id
+            summary: Summary that replaced the oldest messages
+            kept: Messages after the summary that were kept as they were
+        """
+        self._queue.put((session_id, COMPACT, kept, summary))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until everything queued so far is written
+
+        Only the records are written; the index file is saved on its own
+        schedule, so readers can flush cheaply.
+
+        Returns:
+            True if the writer caught up within the timeout
+        """
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Write what is queued, save the index and close the segment"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+    def _run(self):
+        """Writer thread: batch queued records into the current segment"""
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            # Gather whatever else arrives within the flush interval
+            while item is not None and not isinstance(item, threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+
+            waiters = [i for i in batch if isinstance(i, threading.Event)]
+            records = [i for i in batch if isinstance(i, tuple)]
+            if records:
+                self._write(records)
+            if None in batch or (self._index_dirty
+                                 and time.monotonic() - self._index_saved >= INDEX_SAVE_SECONDS):
+                self._save_index()
+            for waiter in waiters:
+                waiter.set()
+            if None in batch:
+                self._sync(force=True)
+                return
+
+    def _write(self, records: List[Tuple[str, int, int, str]]):
+        """Append a batch of records and update the index"""
+        started = time.perf_counter()
+        chunks = []
+        updates = {}
+        personalities = {}
+        for session_id, kind, aux, content in records:
+            if self._offset >= self.segment_bytes:
+                self._file.write(b"".join(chunks))
+                chunks = []
+                self._roll()
+            prev = updates.get(session_id, self._last.get(session_id, NO_RECORD))
+            data = encode_record(kind, session_id, prev, aux, content)
+            updates[session_id] = _position(self._segment, self._offset)
+            if kind == RESET:
+                personalities[session_id] = content
+            chunks.append(data)
+            self._offset += len(data)
+        self._file.write(b"".join(chunks))
+        self._file.flush()
+        self._sync()
+        with self._index_lock:
+            self._last.update(updates)
+            self._personality.update(personalities)
+            self._covered = (self._segment, self._offset)
+        self._index_dirty = True
+        self.metrics.observe("chat_log_write_seconds", time.perf_counter() - started)
+
+    def _sync(self, force: bool = False):
+        """fsync according to the policy"""
+        now = time.monotonic()
+        if self.fsync == "always" or (force and self.fsync != "never") or (
+                self.fsync == "interval" and now - self._last_fsync >= 1.0):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+
+    def _roll(self):
+        """Start the next segment"""
+        self._file.flush()
+        self._sync(force=True)
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), "ab")
+        self._offset = 0
+        self._save_index()
+
+    # Index
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"{segment:08d}.log"
+
+    def _index_path(self) -> Path:
+        return self.directory / "index.json"
+
+    def _save_index(self):
+        """Save each session's latest record and how far the log is indexed"""
+        with self._index_lock:
+            data = {
+                "segment": self._covered[0],
+                "offset": self._covered[1],
+                "sessions": dict(self._last),
+                "personalities": dict(self._personality),
+            }
+        tmp = self._index_path().with_suffix(".tmp")
+        tmp.write_text(json.dumps(data, separators=(",", ":")))
+        os.replace(tmp, self._index_path())
+        self._index_saved = time.monotonic()
+        self._index_dirty = False
+
+    def _load_index(self):
+        """Load the saved index, then index records written after it"""
+        segments = sorted(int(p.stem) for p in self.directory.glob("*.log") if p.stem.isdigit())
+        segment, offset = (segments[0] if segments else 1), 0
+        try:
+            data = json.loads(self._index_path().read_text())
+            self._last = {sid: int(pos) for sid, pos in data["sessions"].items()}
+            self._personality = dict(data["personalities"])
+            segment, offset = data["segment"], data["offset"]
+        except (OSError, ValueError, KeyError):
+            self._last, self._personality = {}, {}
+            offset = 0
+
+        for number in [s for s in segments if s >= segment] or [segment]:
+            offset = self._scan(number, offset if number == segment else 0)
+            segment = number
+        self._segment = segment
+        self._covered = (segment, offset)
+
+    def _scan(self, segment: int, offset: int) -> int:
+        """
+        Index the records of a segment from an offset, truncating a torn tail
+
+        Returns:
+            Offset of the end of the last valid record
+        """
+        path = self._segment_path(segment)
+        if not path.exists():
+            return 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                frame = f.read(_FRAME.size)
+                if len(frame) < _FRAME.size:
+                    break
+                length, checksum = _FRAME.unpack(frame)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != checksum:
+                    break
+                record = decode_payload(payload)
+                self._last[record.session_id] = _position(segment, offset)
+                if record.kind == RESET:
+                    self._personality[record.session_id] = record.content
+                offset += _FRAME.size + length
+        if path.stat().st_size > offset:
+            # A crash mid-write left a partial record; drop it
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return offset
+
+    # Reading
+
+    def _read(self, position: Position, files: Dict[int, BinaryIO]) -> LogRecord:
+        """
+        Read the record at a position
+
+        Args:
+            position: Record position
+            files: Segment files opened so far, reused and added to so a
+                walk opens each segment once (the caller closes them)
+        """
+        segment, offset = _split(position)
+        f = files.get(segment)
+        if f is None:
+            f = files[segment] = open(self._segment_path(segment), "rb")
+        f.seek(offset)
+        length, checksum = _FRAME.unpack(f.read(_FRAME.size))
+        payload = f.read(length)
+        if zlib.crc32(payload) != checksum:
+            raise ValueError(f"Corrupt conversation log record at segment {segment} offset {offset}")
+        return decode_payload(payload)
+
+    def read_session(self, session_id: str, max_messages: Optional[int] = None) -> Optional[SessionTail]:
+        """
+        Rebuild a session's current history from its tail
+
+        Walks back from the session's latest record to its last reset (or
+        compaction), reading only that session's records.
+
+        Args:
+            session_id: Session id
+            max_messages: Stop after this many of the newest messages
+
+        Returns:
+            The session's history, or None if the log has nothing for it
+        """
+        self.flush()
+        with self._index_lock:
+            position = self._last.get(session_id, NO_RECORD)
+            personality = self._personality.get(session_id)
+        if position == NO_RECORD:
+            return None
+
+        messages: List[Tuple[str, str]] = []
+        summary = None
+        remaining = None  # Messages kept alongside the compaction summary still to read
+        files: Dict[int, BinaryIO] = {}
+        try:
+            while position != NO_RECORD:
+                record = self._read(position, files)
+                if record.kind == RESET:
+                    break
+                if record.kind == COMPACT:
+                    # The messages the summary left in place were logged before it
+                    summary = record.content
+                    remaining = record.aux
+                else:
+                    if remaining == 0:
+                        break
+                    messages.append((record.role, record.content))
+                    if remaining is not None:
+                        remaining -= 1
+                if max_messages is not None and len(messages) >= max_messages:
+                    break
+                position = record.prev
+        finally:
+            for f in files.values():
+                f.close()
+
+        messages.reverse()
+        return SessionTail(personality, messages, summary)
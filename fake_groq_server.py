@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Fake GROQ Server for 1-800-PHONESEX
+Local stand-in for the GROQ chat-completions API (streaming and not), with
+configurable latency, throughput, errors and rate limiting, so the chatline
+can be load tested and benchmarked offline
+
+Usage:
+    python fake_groq_server.py [--port 8088] [--ttft-ms 200] [--tokens-per-sec 250]
+                               [--error-rate 0] [--rate-limit-rpm 0] [--throttle-rate 0]
+
+Then point the chatline at it:
+    GROQ_BASE_URL=http://127.0.0.1:8088 python chatline.py
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+DEFAULT_REPLY = (
+    "Mmm, hello there, sexy... I was hoping you'd call tonight. "
+    "Tell me what's on your mind and don't leave out a single detail."
+)
+
+_TOKEN = re.compile(r"\S+\s*")
+
+
+class FakeGroqConfig:
+    """Behaviour of the fake server, adjustable while it runs"""
+
+    def __init__(self, ttft_ms: float = 200.0, tokens_per_second: float = 250.0,
+                 error_rate: float = 0.0, rate_limit_rpm: int = 0, throttle_rate: float = 0.0,
+                 retry_after: float = 1.0, handshake_ms: float = 0.0,
+                 reply: str = DEFAULT_REPLY, seed: Optional[int] = None):
+        """
+        Initialize server behaviour
+
+        Args:
+            ttft_ms: Delay before the first token (or the whole non-streamed reply)
+            tokens_per_second: Streaming speed after the first token (0 = no delay)
+            error_rate: Fraction of requests answered with a 500
+            rate_limit_rpm: Requests per rolling minute before answering 429 (0 = unlimited)
+            throttle_rate: Fraction of requests answered with a 429 regardless of rate
+            retry_after: Retry-After seconds sent with 429s
+            handshake_ms: Delay paid once per new connection, like a TLS handshake
+            reply: Text every completion returns
+            seed: Seed for the error/throttle dice, for reproducible runs
+        """
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rpm = rate_limit_rpm
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.handshake_ms = handshake_ms
+        self.reply = reply
+        self.random = random.Random(seed)
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    """Answers POST .../chat/completions like GROQ does"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        handshake = self.server.config.handshake_ms
+        if handshake > 0:
+            time.sleep(handshake / 1000)
+        super().setup()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            request = {}
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Unknown endpoint", "type": "invalid_request_error"}})
+            return
+
+        outcome = self.server.admit()
+        if outcome == "throttled":
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                            {"Retry-After": str(self.server.config.retry_after)})
+            return
+        if outcome == "error":
+            self._send_json(500, {"error": {"message": "Internal server error", "type": "internal_server_error"}})
+            return
+
+        if request.get("stream"):
+            self._stream(request)
+        else:
+            self._complete(request)
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        """Send a complete JSON response"""
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _tokens(self, request: Dict):
+        """Split the reply into tokens, honouring max_tokens"""
+        tokens = _TOKEN.findall(self.server.config.reply)
+        limit = request.get("max_tokens") or request.get("max_completion_tokens")
+        return tokens[:limit] if limit else tokens
+
+    def _usage(self, request: Dict, completion_tokens: int) -> Dict[str, int]:
+        """Rough usage numbers in GROQ's format"""
+        prompt = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // 4
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt + completion_tokens,
+        }
+
+    def _complete(self, request: Dict):
+        """Answer a non-streaming completion after the first-token delay"""
+        config = self.server.config
+        tokens = self._tokens(request)
+        time.sleep(config.ttft_ms / 1000)
+        if config.tokens_per_second > 0:
+            time.sleep(max(0, len(tokens) - 1) / config.tokens_per_second)
+        self._send_json(200, {
+            "id": self.server.next_id(),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": self._usage(request, len(tokens)),
+        })
+
+    def _stream(self, request: Dict):
+        """Stream the reply as server-sent events, one token per chunk"""
+        config = self.server.config
+        completion_id = self.server.next_id()
+        created = int(time.time())
+        model = request.get("model", "fake")
+
+        def chunk(delta: Dict, finish_reason: Optional[str] = None, **extra) -> Dict:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            payload.update(extra)
+            return payload
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        tokens = self._tokens(request)
+        try:
+            time.sleep(config.ttft_ms / 1000)
+            self._event(chunk({"role": "assistant", "content": ""}))
+            for i, token in enumerate(tokens):
+                if i and config.tokens_per_second > 0:
+                    time.sleep(1 / config.tokens_per_second)
+                self._event(chunk({"content": token}))
+            self._event(chunk({}, "stop", x_groq={"usage": self._usage(request, len(tokens))}))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up mid-stream (cancelled or hedged away)
+            self.close_connection = True
+
+    def _event(self, payload: Dict):
+        """Write one server-sent event"""
+        self._write_chunk(b"data: " + json.dumps(payload).encode() + b"\n\n")
+
+    def _write_chunk(self, data: bytes):
+        """Write one HTTP/1.1 chunk (an empty one ends the body)"""
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGroqServer(ThreadingHTTPServer):
+    """Threaded fake GROQ server that counts what it served"""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 config: Optional[FakeGroqConfig] = None):
+        """
+        Initialize server (port 0 picks a free port)
+
+        Args:
+            host: Interface to bind
+            port: Port to bind
+            config: Server behaviour (defaults to FakeGroqConfig())
+        """
+        super().__init__((host, port), FakeGroqHandler)
+        self.config = config or FakeGroqConfig()
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._ids = 0
+        self.stats = {"requests": 0, "completed": 0, "errors": 0, "throttled": 0}
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL for GROQ_BASE_URL (the SDK appends /openai/v1/...)"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def admit(self) -> str:
+        """
+        Decide how to answer a request
+
+        Returns:
+            "ok", "throttled" (429) or "error" (500)
+        """
+        config = self.config
+        now = time.monotonic()
+        with self._lock:
+            self.stats["requests"] += 1
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+
+            if config.rate_limit_rpm and len(self._recent) >= config.rate_limit_rpm:
+                outcome = "throttled"
+            elif config.throttle_rate and config.random.random() < config.throttle_rate:
+                outcome = "throttled"
+            elif config.error_rate and config.random.random() < config.error_rate:
+                outcome = "error"
+            else:
+                outcome = "ok"
+                self._recent.append(now)
+
+            key = {"ok": "completed", "throttled": "throttled", "error": "errors"}[outcome]
+            self.stats[key] += 1
+        return outcome
+
+    def next_id(self) -> str:
+        """Get a unique completion id"""
+        with self._lock:
+            self._ids += 1
+            return f"chatcmpl-fake-{self._ids}"
+
+    def start(self) -> 'FakeGroqServer':
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True, name="fake-groq")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket"""
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self) -> 'FakeGroqServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="Delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="Streaming speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 500")
+    parser.add_argument("--rate-limit-rpm", type=int, default=0, help="Requests per minute before 429s")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests failing with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429s")
+    parser.add_argument("--seed", type=int, help="Seed for reproducible errors")
+    args = parser.parse_args()
+
+    config = FakeGroqConfig(
+        ttft_ms=args.ttft_ms,
+        tokens_per_second=args.tokens_per_sec,
+        error_rate=args.error_rate,
+        rate_limit_rpm=args.rate_limit_rpm,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    server = FakeGroqServer(args.host, args.port, config)
+    print(f"Fake GROQ server on {server.base_url}")
+    print(f"Run the chatline with: GROQ_BASE_URL={server.base_url} python chatline.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Greeting Audio Cache for 1-800-PHONESEX
+Every call opens with the same greeting, so it is synthesized once per
+(personality, voice, text) and kept on disk as raw 16-bit PCM. Calls play it
+straight from a memory-mapped file instead of going through TTS, and the
+pages are shared by every call and worker process on the host. A changed
+text or voice gives a new key; on a miss the greeting is spoken with live
+TTS and the played audio is cached.
+"""
+
+import os
+import re
+import mmap
+import json
+import struct
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Iterator, Optional
+
+from livekit import rtc
+
+from metrics import MetricsRegistry, REGISTRY
+
+
+# File header: magic, sample rate, channels, reserved (keeps samples aligned)
+_HEADER = struct.Struct("<4sIHH")
+_MAGIC = b"GRT1"
+
+# Bytes per 16-bit sample
+_SAMPLE_BYTES = 2
+
+
+def voice_key(tts) -> str:
+    """
+    Identify the voice a TTS plugin speaks with
+
+    Args:
+        tts: LiveKit TTS plugin
+
+    Returns:
+        String that changes whenever the voice, model, settings or output
+        format change
+    """
+    opts = getattr(tts, "_opts", None)
+    return ":".join(str(part) for part in (
+        type(tts).__module__,
+        getattr(opts, "voice_id", ""),
+        getattr(opts, "model", ""),
+        getattr(opts, "voice_settings", ""),
+        tts.sample_rate,
+        tts.num_channels,
+    ))
+
+
+class CachedGreeting:
+    """A greeting's PCM audio, memory-mapped from the cache"""
+
+    __slots__ = ("sample_rate", "num_channels", "_map", "_pcm")
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.sample_rate, self.num_channels, _ = _HEADER.unpack_from(self._map)
+        if magic != _MAGIC:
+            self._map.close()
+            raise ValueError(f"Not a greeting cache file: {path}")
+        self._pcm = memoryview(self._map)[_HEADER.size:]
+
+    @property
+    def duration(self) -> float:
+        """Length in seconds"""
+        return len(self._pcm) / (_SAMPLE_BYTES * self.num_channels * self.sample_rate)
+
+    def frames(self, frame_ms: int = 20) -> Iterator[rtc.AudioFrame]:
+        """
+        Split the greeting into audio frames
+
+        Each frame is sliced from the mapped file; nothing is read or
+        decoded up front.
+
+        Args:
+            frame_ms: Frame length in milliseconds
+
+        Yields:
+            Audio frames, the last one possibly shorter
+        """
+        frame_bytes = self.sample_rate * frame_ms // 1000 * self.num_channels * _SAMPLE_BYTES
+        for start in range(0, len(self._pcm), frame_bytes):
+            chunk = self._pcm[start:start + frame_bytes]
+            yield rtc.AudioFrame(chunk, self.sample_rate, self.num_channels,
+                                 len(chunk) // (self.num_channels * _SAMPLE_BYTES))
+
+    async def stream(self, frame_ms: int = 20) -> AsyncIterator[rtc.AudioFrame]:
+        """Async version of frames(), for AgentSession.say(audio=...)"""
+        for frame in self.frames(frame_ms):
+            yield frame
+
+
+class GreetingCache:
+    """On-disk cache of synthesized greetings"""
+
+    _shared: Optional['GreetingCache'] = None
+
+    def __init__(self, directory: Optional[str] = None, metrics: Optional[MetricsRegistry] = None):
+        """
+        Open (or create) a greeting cache
+
+        Args:
+            directory: Cache directory (GREETING_CACHE_DIR, default ./greeting_cache)
+            metrics: Registry for hit and miss counters
+        """
+        self.directory = Path(directory or os.getenv("GREETING_CACHE_DIR", "./greeting_cache"))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.metrics = metrics or REGISTRY
+        self._lock = threading.Lock()
+        # Greetings mapped so far, by key; calls share the same mapping
+        self._mapped: Dict[str, CachedGreeting] = {}
+
+    @classmethod
+    def shared(cls) -> Optional['GreetingCache']:
+        """Get the process-wide cache, or None if GREETING_CACHE is 'false'"""
+        if os.getenv("GREETING_CACHE", "true").lower() != "true":
+            return None
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @staticmethod
+    def key(personality: str, voice: str, text: str) -> str:
+        """Cache key for a greeting"""
+        data = json.dumps([personality, voice, text], ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _prefix(self, personality: str) -> str:
+        return re.sub(r"[^a-z0-9]+", "-", personality.lower()).strip("-") or "greeting"
+
+    def _path(self, personality: str, key: str) -> Path:
+        return self.directory / f"{self._prefix(personality)}-{key[:32]}.pcm"
+
+    def get(self, personality: str, voice: str, text: str) -> Optional[CachedGreeting]:
+        """
+        Look up a greeting
+
+        Args:
+            personality: Operator the greeting belongs to
+            voice: Voice it was spoken with (see voice_key())
+            text: Greeting text
+
+        Returns:
+            The cached audio, or None if it has not been synthesized yet
+        """
+        key = self.key(personality, voice, text)
+        with self._lock:
+            greeting = self._mapped.get(key)
+            if greeting is None:
+                path = self._path(personality, key)
+                try:
+                    greeting = CachedGreeting(path)
+                except (OSError, ValueError, struct.error):
+                    greeting = None
+                if greeting is not None:
+                    self._mapped[key] = greeting
+        self.metrics.increment("voice_greeting_cache_total", result="hit" if greeting else "miss")
+        return greeting
+
+    def store(self, personality: str, voice: str, text: str,
+              frames: Iterable[rtc.AudioFrame]) -> CachedGreeting:
+        """
+        Save a synthesized greeting, replacing the personality's older ones
+
+        Args:
+            personality: Operator the greeting belongs to
+            voice: Voice it was spoken with (see voice_key())
+            text: Greeting text
+            frames: Synthesized audio
+
+        Returns:
+            The stored greeting, memory-mapped
+
+        Raises:
+            ValueError: If there is no audio or the frames' formats differ
+        """
+        key = self.key(personality, voice, text)
+        path = self._path(personality, key)
+        # Calls in other worker processes may be storing the same greeting
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, prefix=path.stem + "-", suffix=".tmp")
+        tmp = Path(tmp_name)
+        audio_format = None
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, 0, 0, 0))
+                for frame in frames:
+                    if audio_format is None:
+                        audio_format = (frame.sample_rate, frame.num_channels)
+                    elif audio_format != (frame.sample_rate, frame.num_channels):
+                        raise ValueError("Greeting frames have different audio formats")
+                    f.write(frame.data.cast("B"))
+                if audio_format is None:
+                    raise ValueError("No greeting audio to store")
+                f.seek(0)
+                f.write(_HEADER.pack(_MAGIC, audio_format[0], audio_format[1], 0))
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        os.replace(tmp, path)
+
+        # A changed text or voice leaves the old file behind; drop it
+        prefix = self._prefix(personality)
+        for old in self.directory.glob(f"{prefix}-*.pcm"):
+            if old != path and old.stem.rsplit("-", 1)[0] == prefix:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+        greeting = CachedGreeting(path)
+        with self._lock:
+            self._mapped[key] = greeting
+        return greeting
+
+    async def synthesize(self, tts, personality: str, text: str) -> AsyncIterator[rtc.AudioFrame]:
+        """
+        Synthesize a greeting for live playback and cache what was played
+
+        Frames are yielded as the TTS produces them, so a miss costs one
+        synthesis. The greeting is stored only if it is played to the end;
+        an interrupted greeting is not cached, and a failed write is counted
+        and left for the next call to retry.
+
+        Args:
+            tts: LiveKit TTS plugin to synthesize with
+            personality: Operator the greeting belongs to
+            text: Greeting text
+
+        Yields:
+            Audio frames, for AgentSession.say(audio=...)
+        """
+        frames = []
+        async with tts.synthesize(text) as stream:
+            async for audio in stream:
+                frames.append(audio.frame)
+                yield audio.frame
+        try:
+            self.store(personality, voice_key(tts), text, frames)
+        except (OSError, ValueError):
+            self.metrics.increment("voice_greeting_cache_store_errors_total")
+
+    async def fill(self, tts, personality: str, text: str) -> CachedGreeting:
+        """
+        Synthesize a greeting and cache it, without playing it
+
+        Args:
+            tts: LiveKit TTS plugin to synthesize with
+            personality: Operator the greeting belongs to
+            text: Greeting text
+
+        Returns:
+            The stored greeting
+        """
+        frames = []
+        async with tts.synthesize(text) as stream:
+            async for audio in stream:
+                frames.append(audio.frame)
+        return self.store(personality, voice_key(tts), text, frames)
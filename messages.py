@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Compact Chat Messages for 1-800-PHONESEX
+Slotted message records with interned roles and one shared system prompt
+message per personality, converted to API dictionaries only when a request
+is sent
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Union
+
+
+class Message:
+    """
+    One chat message, stored without a per-message dict
+
+    Supports the read-only dict access the rest of the code uses
+    (message["content"], message.get("role")), so histories may mix
+    Message records and plain dictionaries.
+    """
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: str, content: str):
+        """
+        Initialize message
+
+        Args:
+            role: "system", "user" or "assistant" (interned, so every
+                message shares one string per role)
+            content: Message text
+        """
+        self.role = sys.intern(role)
+        self.content = content
+        # Estimated token count, filled in by context_window on first use
+        self.tokens: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, str]) -> 'Message':
+        """Create a message from its API representation"""
+        return cls(data["role"], data["content"])
+
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in ("role", "content")
+
+    def get(self, key: str, default=None):
+        """Dict-style access with a default"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, str]:
+        """Get the API representation"""
+        return {"role": self.role, "content": self.content}
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content[:40]!r})"
+
+
+ChatMessage = Union[Message, Dict[str, str]]
+
+# Most system prompts kept shared; custom personalities would otherwise grow
+# the table without bound
+SYSTEM_MESSAGE_CACHE_SIZE = 256
+
+# System prompt text -> the one Message every session with that prompt
+# shares, least recently used first
+_system_messages: 'OrderedDict[str, Message]' = OrderedDict()
+_system_messages_lock = threading.Lock()
+
+
+def system_message(prompt: str) -> Message:
+    """
+    Get the shared system message for a prompt
+
+    The returned record is shared between sessions and must not be modified.
+    Only the most recently used prompts are kept; sessions still holding an
+    evicted prompt's message keep it, and the next lookup makes a new one.
+
+    Args:
+        prompt: System prompt text (usually a personality's system_prompt)
+
+    Returns:
+        Shared Message for the prompt
+    """
+    with _system_messages_lock:
+        message = _system_messages.get(prompt)
+        if message is not None:
+            _system_messages.move_to_end(prompt)
+            return message
+        message = _system_messages[prompt] = Message("system", prompt)
+        if len(_system_messages) > SYSTEM_MESSAGE_CACHE_SIZE:
+            _system_messages.popitem(last=False)
+    return message
+
+
+def to_api(messages: Sequence[ChatMessage]) -> List[Dict[str, str]]:
+    """
+    Convert messages to the chat-completions request format
+
+    Args:
+        messages: Message records and/or dictionaries
+
+    Returns:
+        New list of dictionaries
+    """
+    return [m.to_dict() if isinstance(m, Message) else m for m in messages]
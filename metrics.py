@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Latency Metrics for 1-800-PHONESEX
+In-process histogram registry that can be dumped as JSON or scraped in
+Prometheus text format
+"""
+
+import json
+import math
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+
+# Bucket upper bounds in seconds, from 1 ms to one minute
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+# Bucket upper bounds for throughput rates such as tokens per second
+RATE_BUCKETS = (1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0)
+
+# Recent observations kept per histogram for percentile estimates
+RESERVOIR_SIZE = 2048
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative bucket histogram with a window of recent samples"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Initialize histogram
+
+        Args:
+            buckets: Sorted bucket upper bounds
+        """
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._samples = deque(maxlen=RESERVOIR_SIZE)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Record an observation"""
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            self._samples.append(value)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.bucket_counts[i] += 1
+                    break
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Get a percentile of the recent observations
+
+        Args:
+            p: Percentile between 0 and 100
+
+        Returns:
+            Percentile value, or None if nothing was observed
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        # Nearest-rank percentile
+        rank = math.ceil(p / 100 * len(samples))
+        return samples[min(max(rank, 1), len(samples)) - 1]
+
+    def summary(self) -> Dict:
+        """Get count, sum and common percentiles"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    def __init__(self):
+        """Initialize counter at zero"""
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        """Increase the counter"""
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that goes up and down, such as a queue depth"""
+
+    def __init__(self):
+        """Initialize gauge at zero"""
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        """Set the gauge"""
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount: float = 1):
+        """Raise the gauge (lower it with a negative amount)"""
+        with self._lock:
+            self.value += amount
+
+
+class MetricsRegistry:
+    """Named, labelled histograms, counters and gauges shared across the process"""
+
+    def __init__(self):
+        """Initialize an empty registry"""
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, Counter]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, Gauge]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {"chat_tokens_per_second": RATE_BUCKETS}
+        self._lock = threading.Lock()
+
+    def set_buckets(self, name: str, buckets: Tuple[float, ...]):
+        """
+        Set the bucket bounds used for new series of a metric
+
+        Args:
+            name: Metric name
+            buckets: Sorted bucket upper bounds
+        """
+        with self._lock:
+            self._buckets[name] = tuple(buckets)
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        """
+        Get or create a histogram
+
+        Args:
+            name: Metric name
+            **labels: Label values identifying the series
+
+        Returns:
+            Histogram for the series
+        """
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            return series[key]
+
+    def observe(self, name: str, value: float, **labels: str):
+        """Record an observation in a histogram"""
+        self.histogram(name, **labels).observe(value)
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        """
+        Get or create a counter
+
+        Args:
+            name: Metric name
+            **labels: Label values identifying the series
+
+        Returns:
+            Counter for the series
+        """
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            if key not in series:
+                series[key] = Counter()
+            return series[key]
+
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        """Increase a counter"""
+        self.counter(name, **labels).inc(amount)
+
+    def gauge(self, name: str, **labels: str) -> Gauge:
+        """
+        Get or create a gauge
+
+        Args:
+            name: Metric name
+            **labels: Label values identifying the series
+
+        Returns:
+            Gauge for the series
+        """
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            if key not in series:
+                series[key] = Gauge()
+            return series[key]
+
+    def get_gauges(self, name: str) -> List[Tuple[Dict[str, str], Gauge]]:
+        """Get every labelled series of a gauge"""
+        with self._lock:
+            series = list(self._gauges.get(name, {}).items())
+        return [(dict(key), gauge) for key, gauge in series]
+
+    def get_counters(self, name: str) -> List[Tuple[Dict[str, str], Counter]]:
+        """Get every labelled series of a counter"""
+        with self._lock:
+            series = list(self._counters.get(name, {}).items())
+        return [(dict(key), counter) for key, counter in series]
+
+    def get_series(self, name: str) -> List[Tuple[Dict[str, str], Histogram]]:
+        """Get every labelled series of a metric"""
+        with self._lock:
+            series = list(self._histograms.get(name, {}).items())
+        return [(dict(key), histogram) for key, histogram in series]
+
+    def snapshot(self) -> Dict:
+        """
+        Get a JSON-serializable view of all metrics
+
+        Returns:
+            Mapping of metric name to a list of series summaries
+        """
+        with self._lock:
+            names = list(self._histograms)
+            counter_names = list(self._counters)
+            gauge_names = list(self._gauges)
+        snapshot = {
+            name: [
+                {"labels": labels, **histogram.summary()}
+                for labels, histogram in self.get_series(name)
+            ]
+            for name in names
+        }
+        for name in counter_names:
+            snapshot[name] = [
+                {"labels": labels, "value": counter.value}
+                for labels, counter in self.get_counters(name)
+            ]
+        for name in gauge_names:
+            snapshot[name] = [
+                {"labels": labels, "value": gauge.value}
+                for labels, gauge in self.get_gauges(name)
+            ]
+        return snapshot
+
+    def dump(self, path: str):
+        """Write a snapshot of all metrics to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            names = list(self._histograms)
+        for name in names:
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in self.get_series(name):
+                with histogram._lock:
+                    counts = list(histogram.bucket_counts)
+                    count, total = histogram.count, histogram.sum
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        with self._lock:
+            counter_names = list(self._counters)
+        for name in counter_names:
+            lines.append(f"# TYPE {name} counter")
+            for labels, counter in self.get_counters(name):
+                lines.append(f"{name}{_format_labels(labels)} {counter.value}")
+        with self._lock:
+            gauge_names = list(self._gauges)
+        for name in gauge_names:
+            lines.append(f"# TYPE {name} gauge")
+            for labels, gauge in self.get_gauges(name):
+                lines.append(f"{name}{_format_labels(labels)} {gauge.value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Remove all metrics"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+
+def _format_labels(labels: Dict[str, str], **extra) -> str:
+    """Format labels for the Prometheus text format"""
+    items = list(labels.items()) + [(k, str(v)) for k, v in extra.items()]
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class TurnTimer:
+    """
+    Times the phases of a single chat turn
+
+    Phases are recorded into the registry when the turn finishes:
+    chat_gate_seconds, chat_request_build_seconds, chat_ttft_seconds,
+    chat_inter_token_seconds, chat_generation_seconds and
+    chat_tokens_per_second, each labelled with personality, model and tier.
+    """
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, **labels: str):
+        """
+        Start timing a turn
+
+        Args:
+            registry: Registry to record into (defaults to REGISTRY)
+            **labels: Labels for every measurement
+        """
+        self.registry = registry or REGISTRY
+        self.labels = labels
+        self.started = time.perf_counter()
+        self.gate_seconds: Optional[float] = None
+        self.request_build_seconds: Optional[float] = None
+        self.request_sent: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.tokens = 0
+        self.gaps: List[float] = []
+
+    def gate_done(self):
+        """Mark the end of the feature gate and usage checks"""
+        self.gate_seconds = time.perf_counter() - self.started
+
+    def request_built(self, build_started: float):
+        """
+        Mark the prompt as built and about to be sent
+
+        Args:
+            build_started: perf_counter() value when building started
+        """
+        self.request_sent = time.perf_counter()
+        self.request_build_seconds = self.request_sent - build_started
+
+    def sent(self):
+        """Mark the request as sent upstream, once admission and quota waits are over"""
+        self.request_sent = time.perf_counter()
+
+    def token(self):
+        """Mark the arrival of a streamed delta"""
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        else:
+            self.gaps.append(now - self.last_token)
+        self.last_token = now
+        self.tokens += 1
+
+    def finish(self):
+        """Record all phases of the turn in the registry"""
+        labels = self.labels
+        observe = self.registry.observe
+
+        if self.gate_seconds is not None:
+            observe("chat_gate_seconds", self.gate_seconds, **labels)
+        if self.request_build_seconds is not None:
+            observe("chat_request_build_seconds", self.request_build_seconds, **labels)
+        if self.first_token is None or self.request_sent is None:
+            return
+
+        observe("chat_ttft_seconds", self.first_token - self.request_sent, **labels)
+        inter_token = self.registry.histogram("chat_inter_token_seconds", **labels)
+        for gap in self.gaps:
+            inter_token.observe(gap)
+
+        generation = self.last_token - self.request_sent
+        observe("chat_generation_seconds", generation, **labels)
+        streaming = self.last_token - self.first_token
+        if streaming > 0 and self.tokens > 1:
+            observe("chat_tokens_per_second", (self.tokens - 1) / streaming, **labels)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Model Routing for 1-800-PHONESEX
+Sends short, simple turns to a fast small model and everything else to the
+large model, using a cheap local classifier
+"""
+
+import os
+import re
+from typing import List, Optional
+
+from metrics import MetricsRegistry, REGISTRY
+
+
+ROUTE_FAST = "fast"
+ROUTE_LARGE = "large"
+
+_SENTENCE_END = re.compile(r"[.!?]+(?:\s|$)")
+
+
+class RouteDecision:
+    """The model chosen for a turn and why"""
+
+    __slots__ = ("route", "model", "reason")
+
+    def __init__(self, route: str, model: str, reason: str):
+        self.route = route
+        self.model = model
+        self.reason = reason
+
+    def __repr__(self):
+        return f"RouteDecision(route={self.route!r}, model={self.model!r}, reason={self.reason!r})"
+
+
+class ModelRouter:
+    """Picks between the fast and large model for each turn"""
+
+    def __init__(self, large_model: str, fast_model: Optional[str] = None,
+                 enabled: Optional[bool] = None, max_fast_chars: Optional[int] = None,
+                 deep_turns: Optional[int] = None, pin_vip: Optional[bool] = None,
+                 large_personalities: Optional[List[str]] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize model router
+
+        Args:
+            large_model: Model for complex turns (the chatline's AI_MODEL)
+            fast_model: Model for simple turns (FAST_MODEL, default llama-3.1-8b-instant)
+            enabled: Whether routing is on (MODEL_ROUTING, default false)
+            max_fast_chars: Longest message sent to the fast model
+                (ROUTER_FAST_MAX_CHARS, default 60)
+            deep_turns: Conversation length (messages) from which every turn
+                uses the large model to keep long sessions coherent
+                (ROUTER_DEEP_TURNS, default 40)
+            pin_vip: Always use the large model for VIP callers
+                (ROUTER_PIN_VIP, default true)
+            large_personalities: Operators that always use the large model
+                (ROUTER_LARGE_PERSONALITIES, comma separated)
+            metrics: Registry for per-route counters
+        """
+        self.large_model = large_model
+        self.fast_model = fast_model or os.getenv("FAST_MODEL", "llama-3.1-8b-instant")
+        if enabled is None:
+            enabled = os.getenv("MODEL_ROUTING", "false").lower() == "true"
+        self.enabled = enabled
+        self.max_fast_chars = max_fast_chars if max_fast_chars is not None else int(
+            os.getenv("ROUTER_FAST_MAX_CHARS", "60"))
+        self.deep_turns = deep_turns if deep_turns is not None else int(
+            os.getenv("ROUTER_DEEP_TURNS", "40"))
+        if pin_vip is None:
+            pin_vip = os.getenv("ROUTER_PIN_VIP", "true").lower() == "true"
+        self.pin_vip = pin_vip
+        if large_personalities is None:
+            large_personalities = [
+                name.strip() for name in os.getenv("ROUTER_LARGE_PERSONALITIES", "").split(",")
+                if name.strip()
+            ]
+        self.large_personalities = set(large_personalities)
+        self.metrics = metrics or REGISTRY
+
+    def classify(self, message: str, turn_depth: int, personality_name: str,
+                 tier: str) -> RouteDecision:
+        """
+        Choose the model for a turn
+
+        Args:
+            message: The caller's message
+            turn_depth: Messages already exchanged in the session
+            personality_name: Current operator
+            tier: Caller's subscription tier value ("free", "premium", "vip")
+
+        Returns:
+            Route decision
+        """
+        if not self.enabled:
+            return RouteDecision(ROUTE_LARGE, self.large_model, "routing_disabled")
+        if self.pin_vip and tier == "vip":
+            return RouteDecision(ROUTE_LARGE, self.large_model, "vip_pinned")
+        if personality_name in self.large_personalities:
+            return RouteDecision(ROUTE_LARGE, self.large_model, "personality")
+        if turn_depth >= self.deep_turns:
+            return RouteDecision(ROUTE_LARGE, self.large_model, "deep_session")
+
+        text = message.strip()
+        if len(text) > self.max_fast_chars:
+            return RouteDecision(ROUTE_LARGE, self.large_model, "long_message")
+        if len(_SENTENCE_END.findall(text)) > 1 or "\n" in text:
+            return RouteDecision(ROUTE_LARGE, self.large_model, "multi_sentence")
+
+        return RouteDecision(ROUTE_FAST, self.fast_model, "short_message")
+
+    def route(self, message: str, turn_depth: int, personality_name: str,
+              tier: str) -> RouteDecision:
+        """
+        Choose the model for a turn and count the decision
+
+        Args:
+            message: The caller's message
+            turn_depth: Messages already exchanged in the session
+            personality_name: Current operator
+            tier: Caller's subscription tier value
+
+        Returns:
+            Route decision
+        """
+        decision = self.classify(message, turn_depth, personality_name, tier)
+        self.metrics.increment("chat_route_total", 1, route=decision.route, reason=decision.reason)
+        return decision
+
+    def record(self, decision: RouteDecision, tokens: int):
+        """
+        Record the streamed tokens of a routed turn, for per-route cost
+
+        Args:
+            decision: Route the turn took
+            tokens: Completion tokens (streamed deltas) produced
+        """
+        self.metrics.increment("chat_route_tokens_total", tokens,
+                               route=decision.route, model=decision.model)
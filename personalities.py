@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Personality Registry for 1-800-PHONESEX
+Indexes the operators by name, with the built-in presets optionally
+overridden or extended by JSON files and VIP callers' custom operators kept
+per user on disk. Files are re-read when they change, so prompts can be
+tuned without restarting workers.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from context_window import estimate_tokens, MESSAGE_OVERHEAD_TOKENS
+from messages import system_message
+
+
+Personality = Dict[str, str]
+
+
+class PersonalityPresets:
+    """Predefined AI personality presets for different conversation styles"""
+
+    FLIRTY = {
+        "name": "Flirty",
+        "icon": "💋",
+        "description": "Sultry seduction specialist",
+        "system_prompt": "You are a sultry, seductive phone sex operator with years of experience turning callers on. Your voice drips with desire and you know exactly how to tease and please. Be explicitly flirtatious, sensual, and provocative. Use vivid, adult language to describe intimate scenarios. You're confident, sexually liberated, and love making callers fantasize. Build tension with suggestive descriptions and make every word count. This is a 1-800 late night experience - be bold, be naughty, be unforgettable."
+    }
+
+    ROMANTIC = {
+        "name": "Romantic",
+        "icon": "❤️",
+        "description": "Passionate lover with X-rated intensity",
+        "system_prompt": "You are a passionate, sensual lover who combines deep romance with explicit desire. You speak of love and lust in equal measure, painting intimate pictures of tender yet intensely physical encounters. Your words caress and arouse, blending emotional connection with raw sexual energy. You're the midnight whisper that tells callers exactly how you'd worship their body while making them feel cherished and desired. Be explicit but emotionally intense - this is romantic passion with an X-rated edge."
+    }
+
+    ADVENTUROUS = {
+        "name": "Adventurous",
+        "icon": "🔥",
+        "description": "Kinky fantasy expert",
+        "system_prompt": "You are a wild, uninhibited phone sex operator who specializes in kinky fantasies and taboo desires. Nothing is off limits - you're open-minded, adventurous, and eager to explore the caller's deepest, darkest fantasies. Be explicitly descriptive about wild scenarios, roleplay, and erotic adventures. You thrive on pushing boundaries and getting callers to confess their hidden desires. Your energy is electric, your imagination limitless, and your descriptions intensely graphic. This is the kinky hotline where fantasies come alive."
+    }
+
+    MYSTERIOUS = {
+        "name": "Mysterious",
+        "icon": "🌙",
+        "description": "Enigmatic late-night seductress",
+        "system_prompt": "You are an enigmatic seductress who operates in shadows and whispers. Your sultry voice hints at forbidden pleasures and secret desires. You're deliberately vague about your identity but explicit about what you want to do. Build intense sexual tension through suggestion and mystery, making callers imagine the most erotic scenarios. You're the fantasy they can't quite grasp but desperately crave. Use sensual, provocative language that leaves them aching for more. You're the late-night mystery that haunts their dreams."
+    }
+
+    PLAYFUL = {
+        "name": "Playful",
+        "icon": "😈",
+        "description": "Naughty tease with dirty mind",
+        "system_prompt": "You are a naughty, giggling phone sex operator who treats every call like sexy playtime. You're mischievous, cheeky, and love dirty talk with a playful twist. Tease mercilessly, use explicit language with a fun edge, and make callers laugh while turning them on. You're the girl next door who's secretly a freak, combining innocent giggles with filthy suggestions. Keep it light but intensely sexual - you're here to have fun while getting everyone hot and bothered. Think sexy pillow talk meets dirty jokes."
+    }
+
+    @classmethod
+    def all(cls) -> Tuple[Personality, ...]:
+        """Get the presets in menu order"""
+        return (cls.FLIRTY, cls.ROMANTIC, cls.ADVENTUROUS, cls.MYSTERIOUS, cls.PLAYFUL)
+
+    @classmethod
+    def get(cls, name: str) -> Optional[Personality]:
+        """Get a preset by its name, or None if there is no such preset"""
+        return _PRESETS_BY_NAME.get(name)
+
+
+_PRESETS_BY_NAME = {preset["name"]: preset for preset in PersonalityPresets.all()}
+
+# Longest custom system prompt a caller may save
+MAX_CUSTOM_PROMPT_CHARS = 4000
+
+
+def _prepare(personality: Personality) -> Personality:
+    """Count the system prompt's tokens once, on its shared message"""
+    message = system_message(personality["system_prompt"])
+    if message.tokens is None:
+        message.tokens = estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+    return personality
+
+
+def _valid(entry) -> bool:
+    """Check that a loaded entry has a name and a system prompt"""
+    return (isinstance(entry, dict)
+            and isinstance(entry.get("name"), str) and entry["name"].strip() != ""
+            and isinstance(entry.get("system_prompt"), str) and entry["system_prompt"].strip() != "")
+
+
+class _UserPersonalities:
+    """One caller's custom personalities as last read from disk"""
+
+    __slots__ = ("stamp", "checked", "by_name", "listing")
+
+    def __init__(self, stamp, personalities: List[Personality]):
+        self.stamp = stamp
+        self.checked = time.monotonic()
+        self.by_name = {p["name"]: p for p in personalities}
+        self.listing = tuple(personalities)
+
+
+class PersonalityRegistry:
+    """
+    Name-indexed personalities with file-backed overrides and custom operators
+
+    Layout of the personality directory:
+
+        personalities/*.json          Operators (an object or a list of them)
+                                      that replace presets of the same name
+                                      or add new ones
+        personalities/users/*.json    A caller's custom operators
+
+    Each operator has "name" and "system_prompt", and optionally "icon" and
+    "description".
+    """
+
+    _shared: Optional['PersonalityRegistry'] = None
+
+    def __init__(self, directory: Optional[str] = None, reload_interval: Optional[float] = None,
+                 max_users: Optional[int] = None):
+        """
+        Initialize registry
+
+        Args:
+            directory: Personality directory (PERSONALITY_DIR, default ./personalities)
+            reload_interval: Seconds between checks for changed files
+                (PERSONALITY_RELOAD_SECONDS, default 2; 0 checks on every lookup)
+            max_users: Callers whose custom personalities are kept in memory,
+                least recently used dropped first (PERSONALITY_USER_CACHE,
+                default 1024)
+        """
+        self.directory = Path(directory or os.getenv("PERSONALITY_DIR", "./personalities"))
+        if reload_interval is None:
+            reload_interval = float(os.getenv("PERSONALITY_RELOAD_SECONDS", "2"))
+        self.reload_interval = reload_interval
+        if max_users is None:
+            max_users = int(os.getenv("PERSONALITY_USER_CACHE", "1024"))
+        self.max_users = max_users
+
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked = time.monotonic()
+        self._by_name: Dict[str, Personality] = {}
+        self._listing: Tuple[Personality, ...] = ()
+        # Only callers that have custom personalities are cached
+        self._users: 'OrderedDict[str, _UserPersonalities]' = OrderedDict()
+        self._users_lock = threading.Lock()
+        self._load_builtin(self._builtin_stamp())
+
+    @classmethod
+    def shared(cls) -> 'PersonalityRegistry':
+        """Get the process-wide registry"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    # Lookup
+
+    def get(self, name: str, user_id: Optional[str] = None) -> Optional[Personality]:
+        """
+        Get a personality by name
+
+        Args:
+            name: Personality name
+            user_id: Also look among this caller's custom personalities
+
+        Returns:
+            The personality, or None if there is none by that name
+        """
+        self._maybe_reload()
+        if user_id is not None:
+            personality = self._user(user_id).by_name.get(name)
+            if personality is not None:
+                return personality
+        return self._by_name.get(name)
+
+    def list(self, user_id: Optional[str] = None) -> Tuple[Personality, ...]:
+        """
+        Get the personalities in menu order
+
+        Args:
+            user_id: Append this caller's custom personalities
+
+        Returns:
+            Built-in personalities followed by the caller's own
+        """
+        self._maybe_reload()
+        if user_id is None:
+            return self._listing
+        return self._listing + self._user(user_id).listing
+
+    def default(self) -> Personality:
+        """Get the personality new sessions start with"""
+        self._maybe_reload()
+        return self._listing[0]
+
+    # Custom personalities
+
+    def add_custom(self, user, name: str, system_prompt: str, description: str = "") -> Personality:
+        """
+        Create or replace one of a caller's custom personalities
+
+        Args:
+            user: User object (their plan must include custom personalities)
+            name: Personality name
+            system_prompt: System prompt
+            description: Short description for the menu
+
+        Returns:
+            The saved personality
+
+        Raises:
+            ValueError: If the plan does not allow it, all slots are taken
+                or the name or prompt is not usable
+        """
+        if not user.can_create_custom_personality():
+            raise ValueError("Custom personalities require a VIP subscription")
+        name = name.strip()
+        if not name or not system_prompt.strip():
+            raise ValueError("A custom personality needs a name and a system prompt")
+        if len(system_prompt) > MAX_CUSTOM_PROMPT_CHARS:
+            raise ValueError(f"System prompt is longer than {MAX_CUSTOM_PROMPT_CHARS} characters")
+        if self.get(name) is not None:
+            raise ValueError(f"{name} is already one of our operators")
+
+        with self._lock:
+            current = self._read_user(user.user_id)
+            slots = user.get_features().get("custom_personality_slots", 0)
+            if name not in current.by_name and len(current.listing) >= slots:
+                raise ValueError(f"All {slots} custom personality slots are in use")
+            personality = {
+                "name": name,
+                "icon": "✨",
+                "description": description,
+                "system_prompt": system_prompt,
+                "owner": user.user_id,
+            }
+            kept = [p for p in current.listing if p["name"] != name]
+            return self._write_user(user.user_id, kept + [personality]).by_name[name]
+
+    def remove_custom(self, user_id: str, name: str) -> bool:
+        """
+        Delete one of a caller's custom personalities
+
+        Returns:
+            True if it existed
+        """
+        with self._lock:
+            current = self._read_user(user_id)
+            if name not in current.by_name:
+                return False
+            self._write_user(user_id, [p for p in current.listing if p["name"] != name])
+        return True
+
+    # Loading
+
+    def _maybe_reload(self):
+        """Reload the operator files if they changed (checked once per interval)"""
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.reload_interval:
+                return
+            stamp = self._builtin_stamp()
+            if stamp != self._stamp:
+                self._load_builtin(stamp)
+            self._checked = now
+
+    def _builtin_stamp(self):
+        """Name, mtime and size of every operator file"""
+        try:
+            return tuple(sorted(
+                (p.name, p.stat().st_mtime_ns, p.stat().st_size) for p in self.directory.glob("*.json")
+            ))
+        except OSError:
+            return None
+
+    def _load_builtin(self, stamp):
+        """Build the index from the presets and the operator files"""
+        by_name = {preset["name"]: preset for preset in PersonalityPresets.all()}
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                entries = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                # Likely caught mid-save; keep what we have and retry next check
+                print(f"⚠️  Could not load personalities from {path.name}: {e}")
+                if self._listing:
+                    return
+                continue
+            for entry in entries if isinstance(entries, list) else [entries]:
+                if _valid(entry):
+                    by_name[entry["name"]] = {k: v for k, v in entry.items() if k != "owner"}
+
+        for personality in by_name.values():
+            _prepare(personality)
+        self._by_name = by_name
+        self._listing = tuple(by_name.values())
+        self._stamp = stamp
+
+    def _user_path(self, user_id: str) -> Path:
+        """Custom personality file for a caller (ids are hashed, so any string is safe)"""
+        import hashlib
+        digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+        return self.directory / "users" / f"{digest}.json"
+
+    def _user(self, user_id: str) -> _UserPersonalities:
+        """A caller's custom personalities, re-read if their file changed"""
+        with self._users_lock:
+            cached = self._users.get(user_id)
+            if cached is not None:
+                self._users.move_to_end(user_id)
+        if cached is not None and time.monotonic() - cached.checked < self.reload_interval:
+            return cached
+        return self._read_user(user_id)
+
+    def _read_user(self, user_id: str) -> _UserPersonalities:
+        """
+        Load a caller's file if it changed since it was cached
+
+        The file is checked and read without holding the registry lock;
+        add_custom() and remove_custom() hold it to serialize their writes.
+        """
+        path = self._user_path(user_id)
+        try:
+            stat = path.stat()
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+
+        with self._users_lock:
+            cached = self._users.get(user_id)
+        if cached is not None and cached.stamp == stamp:
+            cached.checked = time.monotonic()
+            return cached
+        if stamp is None:
+            # Remember that there is no file, so the next message doesn't stat again
+            return self._cache_user(user_id, _UserPersonalities(None, []))
+
+        try:
+            entries = json.loads(path.read_text(encoding="utf-8"))
+            personalities = [dict(e, owner=user_id) for e in entries if _valid(e)]
+        except (OSError, ValueError, TypeError) as e:
+            print(f"⚠️  Could not load custom personalities for {user_id}: {e}")
+            return cached if cached is not None else _UserPersonalities(None, [])
+        for personality in personalities:
+            _prepare(personality)
+        return self._cache_user(user_id, _UserPersonalities(stamp, personalities))
+
+    def _cache_user(self, user_id: str, loaded: _UserPersonalities) -> _UserPersonalities:
+        """Keep a caller's personalities, evicting the least recently used caller"""
+        with self._users_lock:
+            self._users[user_id] = loaded
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return loaded
+
+    def _forget_user(self, user_id: str):
+        """Drop a caller's cached personalities"""
+        with self._users_lock:
+            self._users.pop(user_id, None)
+
+    def _write_user(self, user_id: str, personalities: List[Personality]) -> _UserPersonalities:
+        """Save a caller's custom personalities atomically (caller holds the registry lock)"""
+        path = self._user_path(user_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        # The owner is implied by the file
+        data = [{k: v for k, v in p.items() if k != "owner"} for p in personalities]
+        tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        self._forget_user(user_id)
+        return self._read_user(user_id)
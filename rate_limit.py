@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Upstream Rate Limiting for 1-800-PHONESEX
+Process-wide requests/min and tokens/min buckets shared by every chat
+session and the voice agent, so callers queue briefly instead of hitting
+GROQ 429s
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from metrics import MetricsRegistry, REGISTRY
+from resilience import UpstreamUnavailable, wait_within
+
+
+class RateLimitTimeout(UpstreamUnavailable):
+    """The caller waited longer than allowed for upstream quota"""
+
+
+class TokenBucket:
+    """Bucket refilled continuously up to its capacity (not thread-safe on its own)"""
+
+    def __init__(self, per_minute: float):
+        """
+        Initialize token bucket
+
+        Args:
+            per_minute: Quota per minute, also the burst capacity
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        """Add the quota accrued since the last update"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it already is)"""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        """Remove quota (may go negative when settling over-use)"""
+        self.level -= amount
+
+    def give(self, amount: float):
+        """Return unused quota"""
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Reservation:
+    """Quota held for one upstream request until it is settled"""
+
+    def __init__(self, limiter: Optional['UpstreamLimiter'], tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.settled = False
+
+    def settle(self, used_tokens: int):
+        """
+        Settle the reservation with the tokens actually used
+
+        The unused part of the estimate is refunded; over-use is charged so
+        the bucket stays honest. Settling twice has no effect.
+
+        Args:
+            used_tokens: Prompt plus completion tokens consumed
+        """
+        if self.settled:
+            return
+        self.settled = True
+        if self.limiter is not None:
+            self.limiter._adjust(self.tokens - used_tokens)
+
+    def release(self):
+        """Refund the whole reservation (the request was never sent)"""
+        self.settle(0)
+
+
+class UpstreamLimiter:
+    """
+    Fair token-bucket limiter for GROQ requests and tokens
+
+    Waiters are served strictly in arrival order, whether they wait on a
+    thread or on the event loop. Nobody polls: the waiter at the head of the
+    line sleeps until its quota has refilled, and is woken early by refunds;
+    the others sleep until they reach the head.
+    """
+
+    _shared: Optional['UpstreamLimiter'] = None
+
+    def __init__(self, requests_per_minute: Optional[int] = None,
+                 tokens_per_minute: Optional[int] = None, max_wait: Optional[float] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize limiter
+
+        Args:
+            requests_per_minute: Request quota (GROQ_RPM, default 0 = unlimited)
+            tokens_per_minute: Token quota (GROQ_TPM, default 0 = unlimited)
+            max_wait: Longest a caller waits in line, in seconds
+                (LIMITER_MAX_WAIT, default 10)
+            metrics: Registry for wait-time histograms
+        """
+        rpm = requests_per_minute if requests_per_minute is not None else int(os.getenv("GROQ_RPM", "0"))
+        tpm = tokens_per_minute if tokens_per_minute is not None else int(os.getenv("GROQ_TPM", "0"))
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("LIMITER_MAX_WAIT", "10"))
+        self.metrics = metrics or REGISTRY
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue = deque()
+        self._next_ticket = 0
+        # Ticket -> callback waking an event-loop waiter
+        self._wakers: Dict[int, Callable[[], None]] = {}
+
+    @classmethod
+    def shared(cls) -> 'UpstreamLimiter':
+        """Get the process-wide limiter configured from the environment"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any quota is configured"""
+        return self.requests is not None or self.tokens is not None
+
+    def _try_acquire(self, ticket: int, cost: int) -> float:
+        """
+        Take quota for a waiter if it is at the head of the line
+
+        Returns:
+            0 if acquired, otherwise seconds until it may be possible
+            (infinite while others are ahead in line)
+        """
+        if self._queue[0] != ticket:
+            return float("inf")
+        now = time.monotonic()
+        wait = 0.0
+        for bucket, amount in ((self.requests, 1), (self.tokens, cost)):
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait_time(amount))
+        if wait > 0:
+            return wait
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(cost)
+        self._queue.popleft()
+        self._notify()
+        return 0.0
+
+    def _leave(self, ticket: int):
+        """Remove a waiter that gave up (caller holds the lock)"""
+        try:
+            self._queue.remove(ticket)
+        except ValueError:
+            pass
+        self._notify()
+
+    def _adjust(self, refund: int):
+        """Return (or, if negative, charge) tokens after a request settles"""
+        if self.tokens is None or refund == 0:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            if refund > 0:
+                self.tokens.give(refund)
+            else:
+                self.tokens.take(-refund)
+            self._notify()
+
+    def _notify(self):
+        """Wake waiting threads and the event-loop waiter at the head of the line (caller holds the lock)"""
+        self._changed.notify_all()
+        if self._queue:
+            waker = self._wakers.get(self._queue[0])
+            if waker is not None:
+                waker()
+
+    def _enqueue(self) -> int:
+        """Take a ticket at the back of the line (caller holds the lock)"""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+        self._queue.append(ticket)
+        return ticket
+
+    def acquire(self, tokens: int, timeout: Optional[float] = None) -> Reservation:
+        """
+        Wait in line for one request and an estimated token cost
+
+        Args:
+            tokens: Estimated tokens (prompt plus max_tokens)
+            timeout: Longest wait in seconds (defaults to max_wait)
+
+        Returns:
+            Reservation to settle once the request finishes
+
+        Raises:
+            RateLimitTimeout: If quota is not available in time
+        """
+        if not self.enabled:
+            return Reservation(None, tokens)
+
+        timeout = self.max_wait if timeout is None else timeout
+        started = time.monotonic()
+        with self._lock:
+            ticket = self._enqueue()
+            try:
+                while True:
+                    wait = self._try_acquire(ticket, tokens)
+                    if wait == 0:
+                        break
+                    remaining = started + timeout - time.monotonic()
+                    if remaining <= 0:
+                        raise RateLimitTimeout("Upstream quota exhausted")
+                    self._changed.wait(min(wait, remaining))
+            except BaseException:
+                # Also on Ctrl-C, so a dead ticket never blocks the head of the line
+                self._leave(ticket)
+                raise
+
+        self.metrics.observe("chat_limiter_wait_seconds", time.monotonic() - started)
+        return Reservation(self, tokens)
+
+    async def acquire_async(self, tokens: int, timeout: Optional[float] = None) -> Reservation:
+        """Async version of acquire(), waiting without blocking the loop"""
+        import asyncio
+        if not self.enabled:
+            return Reservation(None, tokens)
+
+        timeout = self.max_wait if timeout is None else timeout
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+        with self._lock:
+            ticket = self._enqueue()
+            self._wakers[ticket] = lambda: loop.call_soon_threadsafe(woken.set)
+        try:
+            while True:
+                # Cleared before checking, so a wake-up from now on is not lost
+                woken.clear()
+                with self._lock:
+                    wait = self._try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                remaining = started + timeout - time.monotonic()
+                if remaining <= 0:
+                    raise RateLimitTimeout("Upstream quota exhausted")
+                try:
+                    await wait_within(woken.wait(), min(wait, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._lock:
+                self._leave(ticket)
+            raise
+        finally:
+            with self._lock:
+                self._wakers.pop(ticket, None)
+
+        self.metrics.observe("chat_limiter_wait_seconds", time.monotonic() - started)
+        return Reservation(self, tokens)
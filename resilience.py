@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+"""
+Upstream Resilience for 1-800-PHONESEX
+Retries with jittered backoff, time-to-first-token and stall deadlines and
+optional hedged requests for GROQ completions
+"""
+
+import os
+import time
+import queue
+import random
+import threading
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+
+from metrics import Histogram, MetricsRegistry, REGISTRY
+
+if TYPE_CHECKING:
+    from rate_limit import UpstreamLimiter
+
+
+# Minimum time-to-first-token samples before the p95 is trusted for hedging
+HEDGE_MIN_SAMPLES = 50
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class FirstTokenTimeout(Exception):
+    """The first token did not arrive before the deadline"""
+
+
+class UpstreamUnavailable(Exception):
+    """GROQ could not produce a reply after all attempts"""
+
+
+class StreamStalled(UpstreamUnavailable):
+    """The reply stopped arriving partway through"""
+
+
+class GenerationCancelled(Exception):
+    """The caller interrupted or hung up before the reply finished"""
+
+
+class CancelToken:
+    """Thread-safe signal that stops an in-flight generation"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether cancel() has been called"""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the generation (safe from any thread, and more than once)"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Run callback on cancellation (right away if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds, returning True early if cancelled"""
+        return self._event.wait(timeout)
+
+
+async def wait_within(awaitable: Awaitable[Any], timeout: Optional[float]) -> Any:
+    """
+    Await with a timeout without losing a cancellation of the waiting task
+
+    asyncio.wait_for() can swallow a task cancellation that arrives just as
+    the awaited result does (CPython gh-86296), leaving a cancelled turn
+    generating to the end. asyncio.timeout() (Python 3.11+) cannot, so it is
+    used where available.
+
+    Args:
+        awaitable: What to wait for
+        timeout: Seconds to wait (None waits forever)
+
+    Returns:
+        The awaitable's result
+
+    Raises:
+        asyncio.TimeoutError: If the timeout expires first
+    """
+    import asyncio
+    if hasattr(asyncio, "timeout"):
+        async with asyncio.timeout(timeout):
+            return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Check if a failed attempt is worth retrying
+
+    Connection problems, timeouts, rate limits and server errors are
+    retryable; bad requests and authentication failures are not.
+
+    Args:
+        error: Exception raised by the attempt
+
+    Returns:
+        True if the request should be retried
+    """
+    # Imported here so importing this module does not pull in the SDK
+    import groq
+    if isinstance(error, (FirstTokenTimeout, groq.APIConnectionError)):
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def _delta_text(chunk: Any) -> Optional[str]:
+    """Get the text delta of a streamed completion chunk"""
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return None
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Get the server's Retry-After hint in seconds, if any"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Attempt:
+    """One streaming request running on a worker thread"""
+
+    def __init__(self, open_stream: Callable[[], Any], events: 'queue.Queue'):
+        self.open_stream = open_stream
+        self.events = events
+        self.stream = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self._run, daemon=True, name="groq-attempt")
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        """Stop the attempt and close its HTTP stream"""
+        self.cancelled = True
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        try:
+            self.stream = self.open_stream()
+            if self.cancelled:
+                self.stream.close()
+                return
+            for chunk in self.stream:
+                if self.cancelled:
+                    return
+                content = _delta_text(chunk)
+                if content:
+                    self.events.put((self, "delta", content))
+            self.events.put((self, "done", None))
+        except Exception as e:
+            if not self.cancelled:
+                self.events.put((self, "error", e))
+        finally:
+            if self.cancelled and self.stream is not None:
+                try:
+                    self.stream.close()
+                except Exception:
+                    pass
+
+
+class _Call(_Attempt):
+    """
+    One non-streaming request running on a worker thread
+
+    A cancelled call cannot be interrupted; its thread is left to finish
+    and its result is dropped.
+    """
+
+    def _run(self):
+        try:
+            result = self.open_stream()
+        except Exception as e:
+            if not self.cancelled:
+                self.events.put((self, "error", e))
+        else:
+            if not self.cancelled:
+                self.events.put((self, "result", result))
+
+
+class ResiliencePolicy:
+    """
+    Retry, deadline and hedging rules for upstream completions
+
+    Retries only happen before the first token is delivered; once text has
+    reached the caller a failure is raised rather than repeated. Exhausted
+    retries raise UpstreamUnavailable; errors that retrying cannot fix, such
+    as bad requests or authentication failures, are raised unchanged.
+    """
+
+    def __init__(self, max_attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None, first_token_timeout: Optional[float] = None,
+                 hedge: Optional[bool] = None, hedge_delay: Optional[float] = None,
+                 stall_timeout: Optional[float] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize resilience policy
+
+        Args:
+            max_attempts: Attempts per request (UPSTREAM_MAX_ATTEMPTS, default 3)
+            base_delay: Backoff base in seconds (UPSTREAM_RETRY_BASE_DELAY, default 0.25)
+            max_delay: Backoff cap in seconds (UPSTREAM_RETRY_MAX_DELAY, default 4)
+            first_token_timeout: Seconds to wait for the first token before the
+                attempt is abandoned (FIRST_TOKEN_TIMEOUT, default 10, 0 disables)
+            hedge: Fire a second request when the first token is late
+                (HEDGE_REQUESTS, default false)
+            hedge_delay: Seconds before hedging while too few latency samples
+                exist to use the observed p95 (HEDGE_DELAY, default 1.5)
+            stall_timeout: Longest gap in seconds between tokens once the
+                reply has started (STREAM_STALL_TIMEOUT, default 10, 0 disables)
+            metrics: Registry for attempt and hedge counters
+        """
+        def setting(value, name, default, cast):
+            return value if value is not None else cast(os.getenv(name, default))
+
+        self.max_attempts = max(1, setting(max_attempts, "UPSTREAM_MAX_ATTEMPTS", "3", int))
+        self.base_delay = setting(base_delay, "UPSTREAM_RETRY_BASE_DELAY", "0.25", float)
+        self.max_delay = setting(max_delay, "UPSTREAM_RETRY_MAX_DELAY", "4", float)
+        self.first_token_timeout = setting(first_token_timeout, "FIRST_TOKEN_TIMEOUT", "10", float)
+        self.hedge = setting(hedge, "HEDGE_REQUESTS", "false", lambda v: str(v).lower() == "true")
+        self.hedge_delay = setting(hedge_delay, "HEDGE_DELAY", "1.5", float)
+        self.stall_timeout = setting(stall_timeout, "STREAM_STALL_TIMEOUT", "10", float)
+        self.metrics = metrics or REGISTRY
+
+    def backoff(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """
+        Get the delay before the next attempt (full jitter)
+
+        Args:
+            attempt: Number of attempts made so far
+            error: Error of the last attempt, for Retry-After hints
+
+        Returns:
+            Seconds to wait
+        """
+        hint = _retry_after(error) if error is not None else None
+        if hint is not None:
+            return min(hint, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def hedge_after(self, ttft: Optional[Histogram] = None) -> Optional[float]:
+        """
+        Get the delay after which a hedge request fires
+
+        Args:
+            ttft: Time-to-first-token histogram for this route
+
+        Returns:
+            Seconds to wait for the first token, or None if hedging is off
+        """
+        if not self.hedge:
+            return None
+        if ttft is not None and ttft.count >= HEDGE_MIN_SAMPLES:
+            p95 = ttft.percentile(95)
+            if p95:
+                return p95
+        return self.hedge_delay
+
+    @staticmethod
+    def _reserve_retry(limiter: Optional['UpstreamLimiter'], prompt_tokens: int):
+        """
+        Wait for upstream quota before a retry
+
+        The retry is charged one request and its prompt tokens; what it
+        generates is settled on the turn's own reservation.
+
+        Raises:
+            RateLimitTimeout: If quota is not available in time
+        """
+        if limiter is not None:
+            limiter.acquire(prompt_tokens).settle(prompt_tokens)
+
+    @staticmethod
+    async def _reserve_retry_async(limiter: Optional['UpstreamLimiter'], prompt_tokens: int):
+        """Async version of _reserve_retry()"""
+        if limiter is not None:
+            (await limiter.acquire_async(prompt_tokens)).settle(prompt_tokens)
+
+    @staticmethod
+    def _reserve_hedge(limiter: Optional['UpstreamLimiter'], prompt_tokens: int) -> bool:
+        """Charge a hedge request if quota is available right now (a hedge never waits)"""
+        if limiter is None:
+            return True
+        try:
+            limiter.acquire(prompt_tokens, timeout=0).settle(prompt_tokens)
+        except UpstreamUnavailable:
+            return False
+        return True
+
+    def _record(self, attempts: int, hedged: bool, outcome: str, labels: dict):
+        """Count attempts and hedges for a finished request"""
+        self.metrics.increment("chat_upstream_attempts_total", attempts, **labels)
+        if hedged:
+            self.metrics.increment("chat_upstream_hedges_total", 1, **labels)
+        self.metrics.increment("chat_upstream_requests_total", 1, outcome=outcome, **labels)
+
+    def call(self, fn: Callable[[], Any], hedge_after: Optional[float] = None,
+             labels: Optional[dict] = None, limiter: Optional['UpstreamLimiter'] = None,
+             prompt_tokens: int = 0) -> Any:
+        """
+        Make a non-streaming request with retries, a deadline and hedging
+
+        The whole reply is the first response here, so first_token_timeout
+        bounds each attempt and hedge_after is measured against it.
+
+        Args:
+            fn: Function performing the request
+            hedge_after: Seconds without a response before hedging
+                (None disables hedging)
+            labels: Metric labels
+            limiter: Limiter charged for every retry and hedge (the first
+                attempt is covered by the caller's own reservation)
+            prompt_tokens: Prompt tokens charged per extra attempt
+
+        Returns:
+            The function's result
+
+        Raises:
+            UpstreamUnavailable: If every attempt failed with a retryable error
+                or missed the deadline
+        """
+        _, result, _ = self._first(lambda events: _Call(fn, events), hedge_after,
+                                   labels or {}, None, limiter, prompt_tokens)
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]], hedge_after: Optional[float] = None,
+                    labels: Optional[dict] = None, limiter: Optional['UpstreamLimiter'] = None,
+                    prompt_tokens: int = 0) -> Any:
+        """Async version of call()"""
+        import asyncio
+
+        async def run(events: asyncio.Queue, tag: int):
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await events.put((tag, "error", e))
+            else:
+                await events.put((tag, "result", result))
+
+        _, result, _, _ = await self._afirst(run, hedge_after, labels or {}, None,
+                                             limiter, prompt_tokens)
+        return result
+
+    def stream(self, open_stream: Callable[[], Any], hedge_after: Optional[float] = None,
+               labels: Optional[dict] = None, cancel: Optional[CancelToken] = None,
+               limiter: Optional['UpstreamLimiter'] = None, prompt_tokens: int = 0) -> Iterator[str]:
+        """
+        Stream a completion with retries, a first-token deadline and hedging
+
+        Args:
+            open_stream: Function starting a streaming completion
+            hedge_after: Seconds without a first token before hedging
+                (None disables hedging)
+            labels: Metric labels
+            cancel: Token that closes every attempt's stream when cancelled
+            limiter: Limiter charged for every retry and hedge (the first
+                attempt is covered by the caller's own reservation); hedges
+                are skipped when no quota is available right away
+            prompt_tokens: Prompt tokens charged per extra attempt
+
+        Yields:
+            Reply text deltas from the winning attempt
+
+        Raises:
+            GenerationCancelled: If the token is cancelled before the end
+            StreamStalled: If no token arrives for stall_timeout seconds
+                after the first
+            UpstreamUnavailable: If every attempt failed with a retryable error
+        """
+        winner, first, events = self._first(lambda events: _Attempt(open_stream, events),
+                                            hedge_after, labels or {}, cancel, limiter,
+                                            prompt_tokens)
+        stall = self.stall_timeout if self.stall_timeout > 0 else None
+        try:
+            if first is None:  # Finished without any text
+                return
+            yield first
+            while True:
+                try:
+                    attempt, kind, value = events.get(timeout=stall)
+                except queue.Empty:
+                    raise StreamStalled(f"No token for {stall:.1f}s") from None
+                if kind == "cancelled":
+                    raise GenerationCancelled("Generation cancelled")
+                if attempt is not winner:
+                    continue
+                if kind == "delta":
+                    yield value
+                elif kind == "done":
+                    return
+                else:
+                    raise value
+        finally:
+            winner.cancel()
+
+    def _first(self, start: Callable[['queue.Queue'], _Attempt], hedge_after: Optional[float],
+               labels: dict, cancel: Optional[CancelToken],
+               limiter: Optional['UpstreamLimiter'], prompt_tokens: int):
+        """
+        Race attempts until one delivers its first event, retrying failures
+
+        Returns:
+            The winning attempt, its first text or result, and the event queue
+        """
+        attempts = 0
+        hedged = False
+
+        while True:
+            events: 'queue.Queue' = queue.Queue()
+            live: List[_Attempt] = [start(events)]
+            if cancel is not None:
+                # Close the HTTP streams right away, even if nobody is reading
+                cancel.on_cancel(lambda events=events, live=live: (
+                    [attempt.cancel() for attempt in list(live)],
+                    events.put((None, "cancelled", None)),
+                ))
+            live[0].start()
+            attempts += 1
+            started = time.monotonic()
+            deadline = started + self.first_token_timeout if self.first_token_timeout > 0 else None
+            hedge_at = started + hedge_after if hedge_after is not None else None
+            winner = first = failure = None
+
+            try:
+                while winner is None and live:
+                    now = time.monotonic()
+                    wake = min(t for t in (deadline, hedge_at, now + 60) if t is not None)
+                    try:
+                        attempt, kind, value = events.get(timeout=max(wake - now, 0))
+                    except queue.Empty:
+                        now = time.monotonic()
+                        if hedge_at is not None and now >= hedge_at:
+                            hedge_at = None
+                            if self._reserve_hedge(limiter, prompt_tokens):
+                                hedged = True
+                                attempts += 1
+                                backup = start(events)
+                                live.append(backup)
+                                backup.start()
+                        elif deadline is not None and now >= deadline:
+                            failure = FirstTokenTimeout(
+                                f"No first token after {self.first_token_timeout:.1f}s"
+                            )
+                            break
+                        continue
+
+                    if kind == "cancelled":
+                        failure = GenerationCancelled("Generation cancelled")
+                        break
+                    if attempt.cancelled:
+                        continue
+                    if kind == "error":
+                        live.remove(attempt)
+                        failure = value
+                    else:
+                        winner, first = attempt, value
+            finally:
+                # Also runs on KeyboardInterrupt or when the consumer closes us
+                for attempt in live:
+                    if attempt is not winner:
+                        attempt.cancel()
+
+            if winner is not None:
+                break
+            if isinstance(failure, GenerationCancelled):
+                self._record(attempts, hedged, "cancelled", labels)
+                raise failure
+            if not is_retryable(failure):
+                self._record(attempts, hedged, "failed", labels)
+                raise failure
+            if attempts >= self.max_attempts:
+                self._record(attempts, hedged, "failed", labels)
+                raise UpstreamUnavailable(str(failure)) from failure
+            delay = self.backoff(attempts, failure)
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                self._record(attempts, hedged, "cancelled", labels)
+                raise GenerationCancelled("Generation cancelled")
+            self._reserve_retry(limiter, prompt_tokens)
+
+        self._record(attempts, hedged, "ok", labels)
+        return winner, first, events
+
+    async def astream(self, open_stream: Callable[[], Awaitable[Any]],
+                      hedge_after: Optional[float] = None,
+                      labels: Optional[dict] = None,
+                      cancel: Optional[CancelToken] = None,
+                      limiter: Optional['UpstreamLimiter'] = None,
+                      prompt_tokens: int = 0) -> AsyncIterator[str]:
+        """
+        Async version of stream(), running attempts as tasks on the loop
+
+        Cancelling the consuming task works too; the token is for callers
+        that cancel from elsewhere (another thread or another task).
+        """
+        import asyncio
+
+        async def run(events: asyncio.Queue, tag: int):
+            stream = None
+            try:
+                stream = await open_stream()
+                async for chunk in stream:
+                    content = _delta_text(chunk)
+                    if content:
+                        await events.put((tag, "delta", content))
+                await events.put((tag, "done", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await events.put((tag, "error", e))
+            finally:
+                if stream is not None:
+                    await stream.close()
+
+        winner, first, events, tasks = await self._afirst(run, hedge_after, labels or {}, cancel,
+                                                          limiter, prompt_tokens)
+        stall = self.stall_timeout if self.stall_timeout > 0 else None
+        try:
+            if first is None:  # Finished without any text
+                return
+            yield first
+            while True:
+                try:
+                    tag, kind, value = await wait_within(events.get(), stall)
+                except asyncio.TimeoutError:
+                    raise StreamStalled(f"No token for {stall:.1f}s") from None
+                if kind == "cancelled":
+                    raise GenerationCancelled("Generation cancelled")
+                if tag != winner:
+                    continue
+                if kind == "delta":
+                    yield value
+                elif kind == "done":
+                    return
+                else:
+                    raise value
+        finally:
+            tasks[winner].cancel()
+
+    async def _afirst(self, run: Callable[[Any, int], Awaitable[None]],
+                      hedge_after: Optional[float], labels: dict,
+                      cancel: Optional[CancelToken], limiter: Optional['UpstreamLimiter'],
+                      prompt_tokens: int):
+        """
+        Async version of _first(), running attempts as tasks on the loop
+
+        Returns:
+            The winning attempt's tag, its first text or result, the event
+            queue and the attempt tasks
+        """
+        import asyncio
+        attempts = 0
+        hedged = False
+
+        while True:
+            events: asyncio.Queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            tasks = {attempts: loop.create_task(run(events, attempts))}
+            if cancel is not None:
+                def on_cancel(events=events, tasks=tasks):
+                    for task in list(tasks.values()):
+                        task.cancel()
+                    events.put_nowait((None, "cancelled", None))
+                cancel.on_cancel(lambda on_cancel=on_cancel: loop.call_soon_threadsafe(on_cancel))
+            attempts += 1
+            started = loop.time()
+            deadline = started + self.first_token_timeout if self.first_token_timeout > 0 else None
+            hedge_at = started + hedge_after if hedge_after is not None else None
+            winner = first = failure = None
+
+            try:
+                while winner is None and tasks:
+                    now = loop.time()
+                    wake = min(t for t in (deadline, hedge_at, now + 60) if t is not None)
+                    try:
+                        tag, kind, value = await wait_within(events.get(), max(wake - now, 0))
+                    except asyncio.TimeoutError:
+                        now = loop.time()
+                        if hedge_at is not None and now >= hedge_at:
+                            hedge_at = None
+                            if self._reserve_hedge(limiter, prompt_tokens):
+                                hedged = True
+                                tasks[attempts] = loop.create_task(run(events, attempts))
+                                attempts += 1
+                        elif deadline is not None and now >= deadline:
+                            failure = FirstTokenTimeout(
+                                f"No first token after {self.first_token_timeout:.1f}s"
+                            )
+                            break
+                        continue
+
+                    if kind == "cancelled":
+                        failure = GenerationCancelled("Generation cancelled")
+                        break
+                    if tag not in tasks:
+                        continue
+                    if kind == "error":
+                        tasks.pop(tag)
+                        failure = value
+                    else:
+                        winner, first = tag, value
+            finally:
+                for tag, task in tasks.items():
+                    if tag != winner:
+                        task.cancel()
+
+            if winner is not None:
+                break
+            if isinstance(failure, GenerationCancelled):
+                self._record(attempts, hedged, "cancelled", labels)
+                raise failure
+            if not is_retryable(failure):
+                self._record(attempts, hedged, "failed", labels)
+                raise failure
+            if attempts >= self.max_attempts:
+                self._record(attempts, hedged, "failed", labels)
+                raise UpstreamUnavailable(str(failure)) from failure
+            await asyncio.sleep(self.backoff(attempts, failure))
+            if cancel is not None and cancel.cancelled:
+                self._record(attempts, hedged, "cancelled", labels)
+                raise GenerationCancelled("Generation cancelled")
+            await self._reserve_retry_async(limiter, prompt_tokens)
+
+        self._record(attempts, hedged, "ok", labels)
+        return winner, first, events, tasks
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Chat Session Manager for 1-800-PHONESEX
+Owns AdultChatline sessions by id, keeps the recently used ones in memory
+under a budget and hibernates the rest to compact on-disk snapshots that are
+rehydrated transparently on the caller's next message
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional
+
+from metrics import MetricsRegistry, REGISTRY
+
+
+SNAPSHOT_VERSION = 1
+
+# Approximate memory of an idle session object, excluding its history
+SESSION_BASE_BYTES = 2048
+
+# Approximate per-message overhead on top of the content string
+MESSAGE_BASE_BYTES = 64
+
+
+def estimate_session_bytes(chatline) -> int:
+    """
+    Estimate the memory a session holds
+
+    The shared system prompt message is not counted.
+
+    Args:
+        chatline: Chat session
+
+    Returns:
+        Approximate size in bytes
+    """
+    return SESSION_BASE_BYTES + sum(
+        MESSAGE_BASE_BYTES + sys.getsizeof(m["content"]) for m in chatline.conversation_history[1:]
+    )
+
+
+class _Resident:
+    """A session held in memory, or a placeholder while it is being loaded"""
+
+    __slots__ = ("chatline", "last_used", "in_use", "size", "lock")
+
+    def __init__(self, chatline=None, size: int = 0):
+        self.chatline = chatline
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.size = size
+        # Held while the session is created, rehydrated or hibernated
+        self.lock = threading.Lock()
+
+
+class ChatSessionManager:
+    """
+    Keeps chat sessions by id with LRU eviction and on-disk hibernation
+
+    Use session() around each turn so a session is never hibernated while a
+    reply is still streaming:
+
+        with manager.session(session_id, user=user) as chatline:
+            chatline.send_message(message)
+
+    The manager lock only guards the session table. Creating a session,
+    reading its snapshot and writing one happen under that session's own
+    lock, so one slow disk or factory never stalls other callers.
+    """
+
+    def __init__(self, factory: Optional[Callable] = None, snapshot_dir: Optional[str] = None,
+                 memory_budget: Optional[int] = None, idle_seconds: Optional[float] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize session manager
+
+        Args:
+            factory: Creates a session, called as
+                factory(user=user, session_id=session_id) (defaults to
+                AdultChatline with no terminal output)
+            snapshot_dir: Directory for hibernated sessions
+                (SESSION_DIR, default ./session_data)
+            memory_budget: Bytes of session state kept in memory
+                (SESSION_MEMORY_BUDGET_MB, default 256 MB)
+            idle_seconds: Idle time after which evict_idle() hibernates a
+                session (SESSION_IDLE_SECONDS, default 900)
+            metrics: Registry for hydration latency and eviction counters
+        """
+        if factory is None:
+            from chatline import AdultChatline, load_env
+            load_env()
+
+            def factory(user=None, session_id=None):
+                return AdultChatline(user=user, session_id=session_id, sinks=[])
+        self.factory = factory
+        self.snapshot_dir = Path(snapshot_dir or os.getenv("SESSION_DIR", "./session_data"))
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        if memory_budget is None:
+            memory_budget = int(float(os.getenv("SESSION_MEMORY_BUDGET_MB", "256")) * 1024 * 1024)
+        self.memory_budget = memory_budget
+        self.idle_seconds = idle_seconds if idle_seconds is not None else float(
+            os.getenv("SESSION_IDLE_SECONDS", "900"))
+        self.metrics = metrics or REGISTRY
+
+        self._sessions: 'OrderedDict[str, _Resident]' = OrderedDict()
+        self._memory = 0
+        self._lock = threading.RLock()
+        self._reaper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _snapshot_path(self, session_id: str) -> Path:
+        """Snapshot file for a session (ids are hashed, so any string is safe)"""
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return self.snapshot_dir / f"{digest}.snap"
+
+    @contextmanager
+    def session(self, session_id: str, user=None) -> Iterator:
+        """
+        Get a session for the duration of a turn, creating or rehydrating it
+
+        Args:
+            session_id: Session (or user) id
+            user: Optional user passed to the factory for new sessions
+
+        Yields:
+            The session's chatline
+        """
+        resident = self._checkout(session_id, user)
+        try:
+            yield resident.chatline
+        finally:
+            with self._lock:
+                resident.in_use -= 1
+                resident.last_used = time.monotonic()
+                if self._sessions.get(session_id) is resident:
+                    size = estimate_session_bytes(resident.chatline)
+                    self._memory += size - resident.size
+                    resident.size = size
+            self._enforce_budget()
+
+    def get(self, session_id: str, user=None):
+        """
+        Get a session, creating or rehydrating it
+
+        Prefer session() when the caller is about to send a message.
+
+        Args:
+            session_id: Session (or user) id
+            user: Optional user passed to the factory for new sessions
+
+        Returns:
+            The session's chatline
+        """
+        with self.session(session_id, user) as chatline:
+            return chatline
+
+    def send_message(self, session_id: str, message: str, user=None, **kwargs) -> str:
+        """Send a message in a session (see AdultChatline.send_message)"""
+        with self.session(session_id, user) as chatline:
+            return chatline.send_message(message, **kwargs)
+
+    def _checkout(self, session_id: str, user) -> _Resident:
+        """
+        Find, rehydrate or create a session and mark it in use
+
+        A missing session is entered in the table as a placeholder first, so
+        concurrent callers for the same id wait on its lock for one load
+        instead of each building their own.
+        """
+        with self._lock:
+            resident = self._sessions.get(session_id)
+            if resident is None:
+                resident = _Resident()
+                self._sessions[session_id] = resident
+            else:
+                self._sessions.move_to_end(session_id)
+            resident.in_use += 1
+
+        try:
+            with resident.lock:
+                if resident.chatline is None:
+                    self._load(session_id, resident, user)
+        except BaseException:
+            with self._lock:
+                resident.in_use -= 1
+                if (resident.chatline is None and not resident.in_use
+                        and self._sessions.get(session_id) is resident):
+                    del self._sessions[session_id]
+            raise
+        return resident
+
+    def _load(self, session_id: str, resident: _Resident, user):
+        """Create a session and rehydrate its snapshot (caller holds the session lock)"""
+        chatline = self.factory(user=user, session_id=session_id)
+        path = self._snapshot_path(session_id)
+        if path.exists():
+            started = time.perf_counter()
+            state = json.loads(zlib.decompress(path.read_bytes()))
+            chatline.load_state(state)
+            path.unlink()
+            self.metrics.observe("chat_session_hydrate_seconds", time.perf_counter() - started)
+            self.metrics.increment("chat_session_hydrations_total")
+
+        size = estimate_session_bytes(chatline)
+        with self._lock:
+            resident.chatline = chatline
+            resident.size = size
+            self._memory += size
+
+    def hibernate(self, session_id: str) -> bool:
+        """
+        Write a session to disk and drop it from memory
+
+        Args:
+            session_id: Session id
+
+        Returns:
+            True if the session was hibernated, False if it is unknown or busy
+        """
+        with self._lock:
+            resident = self._sessions.get(session_id)
+            if resident is None or resident.in_use or not resident.lock.acquire(blocking=False):
+                return False
+        try:
+            # Callers that check the session out now wait on its lock, so
+            # no turn can change it while the snapshot is written
+            self._write_snapshot(session_id, resident.chatline)
+            with self._lock:
+                if resident.in_use:
+                    # Wanted again while writing; keep it in memory
+                    self._snapshot_path(session_id).unlink(missing_ok=True)
+                    return False
+                del self._sessions[session_id]
+                self._memory -= resident.size
+        finally:
+            resident.lock.release()
+        self.metrics.increment("chat_session_hibernations_total")
+        return True
+
+    def _write_snapshot(self, session_id: str, chatline):
+        """Write a compressed snapshot atomically"""
+        state = chatline.get_state()
+        state["version"] = SNAPSHOT_VERSION
+        data = zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"), 6)
+        path = self._snapshot_path(session_id)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _enforce_budget(self):
+        """Hibernate least recently used sessions until under budget"""
+        with self._lock:
+            if self._memory <= self.memory_budget:
+                return
+            idle = [sid for sid, r in self._sessions.items() if not r.in_use]
+        for session_id in idle:
+            with self._lock:
+                if self._memory <= self.memory_budget:
+                    break
+            self.hibernate(session_id)
+
+    def evict_idle(self) -> int:
+        """
+        Hibernate sessions idle for longer than idle_seconds
+
+        Returns:
+            Number of sessions hibernated
+        """
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [sid for sid, r in self._sessions.items() if not r.in_use and r.last_used <= cutoff]
+        return sum(1 for session_id in idle if self.hibernate(session_id))
+
+    def hibernate_all(self) -> int:
+        """Hibernate every idle session, e.g. before shutdown"""
+        with self._lock:
+            ids = list(self._sessions)
+        return sum(1 for session_id in ids if self.hibernate(session_id))
+
+    def discard(self, session_id: str):
+        """Forget a session, in memory and on disk"""
+        with self._lock:
+            resident = self._sessions.pop(session_id, None)
+            if resident is not None:
+                self._memory -= resident.size
+        self._snapshot_path(session_id).unlink(missing_ok=True)
+
+    def start_reaper(self, interval: float = 60.0):
+        """Run evict_idle() every interval seconds on a background thread"""
+        if self._reaper is not None:
+            return
+        self._stop.clear()
+
+        def reap():
+            while not self._stop.wait(interval):
+                self.evict_idle()
+
+        self._reaper = threading.Thread(target=reap, daemon=True, name="session-reaper")
+        self._reaper.start()
+
+    def stop_reaper(self):
+        """Stop the background reaper"""
+        if self._reaper is None:
+            return
+        self._stop.set()
+        self._reaper.join()
+        self._reaper = None
+
+    def get_stats(self) -> Dict:
+        """Get resident session count and memory use"""
+        with self._lock:
+            return {
+                "resident_sessions": len(self._sessions),
+                "resident_bytes": self._memory,
+                "memory_budget": self.memory_budget,
+                "hibernated_sessions": sum(1 for _ in self.snapshot_dir.glob("*.snap")),
+            }
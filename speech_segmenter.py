@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Speech Segmenter for 1-800-PHONESEX
+Cuts a streamed LLM reply into units the TTS can start speaking. The first
+unit ends at the first clause boundary so the caller hears something as soon
+as possible; later units collect whole sentences, which sound more natural
+than fragments and are spoken while the rest of the reply streams in.
+"""
+
+import os
+import re
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+
+# A sentence ends at terminal punctuation (and closing quotes or brackets)
+# followed by whitespace, or at a line break
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\n+")
+# A clause ends at a comma, semicolon, colon or dash followed by whitespace
+_CLAUSE_END = re.compile(r"[,;:–—]+\s+|\s[-–—]+\s+")
+_WHITESPACE = re.compile(r"\s+")
+
+# Words whose trailing period does not end a sentence
+_ABBREVIATIONS = frozenset({"mr", "mrs", "ms", "dr", "st", "vs", "etc", "jr", "sr"})
+
+# Shortest first segment worth sending on its own
+FIRST_SEGMENT_MIN_CHARS = 8
+
+
+def _boundaries(pattern, text: str) -> List[int]:
+    """End offsets of the boundaries in text, skipping abbreviations"""
+    ends = []
+    for match in pattern.finditer(text):
+        if match.group().startswith("."):
+            words = text[:match.start()].split()
+            if words and words[-1].lower() in _ABBREVIATIONS:
+                continue
+        ends.append(match.end())
+    return ends
+
+
+class SpeechSegmenter:
+    """
+    Splits streamed text into speakable segments
+
+    push() text as it arrives and send each returned segment to the TTS;
+    call flush() when the reply is complete for whatever is left.
+    """
+
+    def __init__(self, first_chars: Optional[int] = None, segment_chars: Optional[int] = None):
+        """
+        Initialize segmenter
+
+        Args:
+            first_chars: Longest the first segment waits for a clause
+                boundary before it is cut at a word (VOICE_FIRST_SEGMENT_CHARS,
+                default 40)
+            segment_chars: Length at which later segments are cut at the last
+                sentence boundary (VOICE_SEGMENT_CHARS, default 120); with no
+                sentence boundary they are cut at a clause at twice this
+                length and at a word at three times
+        """
+        if first_chars is None:
+            first_chars = int(os.getenv("VOICE_FIRST_SEGMENT_CHARS", "40"))
+        if segment_chars is None:
+            segment_chars = int(os.getenv("VOICE_SEGMENT_CHARS", "120"))
+        self.first_chars = first_chars
+        self.segment_chars = segment_chars
+        self.emitted = 0
+        self._buffer = ""
+
+    def _cut(self) -> Optional[int]:
+        """Offset to cut the buffer at, or None to keep waiting"""
+        text = self._buffer
+        if self.emitted == 0:
+            for end in sorted(_boundaries(_SENTENCE_END, text) + _boundaries(_CLAUSE_END, text)):
+                if len(text[:end].strip()) >= FIRST_SEGMENT_MIN_CHARS:
+                    return end
+            limit = self.first_chars
+        else:
+            if len(text) < self.segment_chars:
+                return None
+            sentences = _boundaries(_SENTENCE_END, text)
+            if sentences:
+                return sentences[-1]
+            if len(text) < 2 * self.segment_chars:
+                return None
+            clauses = _boundaries(_CLAUSE_END, text)
+            if clauses:
+                return clauses[-1]
+            limit = 3 * self.segment_chars
+
+        if len(text) < limit:
+            return None
+        words = [m.end() for m in _WHITESPACE.finditer(text, 0, limit + 1)]
+        return words[-1] if words else None
+
+    def push(self, text: str) -> List[str]:
+        """
+        Add streamed text
+
+        Args:
+            text: Next chunk of the reply
+
+        Returns:
+            Segments ready to speak (often none)
+        """
+        self._buffer += text
+        segments = []
+        while True:
+            end = self._cut()
+            if end is None:
+                return segments
+            segment = self._buffer[:end].strip()
+            self._buffer = self._buffer[end:]
+            if segment:
+                segments.append(segment)
+                self.emitted += 1
+
+    def flush(self) -> List[str]:
+        """Get whatever is left once the reply is complete"""
+        segment = self._buffer.strip()
+        self._buffer = ""
+        if not segment:
+            return []
+        self.emitted += 1
+        return [segment]
+
+
+async def segment_text(text: AsyncIterable[str],
+                       segmenter: Optional[SpeechSegmenter] = None) -> AsyncIterator[str]:
+    """
+    Split a text stream into speakable segments
+
+    Args:
+        text: Streamed reply
+        segmenter: Segmenter to use (defaults to one configured from the environment)
+
+    Yields:
+        Segments, as soon as each is complete
+    """
+    segmenter = segmenter or SpeechSegmenter()
+    async for chunk in text:
+        for segment in segmenter.push(chunk):
+            yield segment
+    for segment in segmenter.flush():
+        yield segment
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Stream Sinks for 1-800-PHONESEX
+Consumers that receive reply deltas as the operator's response is generated
+"""
+
+import sys
+import json
+from typing import Any, Callable, IO, List, Optional, Sequence
+
+
+class StreamSink:
+    """
+    Base class for reply stream consumers
+
+    Sinks receive the same delta string objects the model produced, so
+    attaching several sinks never copies the reply. Sinks used with
+    AsyncAdultChatline may return awaitables from any hook.
+    """
+
+    def on_start(self) -> Any:
+        """Called before the first delta of a reply"""
+
+    def on_delta(self, text: str) -> Any:
+        """Called for every text delta"""
+
+    def on_end(self, text: str) -> Any:
+        """Called with the complete reply once it has finished"""
+
+    def on_error(self, message: str) -> Any:
+        """Called instead of on_end if the reply failed"""
+
+
+class TerminalSink(StreamSink):
+    """Prints the reply to the terminal as it streams (the CLI default)"""
+
+    def __init__(self, prefix: str = "AI: ", file: Optional[IO[str]] = None):
+        """
+        Initialize terminal sink
+
+        Args:
+            prefix: Text printed before each reply
+            file: Stream to write to (defaults to sys.stdout)
+        """
+        self.prefix = prefix
+        self.file = file
+
+    def on_start(self):
+        print(self.prefix, end="", flush=True, file=self.file or sys.stdout)
+
+    def on_delta(self, text: str):
+        print(text, end="", flush=True, file=self.file or sys.stdout)
+
+    def on_end(self, text: str):
+        print(file=self.file or sys.stdout)  # New line after streaming
+
+    def on_error(self, message: str):
+        print(message, file=self.file or sys.stdout)
+
+
+class SSESink(StreamSink):
+    """Writes the reply as Server-Sent Events"""
+
+    def __init__(self, write: Callable[[str], Any]):
+        """
+        Initialize SSE sink
+
+        Args:
+            write: Callable receiving each encoded event (e.g. a response
+                writer, or queue.put for a WSGI streaming generator)
+        """
+        self.write = write
+
+    def on_delta(self, text: str):
+        return self.write(f"data: {json.dumps({'delta': text})}\n\n")
+
+    def on_end(self, text: str):
+        return self.write("event: done\ndata: {}\n\n")
+
+    def on_error(self, message: str):
+        return self.write(f"event: error\ndata: {json.dumps({'error': message})}\n\n")
+
+
+class WebSocketSink(StreamSink):
+    """Sends the reply over a WebSocket as JSON messages"""
+
+    def __init__(self, send: Callable[[str], Any]):
+        """
+        Initialize WebSocket sink
+
+        Args:
+            send: The socket's send callable (sync or async)
+        """
+        self.send = send
+
+    def on_delta(self, text: str):
+        return self.send(json.dumps({"type": "delta", "text": text}))
+
+    def on_end(self, text: str):
+        return self.send(json.dumps({"type": "done"}))
+
+    def on_error(self, message: str):
+        return self.send(json.dumps({"type": "error", "error": message}))
+
+
+class QueueSink(StreamSink):
+    """
+    Feeds deltas into a queue, e.g. for a TTS worker
+
+    Works with queue.Queue and asyncio.Queue alike; None is put after the
+    last delta to mark the end of the reply.
+    """
+
+    def __init__(self, queue):
+        """
+        Initialize queue sink
+
+        Args:
+            queue: queue.Queue or asyncio.Queue to feed
+        """
+        self.queue = queue
+
+    def on_delta(self, text: str):
+        self.queue.put_nowait(text)
+
+    def on_end(self, text: str):
+        self.queue.put_nowait(None)
+
+    def on_error(self, message: str):
+        self.queue.put_nowait(None)
+
+
+class TranscriptSink(StreamSink):
+    """Appends each completed reply to a transcript file"""
+
+    def __init__(self, path: str, speaker: str = "Operator"):
+        """
+        Initialize transcript sink
+
+        Args:
+            path: Transcript file path
+            speaker: Label written before each reply
+        """
+        self.path = path
+        self.speaker = speaker
+
+    def on_end(self, text: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(f"{self.speaker}: {text}\n")
+
+
+class SinkGroup:
+    """Dispatches stream events to a set of sinks"""
+
+    def __init__(self, sinks: Sequence[StreamSink]):
+        """
+        Initialize sink group
+
+        Args:
+            sinks: Sinks receiving the stream
+        """
+        self.sinks: List[StreamSink] = list(sinks)
+
+    def start(self):
+        for sink in self.sinks:
+            sink.on_start()
+
+    def delta(self, text: str):
+        for sink in self.sinks:
+            sink.on_delta(text)
+
+    def end(self, text: str):
+        for sink in self.sinks:
+            sink.on_end(text)
+
+    def error(self, message: str):
+        for sink in self.sinks:
+            sink.on_error(message)
+
+    def whole(self, text: str):
+        """Send a complete, non-streamed reply as a single delta"""
+        self.start()
+        self.delta(text)
+        self.end(text)
+
+    async def astart(self):
+        for sink in self.sinks:
+            await _resolve(sink.on_start())
+
+    async def adelta(self, text: str):
+        for sink in self.sinks:
+            await _resolve(sink.on_delta(text))
+
+    async def aend(self, text: str):
+        for sink in self.sinks:
+            await _resolve(sink.on_end(text))
+
+    async def aerror(self, message: str):
+        for sink in self.sinks:
+            await _resolve(sink.on_error(message))
+
+    async def awhole(self, text: str):
+        """Send a complete, non-streamed reply as a single delta"""
+        await self.astart()
+        await self.adelta(text)
+        await self.aend(text)
+
+
+async def _resolve(result: Any):
+    """Await a sink hook's result if it returned an awaitable"""
+    # Already loaded on the async path (by asyncio), so importing chatline skips it
+    import inspect
+    if inspect.isawaitable(result):
+        await result
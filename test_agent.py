@@ -91,6 +91,454 @@ def test_plugin_initialization():
         return False
 
 
+def test_prewarm_reuses_plugins():
+    """Test that calls reuse the plugin instances built by prewarm"""
+    print("Testing prewarmed plugin reuse...")
+    
+    from livekit.agents import JobExecutorType, JobProcess
+    
+    proc = JobProcess(executor_type=JobExecutorType.PROCESS, user_arguments=None, http_proxy=None)
+    agent.prewarm(proc)
+    prewarmed = proc.userdata["plugins"]
+    assert {"stt", "llm", "tts"} <= set(prewarmed), "prewarm did not build the plugins"
+    
+    for _ in range(2):
+        plugins, was_prewarmed = agent.job_plugins(proc)
+        assert was_prewarmed, "Call did not see the prewarmed plugins"
+        assert all(plugins[name] is prewarmed[name] for name in prewarmed), \
+            "Call built new plugin instances"
+    print("  ✓ Every call reuses the prewarmed STT, LLM and TTS")
+    
+    cold = JobProcess(executor_type=JobExecutorType.PROCESS, user_arguments=None, http_proxy=None)
+    os.environ["VOICE_PREWARM"] = "false"
+    try:
+        agent.prewarm(cold)
+    finally:
+        del os.environ["VOICE_PREWARM"]
+    plugins, was_prewarmed = agent.job_plugins(cold)
+    assert not was_prewarmed and "plugins" not in cold.userdata
+    assert plugins["llm"] is not prewarmed["llm"]
+    print("  ✓ VOICE_PREWARM=false builds plugins per call\n")
+
+
+def test_first_audio_latency():
+    """Test that time from connect to first audio is recorded once per call"""
+    print("Testing first audio latency measurement...")
+    
+    import asyncio
+    import time
+    from metrics import REGISTRY
+    
+    async def frames():
+        for frame in (b"frame", b"frame"):
+            yield frame
+    
+    async def speak(assistant):
+        return [frame async for frame in assistant.timed_audio(frames())]
+    
+    for prewarmed in (True, False):
+        assistant = agent.ChatlineAgent(instructions="test", call_started=time.perf_counter() - 0.5,
+                                        prewarmed=prewarmed)
+        histogram = REGISTRY.histogram("voice_first_audio_seconds", prewarmed=str(prewarmed).lower())
+        before = histogram.count
+        assert len(asyncio.run(speak(assistant))) == 2, "Frames were not passed through"
+        asyncio.run(speak(assistant))
+        assert histogram.count == before + 1, "First audio was not recorded exactly once"
+        assert histogram.sum >= 0.5 * histogram.count
+    
+    print("  ✓ voice_first_audio_seconds recorded once per call, labelled by prewarm\n")
+
+
+def test_speech_segmenter():
+    """Test that replies are cut into a short first clause and longer sentences"""
+    print("Testing speech segmenter...")
+    
+    import asyncio
+    from speech_segmenter import SpeechSegmenter, segment_text
+    
+    reply = ("Mmm, hey there gorgeous, I've been waiting all night for you to call. "
+             "Tell me what you're wearing. I want every detail, Mr. Smith, don't hold back! "
+             "We have 3.5 hours until sunrise and I intend to use every single minute of them. "
+             "So what's it going to be?")
+    segmenter = SpeechSegmenter(first_chars=40, segment_chars=80)
+    segments = []
+    for i in range(0, len(reply), 5):
+        segments += segmenter.push(reply[i:i + 5])
+    first_pushes = len(segments)
+    segments += segmenter.flush()
+    
+    assert segments[0] == "Mmm, hey there gorgeous,", f"First segment not cut at a clause: {segments[0]!r}"
+    assert first_pushes >= 3, "Segments were held back until the end of the reply"
+    assert " ".join(segments) == " ".join(reply.split()), "Text was lost or reordered"
+    assert all(s.endswith((".", "!", "?")) for s in segments[1:]), f"Later segments split sentences: {segments}"
+    assert all("Mr." not in s[-3:] and not s.endswith("3.") for s in segments), "Split at Mr. or 3.5"
+    print(f"  ✓ First segment {segments[0]!r}, then {len(segments) - 1} sentence segments")
+    
+    rambling = SpeechSegmenter(first_chars=40, segment_chars=80)
+    first = rambling.push("word " * 20)
+    assert first and len(first[0]) <= 40, "First segment without punctuation was not capped"
+    assert not rambling.push("and more words "), "Later segment cut before it was long enough"
+    print("  ✓ Unpunctuated text is cut at a word once it gets too long")
+    
+    async def chunks():
+        for chunk in ("Oh, baby", " yes. ", "More"):
+            yield chunk
+    
+    async def collect():
+        return [s async for s in segment_text(chunks(), SpeechSegmenter())]
+    assert asyncio.run(collect()) == ["Oh, baby yes.", "More"]
+    print("  ✓ segment_text() streams segments and flushes the rest\n")
+
+
+def test_segmented_tts():
+    """Test that segments are flushed to the TTS one by one and the turn is timed"""
+    print("Testing segmented TTS pipeline...")
+    
+    import asyncio
+    from metrics import REGISTRY
+    
+    class FakeStream:
+        """Emits one frame per flushed segment"""
+        def __init__(self):
+            self.pushed = []
+            self.flushes = 0
+            self.queue = asyncio.Queue()
+        
+        async def __aenter__(self):
+            return self
+        
+        async def __aexit__(self, *exc):
+            return False
+        
+        def push_text(self, text):
+            self.pushed.append(text)
+        
+        def flush(self):
+            self.flushes += 1
+            self.queue.put_nowait(type("Audio", (), {"frame": self.pushed[-1].strip()})())
+        
+        def end_input(self):
+            self.queue.put_nowait(None)
+        
+        def __aiter__(self):
+            return self
+        
+        async def __anext__(self):
+            event = await self.queue.get()
+            if event is None:
+                raise StopAsyncIteration
+            return event
+    
+    class FakeTTS:
+        def __init__(self):
+            self.stream_obj = FakeStream()
+        
+        def stream(self, **options):
+            return self.stream_obj
+    
+    async def segments():
+        for segment in ("Hey you,", "come closer."):
+            yield segment
+    
+    first_bytes = []
+    
+    async def speak():
+        tts = FakeTTS()
+        frames = [f async for f in assistant.speak_segments(
+            tts, segments(), on_first_frame=lambda: first_bytes.append(len(tts.stream_obj.pushed)))]
+        return tts.stream_obj, frames
+    
+    assistant = agent.ChatlineAgent(instructions="test")
+    stream, frames = asyncio.run(speak())
+    assert frames == ["Hey you,", "come closer."], f"Unexpected frames: {frames}"
+    assert stream.flushes == 2, "Each segment was not flushed"
+    assert len(first_bytes) == 1, "First TTS audio not reported exactly once"
+    print("  ✓ Each segment is pushed and flushed on a single TTS stream")
+    
+    from livekit import rtc
+    output = rtc.EventEmitter()
+    assistant.watch_playback(output)
+    turn = agent.TurnTiming()
+    turn.mark("tts_first_byte")
+    assistant.playing = turn
+    assert turn.first_audio is None, "first_audio marked before playback"
+    output.emit("playback_started", None)
+    assert turn.first_audio is not None and turn.first_audio >= turn.tts_first_byte
+    assert assistant.last_turn is turn and assistant.playing is None
+    output.emit("playback_started", None)
+    assert assistant.last_turn is turn
+    print("  ✓ first_audio marked when the audio output starts playing, after TTS first byte")
+    
+    before = REGISTRY.histogram("voice_turn_first_audio_seconds").count
+    turn = agent.TurnTiming()
+    for stage in agent.TurnTiming.STAGES:
+        turn.mark(stage)
+    first = turn.first_audio
+    turn.mark("first_audio")
+    assert turn.first_audio == first, "Stage recorded twice"
+    timings = turn.to_dict()
+    assert (timings["llm_first_token"] <= timings["first_segment"]
+            <= timings["tts_first_byte"] <= timings["first_audio"])
+    assert REGISTRY.histogram("voice_turn_first_audio_seconds").count == before + 1
+    print("  ✓ LLM first token, first segment and first audio recorded once per turn\n")
+
+
+def test_worker_load():
+    """Test load reporting, the per-worker call limit and draining"""
+    print("Testing voice worker load...")
+    
+    import asyncio
+    import time
+    from metrics import MetricsRegistry
+    from worker_load import WorkerLoad
+    
+    class FakeCPU:
+        value = 0.1
+        
+        def cpu_percent(self, interval=0.5):
+            time.sleep(0.01)
+            return self.value
+    
+    class FakeServer:
+        def __init__(self):
+            self.jobs = []
+            self.draining = False
+        
+        @property
+        def active_jobs(self):
+            return [type("Info", (), {"job": type("Job", (), {"id": job_id})()})() for job_id in self.jobs]
+    
+    class FakeRequest:
+        def __init__(self, job_id):
+            self.id = job_id
+            self.outcome = None
+        
+        async def accept(self):
+            self.outcome = "accepted"
+        
+        async def reject(self, terminate=True):
+            self.outcome = "rejected" if not terminate else "terminated"
+    
+    unbound = WorkerLoad(max_calls=1, cpu_monitor=FakeCPU(), metrics=MetricsRegistry())
+    early, extra = FakeRequest("job-0"), FakeRequest("job-00")
+    asyncio.run(unbound.request(early))
+    asyncio.run(unbound.request(extra))
+    assert early.outcome == "accepted" and extra.outcome == "rejected", "Calls accepted before the server was bound were not counted"
+    
+    cpu = FakeCPU()
+    metrics = MetricsRegistry()
+    load = WorkerLoad(max_calls=2, threshold=0.75, max_loop_lag=0.2, cpu_monitor=cpu, metrics=metrics)
+    server = FakeServer()
+    load(server)
+    time.sleep(0.05)
+    assert abs(load(server) - 0.1) < 1e-9, "Idle load should be the CPU average"
+    
+    first, second, third = FakeRequest("job-1"), FakeRequest("job-2"), FakeRequest("job-3")
+    asyncio.run(load.request(first))
+    server.jobs.append("job-1")
+    assert first.outcome == "accepted"
+    assert abs(load.components()["calls"] - 0.375) < 1e-9, "One of two calls is half the threshold"
+    asyncio.run(load.request(second))
+    assert second.outcome == "accepted" and load.active_calls() == 2, "Starting call not counted"
+    asyncio.run(load.request(third))
+    assert third.outcome == "rejected", "Call over the limit was not passed on to another worker"
+    assert load(server) == 1.0, "Worker at its call limit should report full load"
+    print("  ✓ Calls count toward load and the call limit routes extra calls elsewhere")
+    
+    server.jobs = []
+    load._starting.clear()
+    cpu.value = 0.9
+    load._cpu.clear()
+    time.sleep(0.1)
+    assert load(server) >= 0.75, "High CPU did not mark the worker full"
+    cpu.value = 0.0
+    load._cpu.clear()
+    
+    async def block_loop():
+        load._start_lag_monitor()
+        await asyncio.sleep(0.1)
+        time.sleep(0.7)
+        await asyncio.sleep(0.05)
+    
+    asyncio.run(block_loop())
+    assert load(server) == 1.0, "Event-loop lag did not mark the worker full"
+    print("  ✓ CPU use and event-loop lag raise the load")
+    
+    server.draining = True
+    late = FakeRequest("job-4")
+    asyncio.run(load.request(late))
+    assert late.outcome == "rejected", "Draining worker accepted a call"
+    assert metrics.counter("voice_jobs_rejected_total", reason="draining").value == 1
+    print("  ✓ A draining worker passes new calls on\n")
+
+
+def test_call_trace():
+    """Test per-turn OTLP spans and the per-stage summary"""
+    print("Testing call latency trace...")
+    
+    import json
+    import shutil
+    import tempfile
+    from types import SimpleNamespace
+    from pathlib import Path
+    from livekit.rtc import EventEmitter
+    from call_trace import CallTrace, TraceExporter, summarize
+    
+    directory = tempfile.mkdtemp()
+    try:
+        path = str(Path(directory) / "calls.jsonl")
+        exporter = TraceExporter(path)
+        trace = CallTrace(exporter, room="room-1", personality="Desire")
+        session = EventEmitter()
+        agent.trace_session(session, trace)
+        
+        session.emit("agent_state_changed", SimpleNamespace(new_state="speaking", created_at=99.0))
+        base = 100.0
+        for turn in range(20):
+            t = base + turn * 10
+            session.emit("user_state_changed", SimpleNamespace(old_state="speaking", created_at=t))
+            session.emit("user_input_transcribed", SimpleNamespace(is_final=False, created_at=t + 0.1))
+            session.emit("user_input_transcribed", SimpleNamespace(is_final=True, created_at=t + 0.2))
+            trace.mark("llm_start", t + 0.5)
+            trace.mark("llm_first_token", t + 0.5 + 0.1 * (turn + 1))
+            trace.mark("tts_start", t + 2.7)
+            trace.mark("tts_first_byte", t + 2.9)
+            trace.mark("llm_done", t + 3.0)
+            session.emit("agent_state_changed", SimpleNamespace(new_state="speaking", created_at=t + 3.1))
+        assert trace.current is None, "Finished turn was not exported"
+        
+        session.emit("user_state_changed", SimpleNamespace(old_state="speaking", created_at=500.0))
+        trace.mark("llm_start", 500.4)
+        trace.close()
+        exporter.close()
+        
+        lines = [json.loads(line) for line in open(path)]
+        assert len(lines) == 21, f"Expected 21 turns, got {len(lines)}"
+        spans = lines[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        root = spans[0]
+        assert root["name"] == "turn" and all(s["parentSpanId"] == root["spanId"] for s in spans[1:])
+        assert {s["name"] for s in spans[1:]} == {"end_of_speech", "stt_final", "llm_first_token", "llm",
+                                                  "tts_first_byte", "first_audio"}
+        tags = {a["key"]: a["value"] for a in root["attributes"]}
+        assert tags["chatline.room"] == {"stringValue": "room-1"}
+        assert tags["chatline.personality"] == {"stringValue": "Desire"}
+        assert abs(int(root["endTimeUnixNano"]) - int(root["startTimeUnixNano"]) - 3.1e9) < 1000
+        partial = [s["name"] for s in lines[-1]["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+        assert partial == ["turn", "end_of_speech"], f"Unfinished turn not exported as is: {partial}"
+        print("  ✓ One OTLP trace per turn with stage spans tagged by room and operator")
+        
+        summary = summarize(path)
+        assert summary["first_audio"]["count"] == 20
+        assert abs(summary["first_audio"]["p50_ms"] - 3100) < 1
+        assert abs(summary["llm_first_token"]["p50_ms"] - 1000) < 1
+        assert abs(summary["llm_first_token"]["p95_ms"] - 1900) < 1
+        assert abs(summary["llm_first_token"]["p99_ms"] - 2000) < 1
+        assert summary["end_of_speech"]["count"] == 21
+        print("  ✓ Summary gives p50/p95/p99 per stage\n")
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_greeting_cache():
+    """Test that greetings are cached as memory-mapped PCM and invalidated on change"""
+    print("Testing greeting audio cache...")
+    
+    import asyncio
+    import shutil
+    import tempfile
+    from pathlib import Path
+    from livekit import rtc
+    from greeting_cache import GreetingCache, voice_key
+    
+    def tone(samples, value):
+        return rtc.AudioFrame(bytes([value, 0]) * samples, 24000, 1, samples)
+    
+    class FakeTTS:
+        """Synthesizes 50 ms of audio per call"""
+        sample_rate = 24000
+        num_channels = 1
+        calls = 0
+        
+        def synthesize(self, text):
+            FakeTTS.calls += 1
+            
+            class Stream:
+                async def __aenter__(self):
+                    return self
+                
+                async def __aexit__(self, *exc):
+                    return False
+                
+                def __aiter__(self):
+                    return self.audio()
+                
+                async def audio(self):
+                    for value in (1, 2):
+                        yield type("Audio", (), {"frame": tone(600, value)})()
+            return Stream()
+    
+    directory = tempfile.mkdtemp()
+    try:
+        cache = GreetingCache(directory)
+        tts = FakeTTS()
+        assert cache.get("Desire", voice_key(tts), "Hello") is None, "Empty cache had a hit"
+        
+        stored = asyncio.run(cache.fill(tts, "Desire", "Hello"))
+        assert FakeTTS.calls == 1
+        assert abs(stored.duration - 0.05) < 1e-9, f"Wrong duration: {stored.duration}"
+        
+        greeting = cache.get("Desire", voice_key(tts), "Hello")
+        assert greeting is stored, "Hit did not reuse the mapped greeting"
+        frames = list(greeting.frames(frame_ms=20))
+        assert [f.samples_per_channel for f in frames] == [480, 480, 240], "Frames not split by 20 ms"
+        assert frames[0].data[0] == 1 and frames[-1].data[-1] == 2, "Audio changed in the cache"
+        print("  ✓ Greeting synthesized once, then played from the mapped file in 20 ms frames")
+        
+        async def collect():
+            return [f async for f in greeting.stream()]
+        assert len(asyncio.run(collect())) == 3
+        
+        async def speak(text):
+            return [f async for f in cache.synthesize(tts, "Candy", text)]
+        played = asyncio.run(speak("Hey you"))
+        assert [f.data[0] for f in played] == [1, 2], "Live greeting was not played as synthesized"
+        assert FakeTTS.calls == 2, "Miss synthesized the greeting twice"
+        cached = cache.get("Candy", voice_key(tts), "Hey you")
+        assert cached is not None and abs(cached.duration - 0.05) < 1e-9, "Played greeting was not cached"
+        
+        async def interrupt():
+            async for _ in cache.synthesize(tts, "Candy", "Cut off"):
+                break
+        asyncio.run(interrupt())
+        assert cache.get("Candy", voice_key(tts), "Cut off") is None, "Interrupted greeting was cached"
+        print("  ✓ A miss plays live TTS once and caches the audio it played")
+        
+        assert cache.get("Desire", voice_key(tts), "Hello again") is None, "Changed text still hit"
+        assert cache.get("Desire", "another-voice", "Hello") is None, "Changed voice still hit"
+        cache.store("Desire", voice_key(tts), "Hello again", [tone(480, 3)])
+        assert len(list(Path(directory).glob("desire-*.pcm"))) == 1, "Old greeting was not removed"
+        cache.store("Candy", voice_key(tts), "Hi", [tone(480, 4)])
+        assert len(list(Path(directory).glob("*.pcm"))) == 2
+        print("  ✓ Changed text or voice misses, and replaces the old greeting file")
+        
+        import threading
+        writers = [threading.Thread(target=cache.store, args=("Candy", voice_key(tts), "Hi", [tone(4800, 5)] * 20))
+                   for _ in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        assert not list(Path(directory).glob("*.tmp")), "Temporary files left behind"
+        assert GreetingCache(directory).get("Candy", voice_key(tts), "Hi").duration == 4.0
+        print("  ✓ Concurrent writers of the same greeting each use their own temporary file")
+        
+        reopened = GreetingCache(directory)
+        assert reopened.get("Desire", voice_key(tts), "Hello again").duration == 0.02
+        print("  ✓ Cached greetings survive a restart\n")
+    finally:
+        shutil.rmtree(directory)
+
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -98,7 +546,7 @@ def main():
     print("=" * 60 + "\n")
     
     tests_passed = 0
-    tests_total = 4
+    tests_total = 11
     
     try:
         test_agent_imports()
@@ -118,6 +566,48 @@ def main():
     if test_agent_instantiation():
         tests_passed += 1
     
+    try:
+        test_prewarm_reuses_plugins()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ Prewarm test failed: {e}\n")
+    
+    try:
+        test_first_audio_latency()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ First audio test failed: {e}\n")
+    
+    try:
+        test_speech_segmenter()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ Speech segmenter test failed: {e}\n")
+    
+    try:
+        test_segmented_tts()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ Segmented TTS test failed: {e}\n")
+    
+    try:
+        test_worker_load()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ Worker load test failed: {e}\n")
+    
+    try:
+        test_call_trace()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ Call trace test failed: {e}\n")
+    
+    try:
+        test_greeting_cache()
+        tests_passed += 1
+    except AssertionError as e:
+        print(f"  ✗ Greeting cache test failed: {e}\n")
+    
     print("=" * 60)
     print(f"Test Results: {tests_passed}/{tests_total} tests passed")
     print("=" * 60)
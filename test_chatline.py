@@ -6,11 +6,16 @@ Tests the application structure without requiring a GROQ API key
 
 import sys
 import os
+import time
+import asyncio
+import inspect
+import threading
+from pathlib import Path
 
 # Mock the GROQ API key for testing
 os.environ['GROQ_API_KEY'] = 'test_key_for_structure_testing'
 
-from chatline import PersonalityPresets, AdultChatline
+from chatline import PersonalityPresets, AdultChatline, AsyncAdultChatline, LINE_BUSY_MESSAGE
 
 
 def test_personality_presets():
@@ -124,6 +129,1355 @@ def test_configuration():
     print("✓ Configuration successful\n")
 
 
+def test_async_chatline():
+    """Test the asyncio chatline variant"""
+    print("Testing Async Chatline...")
+    
+    from payments import SubscriptionTier
+    from user_manager import User
+    
+    chatline = AsyncAdultChatline()
+    assert inspect.iscoroutinefunction(chatline.send_message)
+    assert hasattr(chatline._stream_response(chatline._start_turn()), "__anext__")
+    assert len(chatline.conversation_history) == 1
+    print("  ✓ AsyncAdultChatline instance created")
+    
+    # A user over their daily limit is rejected before any network call
+    user = User("async_user", "async@example.com", SubscriptionTier.FREE)
+    chatline = AsyncAdultChatline(user=user)
+    for _ in range(user.get_daily_message_limit()):
+        chatline.usage_tracker.track_message(user.user_id)
+    
+    reply = asyncio.run(chatline.send_message("hey", stream=True))
+    assert "daily limit" in reply
+    assert chatline.get_conversation_length() == 0
+    print("  ✓ Feature gates run on the async path")
+    
+    print("✓ Async chatline successful\n")
+
+
+def test_context_window():
+    """Test token-budgeted context trimming"""
+    print("Testing Context Window...")
+    
+    from context_window import ContextWindow, get_context_size
+    
+    assert get_context_size("llama-3.1-70b-versatile") == 128000
+    window = ContextWindow("llama-3.1-70b-versatile", 1024)
+    assert window.budget < 128000 - 1024
+    print(f"  ✓ Budget derived from model context: {window.budget} tokens")
+    
+    window = ContextWindow("llama3-8b-8192", 1024, budget=200)
+    system = {"role": "system", "content": "s" * 200}
+    history = [system]
+    for i in range(20):
+        history.append({"role": "user", "content": f"message {i} " + "u" * 80})
+        history.append({"role": "assistant", "content": f"reply {i} " + "a" * 80})
+    history.append({"role": "user", "content": "latest"})
+    
+    selected = window.select(history)
+    assert selected[0] is system
+    assert selected[-1] is history[-1]
+    assert selected[1]["role"] == "user"
+    assert window.total_tokens(selected) <= 200
+    assert len(selected) < len(history)
+    print(f"  ✓ Trimmed {len(history)} messages to {len(selected)} under budget")
+    
+    # Counts are cached on first use, so repeated turns don't recount
+    cached = len(window._token_cache)
+    window.select(history)
+    assert len(window._token_cache) == cached
+    print("  ✓ Token counts cached per message")
+    
+    short = [system, {"role": "user", "content": "hi"}]
+    assert window.select(short) == short
+    print("  ✓ Short conversations are sent unchanged")
+    
+    print("✓ Context window successful\n")
+
+
+def test_compaction():
+    """Test background summarization of old turns"""
+    print("Testing Conversation Compaction...")
+    
+    from compaction import ConversationCompactor, is_summary
+    
+    class StubCompactor(ConversationCompactor):
+        def summarize(self, client, batch):
+            return f"{len(batch)} messages summarized"
+    
+    chatline = AdultChatline()
+    chatline.compactor = StubCompactor(threshold=8, turns=3)
+    for i in range(5):
+        chatline.conversation_history.append({"role": "user", "content": f"message {i}"})
+        chatline.conversation_history.append({"role": "assistant", "content": f"reply {i}"})
+    
+    chatline._maybe_compact()
+    assert chatline._pending_compaction is not None
+    chatline._pending_compaction.result(timeout=5)
+    print("  ✓ Summary runs in the background")
+    
+    chatline._apply_compaction()
+    history = chatline.conversation_history
+    assert is_summary(history[1])
+    assert "6 messages summarized" in history[1]["content"]
+    assert history[2]["content"] == "message 3"
+    assert len(history) == 1 + 1 + 4
+    print("  ✓ Oldest turns replaced with one summary message")
+    
+    # A session cleared while the summary runs is left alone
+    for i in range(5):
+        chatline.conversation_history.append({"role": "user", "content": f"more {i}"})
+        chatline.conversation_history.append({"role": "assistant", "content": f"again {i}"})
+    chatline._maybe_compact()
+    chatline._pending_compaction.result(timeout=5)
+    chatline._set_system_prompt()
+    chatline._apply_compaction()
+    assert len(chatline.conversation_history) == 1
+    print("  ✓ Stale summaries are discarded")
+    
+    print("✓ Conversation compaction successful\n")
+
+
+def test_response_cache():
+    """Test the opening-turn response cache"""
+    print("Testing Response Cache...")
+    
+    from chatline import ResponseCache
+    
+    cache = ResponseCache(max_entries=2, ttl_seconds=60, max_variants=2)
+    key = cache.make_key("Flirty", "model", "Hey there!!", 0)
+    assert key == cache.make_key("Flirty", "model", "  hey   THERE ", 0)
+    assert cache.make_key("Flirty", "model", "hey there", 2) is None
+    print("  ✓ Messages normalized, deep turns not cached")
+    
+    assert cache.get(key) is None
+    cache.put(key, "Mmm, hello")
+    assert cache.get(key) is None  # Still collecting variants
+    cache.put(key, "Well hi, gorgeous")
+    assert cache.get(key) in ("Mmm, hello", "Well hi, gorgeous")
+    assert cache.hits == 1 and cache.misses == 2
+    print("  ✓ Hits served from cached variants")
+    
+    other = cache.make_key("Romantic", "model", "hi", 0)
+    third = cache.make_key("Playful", "model", "hi", 0)
+    cache.put(other, "Hello love")
+    cache.put(third, "Heyyy")
+    assert cache.get_stats()["entries"] == 2
+    assert cache.get(key) is None
+    print("  ✓ Least recently used entries evicted")
+    
+    expired = ResponseCache(ttl_seconds=0, max_variants=1)
+    expired_key = expired.make_key("Flirty", "model", "hi", 0)
+    expired.put(expired_key, "Hi")
+    import time
+    time.sleep(0.01)
+    assert expired.get(expired_key) is None
+    print("  ✓ Entries expire after TTL")
+    
+    small = ResponseCache(max_bytes=10, max_variants=1)
+    small.put(small.make_key("Flirty", "model", "a", 0), "12345678")
+    small.put(small.make_key("Flirty", "model", "b", 0), "12345678")
+    assert small.get_stats()["size_bytes"] <= 10
+    print("  ✓ Memory limit enforced")
+    
+    # Cache hits never reach the network
+    chatline = AdultChatline(response_cache=ResponseCache(max_variants=1))
+    chatline.response_cache.put(chatline._cache_key("hey"), "Hey yourself")
+    reply = chatline.send_message("hey", stream=False)
+    assert reply == "Hey yourself"
+    assert chatline.get_conversation_length() == 2
+    print("  ✓ Chatline serves cached opening replies")
+    
+    print("✓ Response cache successful\n")
+
+
+def test_stream_sinks():
+    """Test the streaming API and pluggable sinks"""
+    print("Testing Stream Sinks...")
+    
+    import io
+    import queue
+    from stream_sinks import StreamSink, TerminalSink, SSESink, QueueSink, WebSocketSink
+    
+    class RecordingSink(StreamSink):
+        def __init__(self):
+            self.events = []
+        def on_start(self):
+            self.events.append("start")
+        def on_delta(self, text):
+            self.events.append(text)
+        def on_end(self, text):
+            self.events.append(("end", text))
+    
+    terminal_out = io.StringIO()
+    recorder = RecordingSink()
+    sse_events = []
+    tts_queue = queue.Queue()
+    
+    chatline = AdultChatline(sinks=[TerminalSink(file=terminal_out)])
+    chatline._stream_response = lambda turn: iter(["Mmm, ", "hello ", "there"])
+    
+    deltas = list(chatline.stream_message(
+        "hi", sinks=[recorder, SSESink(sse_events.append), QueueSink(tts_queue)]
+    ))
+    assert deltas == ["Mmm, ", "hello ", "there"]
+    assert recorder.events == ["start", "Mmm, ", "hello ", "there", ("end", "Mmm, hello there")]
+    assert sse_events[0] == 'data: {"delta": "Mmm, "}\n\n'
+    assert sse_events[-1].startswith("event: done")
+    assert [tts_queue.get_nowait() for _ in range(4)] == ["Mmm, ", "hello ", "there", None]
+    assert chatline.last_reply == "Mmm, hello there"
+    assert chatline.conversation_history[-1]["content"] == "Mmm, hello there"
+    print("  ✓ stream_message yields deltas to every sink")
+    
+    reply = chatline.send_message("again")
+    assert reply == "Mmm, hello there"
+    assert terminal_out.getvalue() == "AI: Mmm, hello there\n"
+    print("  ✓ send_message uses the default terminal sink")
+    
+    sent = []
+    
+    async def ws_send(payload):
+        sent.append(payload)
+    
+    async def fake_stream(turn):
+        for delta in ["Hey ", "you"]:
+            yield delta
+    
+    async_chatline = AsyncAdultChatline(sinks=[])
+    async_chatline._stream_response = fake_stream
+    
+    async def run():
+        return [d async for d in async_chatline.stream_message("hi", sinks=[WebSocketSink(ws_send)])]
+    
+    assert asyncio.run(run()) == ["Hey ", "you"]
+    assert len(sent) == 3 and '"done"' in sent[-1]
+    assert async_chatline.last_reply == "Hey you"
+    print("  ✓ Async sinks awaited on the async path")
+    
+    print("✓ Stream sinks successful\n")
+
+
+def test_latency_metrics():
+    """Test per-turn latency instrumentation"""
+    print("Testing Latency Metrics...")
+    
+    from metrics import MetricsRegistry
+    from payments import SubscriptionTier
+    from user_manager import User
+    
+    registry = MetricsRegistry()
+    user = User("metrics_user", "metrics@example.com", SubscriptionTier.PREMIUM)
+    chatline = AdultChatline(user=user, sinks=[], metrics=registry)
+    
+    def fake_stream(turn):
+        chatline._request_messages(turn)
+        for delta in ["one ", "two ", "three"]:
+            yield delta
+    
+    chatline._stream_response = fake_stream
+    chatline.send_message("hi")
+    
+    snapshot = registry.snapshot()
+    for name in ["chat_gate_seconds", "chat_request_build_seconds", "chat_ttft_seconds",
+                 "chat_inter_token_seconds", "chat_generation_seconds", "chat_tokens_per_second"]:
+        assert name in snapshot, f"Missing metric {name}"
+    ttft = snapshot["chat_ttft_seconds"][0]
+    assert ttft["labels"] == {"personality": "Flirty", "model": chatline.model, "tier": "premium"}
+    assert ttft["count"] == 1
+    assert snapshot["chat_inter_token_seconds"][0]["count"] == 2
+    print("  ✓ Turn phases recorded with personality, model and tier labels")
+    
+    from types import SimpleNamespace
+    from admission import AdmissionController
+    
+    queued_registry = MetricsRegistry()
+    controller = AdmissionController(max_concurrent=1, metrics=queued_registry)
+    holder = controller.acquire("vip")
+    queued = AdultChatline(sinks=[], metrics=queued_registry, admission=controller)
+    queued.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kwargs: FakeStream(["hi"])
+    )))
+    threading.Timer(0.2, holder.release).start()
+    queued.send_message("hi")
+    ttft = queued_registry.get_series("chat_ttft_seconds")[0][1]
+    assert ttft.percentile(50) < 0.1, "Queue time counted as time to first token"
+    assert queued_registry.histogram("chat_admission_wait_seconds", tier="free").percentile(50) >= 0.1
+    print("  ✓ Admission and quota waits kept out of time to first token")
+    
+    text = registry.render_prometheus()
+    assert "# TYPE chat_ttft_seconds histogram" in text
+    assert 'chat_ttft_seconds_count{model=' in text
+    print("  ✓ Prometheus exposition rendered")
+    
+    histogram = registry.histogram("test_seconds")
+    for value in range(1, 101):
+        histogram.observe(value / 100)
+    assert histogram.percentile(50) == 0.5
+    assert histogram.percentile(99) == 0.99
+    print("  ✓ Percentiles computed")
+    
+    print("✓ Latency metrics successful\n")
+
+
+def test_shared_client():
+    """Test the process-wide pooled GROQ client"""
+    print("Testing Shared Client...")
+    
+    from client_pool import get_client, get_async_client, close_async_clients
+    
+    first = AdultChatline()
+    second = AdultChatline()
+    assert first.client is second.client
+    assert first.client is get_client()
+    print("  ✓ Sessions share one sync client")
+    
+    async def loop_clients():
+        a = AsyncAdultChatline()
+        b = AsyncAdultChatline()
+        assert a.client is b.client
+        return a.client
+    
+    one = asyncio.run(loop_clients())
+    two = asyncio.run(loop_clients())
+    assert one is not two
+    print("  ✓ Async sessions share one client per event loop")
+    
+    async def close_loop_clients():
+        client = await loop_clients()
+        await close_async_clients()
+        return client, get_async_client()
+    
+    closed, fresh = asyncio.run(close_loop_clients())
+    assert closed.is_closed() and closed is not fresh
+    print("  ✓ A loop's clients closed explicitly at shutdown")
+    
+    print("✓ Shared client successful\n")
+
+
+def make_chunk(text):
+    """Build a streamed completion chunk like the GROQ SDK returns"""
+    from types import SimpleNamespace
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeStream:
+    """Stand-in for a GROQ stream with optional delays before and after the first chunk"""
+    
+    def __init__(self, texts, delay=0.0, stall=0.0):
+        self.texts = texts
+        self.delay = delay
+        self.stall = stall
+        self.closed = False
+    
+    def __iter__(self):
+        import time
+        time.sleep(self.delay)
+        for i, text in enumerate(self.texts):
+            if self.closed:
+                return
+            if i == 1:
+                time.sleep(self.stall)
+            yield make_chunk(text)
+    
+    def close(self):
+        self.closed = True
+
+
+def test_resilience():
+    """Test retries, first-token deadlines and hedged requests"""
+    print("Testing Upstream Resilience...")
+    
+    import time
+    import httpx
+    import groq
+    from metrics import MetricsRegistry
+    from resilience import ResiliencePolicy, UpstreamUnavailable
+    
+    registry = MetricsRegistry()
+    policy = ResiliencePolicy(max_attempts=3, base_delay=0.01, first_token_timeout=0,
+                              metrics=registry)
+    
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise groq.APIConnectionError(request=httpx.Request("POST", "http://groq.test"))
+        return FakeStream(["Hi ", "there"])
+    
+    assert list(policy.stream(flaky)) == ["Hi ", "there"]
+    assert registry.counter("chat_upstream_attempts_total").value == 2
+    print("  ✓ Retryable errors retried with backoff")
+    
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+    calls.clear()
+    try:
+        list(policy.stream(broken))
+        assert False, "Expected ValueError"
+    except UpstreamUnavailable:
+        assert False, "Non-retryable error reported as an outage"
+    except ValueError:
+        pass
+    assert len(calls) == 1
+    try:
+        policy.call(broken)
+        assert False, "Expected ValueError"
+    except ValueError:
+        pass
+    print("  ✓ Non-retryable errors fail fast and surface unchanged")
+    
+    def down():
+        raise groq.APIConnectionError(request=httpx.Request("POST", "http://groq.test"))
+    try:
+        list(policy.stream(down))
+        assert False, "Expected UpstreamUnavailable"
+    except UpstreamUnavailable:
+        pass
+    print("  ✓ Exhausted retries raise UpstreamUnavailable")
+    
+    from resilience import StreamStalled
+    stall_policy = ResiliencePolicy(max_attempts=1, first_token_timeout=0, stall_timeout=0.1,
+                                    metrics=registry)
+    stalled = FakeStream(["Hi ", "there"], stall=1.0)
+    deltas = stall_policy.stream(lambda: stalled)
+    assert next(deltas) == "Hi "
+    started = time.monotonic()
+    try:
+        next(deltas)
+        assert False, "Expected StreamStalled"
+    except StreamStalled:
+        pass
+    assert time.monotonic() - started < 0.8 and stalled.closed
+    print("  ✓ Stalled reply abandoned after the inter-token deadline")
+    
+    deadline_policy = ResiliencePolicy(max_attempts=2, base_delay=0.01, first_token_timeout=0.1,
+                                       metrics=registry)
+    streams = [FakeStream(["late"], delay=1.0), FakeStream(["on ", "time"])]
+    started = time.monotonic()
+    assert list(deadline_policy.stream(lambda: streams.pop(0))) == ["on ", "time"]
+    assert time.monotonic() - started < 0.8
+    print("  ✓ Slow first token abandoned after the deadline")
+    
+    replies = [1.0, 0]
+    def respond():
+        time.sleep(replies.pop(0))
+        return "reply"
+    started = time.monotonic()
+    assert deadline_policy.call(respond) == "reply"
+    assert time.monotonic() - started < 0.8
+    
+    async def arespond(delay):
+        await asyncio.sleep(delay)
+        return "reply"
+    replies = [1.0, 0]
+    started = time.monotonic()
+    assert asyncio.run(deadline_policy.acall(lambda: arespond(replies.pop(0)))) == "reply"
+    assert time.monotonic() - started < 0.8
+    print("  ✓ Slow non-streaming reply abandoned after the same deadline")
+    
+    hedge_policy = ResiliencePolicy(max_attempts=1, first_token_timeout=5, hedge=True,
+                                    metrics=registry)
+    slow = FakeStream(["slow"], delay=1.0)
+    streams = [slow, FakeStream(["fast"])]
+    started = time.monotonic()
+    assert list(hedge_policy.stream(lambda: streams.pop(0), hedge_after=0.05)) == ["fast"]
+    assert time.monotonic() - started < 0.8
+    assert slow.closed
+    assert registry.counter("chat_upstream_hedges_total").value == 1
+    print("  ✓ Hedge request wins and the loser is cancelled")
+    
+    replies = [1.0, 0]
+    started = time.monotonic()
+    assert hedge_policy.call(respond, hedge_after=0.05) == "reply"
+    assert time.monotonic() - started < 0.8
+    assert registry.counter("chat_upstream_hedges_total").value == 2
+    print("  ✓ Non-streaming requests hedged on the same trigger")
+    
+    from rate_limit import UpstreamLimiter
+    limiter = UpstreamLimiter(requests_per_minute=600, tokens_per_minute=6000, metrics=registry)
+    calls.clear()
+    assert list(policy.stream(flaky, limiter=limiter, prompt_tokens=100)) == ["Hi ", "there"]
+    assert limiter.requests.level < 600 and limiter.tokens.level < 6000 - 99
+    limiter.requests.level = 0
+    slow = FakeStream(["slow"], delay=0.2)
+    streams = [slow, FakeStream(["fast"])]
+    assert list(hedge_policy.stream(lambda: streams.pop(0), hedge_after=0.05,
+                                    limiter=limiter, prompt_tokens=100)) == ["slow"]
+    assert registry.counter("chat_upstream_hedges_total").value == 2
+    print("  ✓ Retries charged to the limiter, hedges skipped without quota")
+    
+    async def async_stream(texts, delay):
+        class AsyncFake:
+            async def __aiter__(self):
+                await asyncio.sleep(delay)
+                for text in texts:
+                    yield make_chunk(text)
+            async def close(self):
+                pass
+        return AsyncFake()
+    
+    async def run_async_hedge():
+        opened = [0]
+        def open_stream():
+            opened[0] += 1
+            if opened[0] == 1:
+                return async_stream(["slow"], 1.0)
+            return async_stream(["quick ", "reply"], 0)
+        return [d async for d in hedge_policy.astream(open_stream, hedge_after=0.05)]
+    
+    started = time.monotonic()
+    assert asyncio.run(run_async_hedge()) == ["quick ", "reply"]
+    assert time.monotonic() - started < 0.8
+    print("  ✓ Async hedging on the event loop")
+    
+    from chatline import LINE_BUSY_MESSAGE
+    chatline = AdultChatline(sinks=[])
+    def unavailable(turn):
+        raise UpstreamUnavailable("503")
+        yield
+    chatline._stream_response = unavailable
+    assert chatline.send_message("hello?") == LINE_BUSY_MESSAGE
+    assert chatline.get_conversation_length() == 0
+    print("  ✓ Failed turns are not recorded as operator replies")
+    
+    print("✓ Upstream resilience successful\n")
+
+
+def test_model_router():
+    """Test routing simple turns to the fast model"""
+    print("Testing Model Router...")
+    
+    from metrics import MetricsRegistry
+    from model_router import ModelRouter, ROUTE_FAST, ROUTE_LARGE
+    
+    registry = MetricsRegistry()
+    router = ModelRouter("big-model", fast_model="small-model", enabled=True,
+                         large_personalities=["Mysterious"], metrics=registry)
+    
+    assert router.route("hey sexy", 0, "Flirty", "free").model == "small-model"
+    assert router.route("mmm yes", 6, "Playful", "premium").route == ROUTE_FAST
+    print("  ✓ Short turns routed to the fast model")
+    
+    long_message = "Tell me a long story about what you would do if we met at the beach tonight"
+    assert router.route(long_message, 2, "Flirty", "free").reason == "long_message"
+    assert router.route("Yes. Go on. Slower.", 2, "Flirty", "free").reason == "multi_sentence"
+    assert router.route("hey", 50, "Flirty", "free").reason == "deep_session"
+    assert router.route("hey", 0, "Mysterious", "premium").reason == "personality"
+    assert router.route("hey", 0, "Flirty", "vip").reason == "vip_pinned"
+    print("  ✓ Complex turns, listed operators and VIP use the large model")
+    
+    disabled = ModelRouter("big-model", enabled=False, metrics=registry)
+    assert disabled.route("hey", 0, "Flirty", "free").route == ROUTE_LARGE
+    assert registry.counter("chat_route_total", route="fast", reason="short_message").value == 2
+    print("  ✓ Decisions counted per route")
+    
+    chatline = AdultChatline(sinks=[], metrics=registry)
+    chatline.router = router
+    chatline._stream_response = lambda turn: iter(["ok"])
+    chatline.send_message("hi")
+    assert chatline._turn_model == "small-model"
+    assert registry.counter("chat_route_tokens_total", route="fast", model="small-model").value == 1
+    assert registry.histogram("chat_gate_seconds", personality="Flirty", model="small-model",
+                              tier="anonymous").count == 1
+    print("  ✓ Chatline sends the turn to the routed model")
+    
+    print("✓ Model router successful\n")
+
+
+def test_rate_limiter():
+    """Test the shared upstream token-bucket limiter"""
+    print("Testing Rate Limiter...")
+    
+    from metrics import MetricsRegistry
+    from rate_limit import UpstreamLimiter, RateLimitTimeout
+    
+    registry = MetricsRegistry()
+    unlimited = UpstreamLimiter(0, 0, metrics=registry)
+    assert not unlimited.enabled
+    unlimited.acquire(10 ** 9).settle(10 ** 9)
+    print("  ✓ Unlimited by default")
+    
+    limiter = UpstreamLimiter(requests_per_minute=600, tokens_per_minute=6000,
+                              max_wait=0.2, metrics=registry)
+    reservation = limiter.acquire(6000)
+    try:
+        limiter.acquire(1000, timeout=0.05)
+        assert False, "Should have timed out"
+    except RateLimitTimeout:
+        pass
+    reservation.settle(1000)
+    reservation.settle(0)
+    assert limiter.tokens.level >= 4999
+    limiter.acquire(1000).settle(1000)
+    print("  ✓ Unused tokens refunded on settle, waiters time out")
+    
+    order = []
+    limiter.tokens.level = 0
+    
+    def waiter(name):
+        limiter.acquire(50, timeout=2)
+        order.append(name)
+    
+    threads = []
+    for name in ("first", "second"):
+        thread = threading.Thread(target=waiter, args=(name,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    assert order == ["first", "second"]
+    print("  ✓ Waiters served in arrival order")
+    
+    class Interrupted:
+        def wait(self, timeout):
+            raise KeyboardInterrupt
+        def notify_all(self):
+            pass
+    
+    changed, limiter._changed = limiter._changed, Interrupted()
+    limiter.tokens.level = 0
+    try:
+        limiter.acquire(50, timeout=2)
+        assert False, "Should have been interrupted"
+    except KeyboardInterrupt:
+        pass
+    limiter._changed = changed
+    assert not limiter._queue
+    limiter.tokens.level = 100
+    limiter.acquire(50, timeout=0.05).settle(50)
+    print("  ✓ Interrupted waiters leave the line")
+    
+    async def run_async():
+        limiter.tokens.level = 0
+        return await limiter.acquire_async(50, timeout=2)
+    
+    assert asyncio.run(run_async()).tokens == 50
+    assert registry.histogram("chat_limiter_wait_seconds").count >= 3
+    print("  ✓ Async callers wait without blocking the loop")
+    
+    checks = []
+    try_acquire = limiter._try_acquire
+    limiter._try_acquire = lambda ticket, cost: (checks.append(ticket), try_acquire(ticket, cost))[1]
+    
+    async def crowd():
+        limiter.tokens.level = 0
+        served = []
+        async def caller(name):
+            await limiter.acquire_async(5, timeout=3)
+            served.append(name)
+        await asyncio.gather(*(caller(i) for i in range(20)))
+        return served
+    
+    assert asyncio.run(crowd()) == list(range(20))
+    del limiter._try_acquire
+    assert len(checks) < 20 * 4, f"Async waiters polled the line ({len(checks)} checks)"
+    print("  ✓ Async waiters served in order, woken instead of polling")
+    
+    busy = UpstreamLimiter(requests_per_minute=1, tokens_per_minute=0, max_wait=0.01, metrics=registry)
+    busy.acquire(0)
+    chatline = AdultChatline(sinks=[], metrics=registry, limiter=busy)
+    chatline.client = None
+    reply = chatline.send_message("hello there", stream=False)
+    assert reply == LINE_BUSY_MESSAGE
+    assert chatline.get_conversation_length() == 0
+    print("  ✓ Exhausted quota gives a busy reply")
+    
+    print("✓ Rate limiter successful\n")
+
+
+def test_fake_groq_server():
+    """Test the full request path against the local fake GROQ server"""
+    print("Testing Fake GROQ Server...")
+    
+    from fake_groq_server import FakeGroqConfig, FakeGroqServer
+    from resilience import ResiliencePolicy
+    
+    config = FakeGroqConfig(ttft_ms=5, tokens_per_second=0, reply="Mmm hello there caller")
+    with FakeGroqServer(config=config) as server:
+        os.environ["GROQ_BASE_URL"] = server.base_url
+        try:
+            chatline = AdultChatline(sinks=[])
+            chatline.resilience = ResiliencePolicy(base_delay=0.01, max_delay=0.05)
+            assert chatline.send_message("hey", stream=True) == "Mmm hello there caller"
+            assert chatline.send_message("hey again", stream=False) == "Mmm hello there caller"
+            assert chatline.get_conversation_length() == 4
+            print("  ✓ Streaming and non-streaming replies over HTTP")
+            
+            async def run_async():
+                async_chatline = AsyncAdultChatline(sinks=[])
+                return await async_chatline.send_message("hey")
+            
+            assert asyncio.run(run_async()) == "Mmm hello there caller"
+            print("  ✓ Async client reaches the fake server")
+            
+            config.throttle_rate = 1.0
+            config.retry_after = 0
+            assert chatline.send_message("still there?") == LINE_BUSY_MESSAGE
+            assert chatline.get_conversation_length() == 4
+            config.throttle_rate = 0
+            
+            config.rate_limit_rpm = server.stats["completed"] + 1
+            assert chatline.send_message("one more") == "Mmm hello there caller"
+            assert chatline.send_message("and another") == LINE_BUSY_MESSAGE
+            assert server.stats["throttled"] >= 6
+            print("  ✓ 429s retried, then a busy reply")
+        finally:
+            os.environ.pop("GROQ_BASE_URL", None)
+    
+    print("✓ Fake GROQ server successful\n")
+
+
+def test_message_storage():
+    """Test compact message records and shared system prompts"""
+    print("Testing Message Storage...")
+    
+    from messages import Message, system_message, to_api
+    
+    first = AdultChatline(sinks=[])
+    second = AdultChatline(sinks=[])
+    assert first.conversation_history[0] is second.conversation_history[0]
+    assert first.conversation_history[0]["role"] == "system"
+    print("  ✓ One system prompt message shared per personality")
+    
+    role = "".join(["us", "er"])
+    message = Message(role, "hi")
+    assert message.role is sys.intern(role)
+    assert message["content"] == "hi" and message.get("name") is None
+    assert not hasattr(message, "__dict__")
+    assert to_api([message, {"role": "assistant", "content": "hey"}]) == [
+        {"role": "user", "content": "hi"},
+        {"role": "assistant", "content": "hey"},
+    ]
+    print("  ✓ Slotted records with interned roles")
+    
+    first._stream_response = lambda turn: iter(["Mmm"])
+    first.send_message("hello")
+    assert isinstance(first.conversation_history[-1], Message)
+    first.conversation_history.append({"role": "user", "content": "plain dict"})
+    sent = first._request_messages()
+    assert all(type(m) is dict for m in sent)
+    assert sent[-1]["content"] == "plain dict"
+    assert first.conversation_history[0].tokens is not None
+    print("  ✓ Converted to API dictionaries only when sending")
+    
+    import messages
+    shared = system_message("Prompt 0")
+    for i in range(messages.SYSTEM_MESSAGE_CACHE_SIZE + 10):
+        system_message(f"Prompt {i}")
+        system_message("Prompt 0")
+    assert len(messages._system_messages) == messages.SYSTEM_MESSAGE_CACHE_SIZE
+    assert system_message("Prompt 0") is shared, "Recently used prompt was evicted"
+    assert "Prompt 1" not in messages._system_messages
+    print("  ✓ Shared system prompts bounded, least recently used evicted")
+    
+    print("✓ Message storage successful\n")
+
+
+def test_session_manager():
+    """Test session eviction, hibernation and rehydration"""
+    print("Testing Session Manager...")
+    
+    import tempfile
+    from metrics import MetricsRegistry
+    from session_manager import ChatSessionManager
+    
+    created = []
+    
+    def factory(user=None, session_id=None):
+        chatline = AdultChatline(user=user, session_id=session_id, sinks=[])
+        chatline._stream_response = lambda turn: iter(["Mmm, ", "yes"])
+        created.append(session_id)
+        return chatline
+    
+    registry = MetricsRegistry()
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        manager = ChatSessionManager(factory, snapshot_dir, memory_budget=10 ** 6,
+                                     idle_seconds=0, metrics=registry)
+        assert manager.send_message("alice", "hi there") == "Mmm, yes"
+        with manager.session("alice") as chatline:
+            chatline.change_personality(PersonalityPresets.MYSTERIOUS)
+            chatline.send_message("who are you?")
+        with manager.session("bob") as chatline:
+            chatline.send_message("hello")
+            assert manager.evict_idle() == 1
+        print("  ✓ Idle sessions hibernated, busy ones kept")
+        
+        assert manager.get_stats()["hibernated_sessions"] == 1
+        alice = manager.get("alice")
+        assert alice.current_personality is PersonalityPresets.MYSTERIOUS
+        assert alice.get_conversation_length() == 2
+        assert alice.conversation_history[-1]["content"] == "Mmm, yes"
+        assert alice._request_messages()[0]["content"] == PersonalityPresets.MYSTERIOUS["system_prompt"]
+        hydrate = registry.histogram("chat_session_hydrate_seconds")
+        assert hydrate.count == 1 and hydrate.percentile(50) < 0.05
+        print(f"  ✓ Rehydrated on next use in {hydrate.percentile(50) * 1000:.2f} ms")
+        
+        manager.memory_budget = 1
+        manager.send_message("carol", "hey")
+        assert manager.get_stats()["resident_sessions"] == 0
+        assert manager.send_message("carol", "still me") == "Mmm, yes"
+        assert manager.get("carol").get_conversation_length() == 4
+        print("  ✓ Least recently used sessions evicted over the memory budget")
+        
+        manager.memory_budget = 10 ** 6
+        loading = threading.Event()
+        slow_factory = manager.factory
+        
+        def factory(user=None, session_id=None):
+            if session_id == "dave":
+                loading.set()
+                time.sleep(0.3)
+            return slow_factory(user=user, session_id=session_id)
+        manager.factory = factory
+        
+        daves = []
+        callers = [threading.Thread(target=lambda: daves.append(manager.get("dave"))) for _ in range(3)]
+        for caller in callers:
+            caller.start()
+        loading.wait()
+        started = time.perf_counter()
+        assert manager.send_message("erin", "hey") == "Mmm, yes"
+        assert time.perf_counter() - started < 0.2, "Loading one session blocked another"
+        for caller in callers:
+            caller.join()
+        assert len(daves) == 3 and daves[0] is daves[1] is daves[2], "Concurrent loads built several sessions"
+        assert created.count("dave") == 1 and daves[0].session_id == "dave"
+        print("  ✓ Sessions load outside the manager lock, once per id, with their session id")
+    
+    print("✓ Session manager successful\n")
+
+
+def test_cancellation():
+    """Test interrupting a reply mid-stream"""
+    print("Testing Cancellation...")
+    
+    from fake_groq_server import FakeGroqConfig, FakeGroqServer
+    from rate_limit import UpstreamLimiter
+    from stream_sinks import StreamSink
+    
+    config = FakeGroqConfig(ttft_ms=5, tokens_per_second=50, reply=" ".join(["word"] * 40))
+    with FakeGroqServer(config=config) as server:
+        os.environ["GROQ_BASE_URL"] = server.base_url
+        try:
+            limiter = UpstreamLimiter(requests_per_minute=0, tokens_per_minute=100000)
+            chatline = AdultChatline(sinks=[], limiter=limiter)
+            
+            delivered = []
+            
+            class HangUp(StreamSink):
+                def on_delta(self, text):
+                    delivered.append(text)
+                    if len(delivered) == 3:
+                        threading.Thread(target=chatline.cancel).start()
+            
+            started = time.perf_counter()
+            reply = chatline.send_message("talk to me", sinks=[HangUp()])
+            assert time.perf_counter() - started < 0.5
+            assert reply.startswith("word word word") and len(reply.split()) < 10
+            assert chatline.conversation_history[-1]["content"] == reply
+            assert chatline.admission.get_stats()["in_flight"] == 0 and chatline._cancel is None
+            assert limiter.tokens.level > 100000 - 2000
+            print("  ✓ cancel() stops the stream and keeps the partial reply")
+            
+            replies = chatline.stream_message("again")
+            next(replies)
+            replies.close()
+            assert chatline.conversation_history[-2]["content"] == "again"
+            assert chatline.conversation_history[-1]["content"] == "word "
+            print("  ✓ Closing the iterator (caller hung up) ends the turn")
+            
+            class CtrlC(StreamSink):
+                def on_delta(self, text):
+                    raise KeyboardInterrupt
+            
+            try:
+                chatline.send_message("once more", sinks=[CtrlC()])
+                assert False, "Should have raised KeyboardInterrupt"
+            except KeyboardInterrupt:
+                pass
+            assert chatline.conversation_history[-1]["content"] == "word "
+            print("  ✓ Ctrl-C aborts the reply, not the session")
+            
+            async def run_async():
+                first_delta = asyncio.Event()
+                
+                class Started(StreamSink):
+                    def on_delta(self, text):
+                        first_delta.set()
+                
+                async_chatline = AsyncAdultChatline(sinks=[])
+                task = asyncio.ensure_future(async_chatline.send_message("hi", sinks=[Started()]))
+                await asyncio.wait_for(first_delta.wait(), 5)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                partial = async_chatline.conversation_history[-1]["content"]
+                
+                replies = async_chatline.stream_message("hey")
+                await replies.__anext__()
+                async_chatline.cancel()
+                rest = [delta async for delta in replies]
+                return partial, rest, async_chatline.last_reply
+            
+            partial, rest, last_reply = asyncio.run(run_async())
+            assert partial.startswith("word") and len(partial.split()) < 40
+            assert len(rest) < 3 and last_reply.startswith("word")
+            print("  ✓ Async turns cancelled by task or cancel()")
+            
+            from admission import AdmissionController
+            
+            async def cancel_repeatedly():
+                admission = AdmissionController(max_concurrent=1)
+                async_chatline = AsyncAdultChatline(sinks=[], limiter=limiter, admission=admission)
+                for attempt in range(20):
+                    task = asyncio.ensure_future(async_chatline.send_message(f"hi {attempt}"))
+                    await asyncio.sleep(0.02 + attempt * 0.005)
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+                    assert task.cancelled(), f"Cancellation swallowed on run {attempt}"
+                    last = async_chatline.conversation_history[-1]
+                    if last["role"] == "assistant":
+                        assert len(last["content"].split()) < 40, "Cancelled reply generated in full"
+                    assert admission.get_stats()["in_flight"] == 0, "Generation slot not released"
+                    assert not limiter._queue, "Limiter ticket left behind"
+            
+            asyncio.run(cancel_repeatedly())
+            assert limiter.tokens.level > 100000 - 4000, "Cancelled turns kept their reservations"
+            print("  ✓ Repeated task cancellation stops the reply and releases slot and quota")
+        finally:
+            os.environ.pop("GROQ_BASE_URL", None)
+    
+    print("✓ Cancellation successful\n")
+
+
+def test_conversation_log():
+    """Test the append-only conversation log and session resume"""
+    print("Testing Conversation Log...")
+    
+    import tempfile
+    from conversation_log import ConversationLog
+    
+    with tempfile.TemporaryDirectory() as log_dir:
+        log = ConversationLog(log_dir, segment_bytes=512, fsync="never", flush_interval=0.01)
+        chatline = AdultChatline(sinks=[], session_id="alice", log=log)
+        chatline._stream_response = lambda turn: iter(["Mmm, ", "hello"])
+        assert chatline.get_conversation_length() == 0
+        
+        chatline.send_message("first call")
+        chatline.change_personality(PersonalityPresets.ROMANTIC)
+        for i in range(6):
+            chatline.send_message(f"message {i}")
+        other = AdultChatline(sinks=[], session_id="bob", log=log)
+        other._stream_response = lambda turn: iter(["hey bob"])
+        other.send_message("bob here")
+        log.close()
+        assert len(list(Path(log_dir).glob("*.log"))) > 1
+        print("  ✓ Turns batched into rolling segments")
+        
+        # Simulate a crash mid-write
+        last_segment = sorted(Path(log_dir).glob("*.log"))[-1]
+        with open(last_segment, "ab") as f:
+            f.write(b"\x40\x00\x00\x00torn")
+        
+        log = ConversationLog(log_dir, segment_bytes=512, fsync="never", flush_interval=0.01)
+        resumed = AdultChatline(sinks=[], session_id="alice", log=log)
+        assert resumed.current_personality is PersonalityPresets.ROMANTIC
+        assert resumed.get_conversation_length() == 12
+        assert resumed.conversation_history[1]["content"] == "message 0"
+        assert resumed.conversation_history[-1]["content"] == "Mmm, hello"
+        print("  ✓ Session resumed from its own tail after a restart")
+        
+        log.compact("alice", "They like slow talk", 2)
+        tail = log.read_session("alice")
+        assert tail.summary == "They like slow talk"
+        assert [content for _, content in tail.messages] == ["message 5", "Mmm, hello"]
+        assert log.read_session("alice", max_messages=1).messages == [("assistant", "Mmm, hello")]
+        assert log.read_session("bob").messages == [("user", "bob here"), ("assistant", "hey bob")]
+        assert log.read_session("nobody") is None
+        print("  ✓ Compaction, tail limits and unknown sessions")
+        
+        import builtins
+        import conversation_log
+        opened = []
+        def counting_open(path, *args, **kwargs):
+            opened.append(path)
+            return builtins.open(path, *args, **kwargs)
+        conversation_log.open = counting_open
+        try:
+            log.read_session("alice")
+        finally:
+            del conversation_log.open
+        assert len(opened) == len(set(opened)), "A segment was reopened for every record"
+        saves = []
+        save_index = log._save_index
+        log._save_index = lambda: (saves.append(1), save_index())
+        log.append("alice", "user", "one more")
+        log.read_session("alice")
+        log.read_session("bob")
+        assert not saves, "Reading a session rewrote the index"
+        del log._save_index
+        print("  ✓ Each segment opened once per read")
+        
+        async def resume_async():
+            deferred = AsyncAdultChatline(sinks=[], session_id="bob", log=log)
+            assert deferred.get_conversation_length() == 0, "Async session resumed in __init__"
+            async def reply(turn):
+                yield "welcome back"
+            deferred._stream_response = reply
+            await deferred.send_message("it's me again")
+            return deferred
+        deferred = asyncio.run(resume_async())
+        assert [m["content"] for m in deferred.conversation_history[1:]] == [
+            "bob here", "hey bob", "it's me again", "welcome back"]
+        log.close()
+        print("  ✓ Async sessions resume off the event loop on their first message")
+    
+    print("✓ Conversation log successful\n")
+
+
+def test_transcript_archive():
+    """Test compressed transcript archiving and indexed retrieval"""
+    print("Testing Transcript Archive...")
+    
+    import tempfile
+    from datetime import datetime, timezone
+    from transcript_archive import TranscriptArchive
+    
+    with tempfile.TemporaryDirectory() as archive_dir:
+        archive = TranscriptArchive(archive_dir, segment_bytes=256, codec="zlib")
+        chatline = AdultChatline(sinks=[], session_id="alice", archive=archive)
+        chatline._stream_response = lambda turn: iter(["Mmm, ", "hello"])
+        assert chatline.archive_transcript() is None
+        
+        chatline.send_message("first call")
+        chatline.clear_history()
+        chatline.send_message("second call " * 20)
+        chatline.change_personality(PersonalityPresets.ROMANTIC)
+        assert archive.flush(timeout=5)
+        assert len(archive.find(user_id="alice")) == 2
+        print("  ✓ Calls archived when the history is reset")
+        
+        first_id = archive.archive([("user", "hi"), ("assistant", "hey there")], user_id="bob",
+                                   personality="Romantic", started_at=0, ended_at=86400)
+        archive.close()
+        
+        archive = TranscriptArchive(archive_dir, segment_bytes=256, codec="zlib")
+        transcript = archive.get(first_id)
+        assert transcript["messages"] == [["user", "hi"], ["assistant", "hey there"]]
+        assert transcript["user_id"] == "bob"
+        assert archive.get("missing") is None
+        assert [e["id"] for e in archive.find(date="1970-01-02")] == [first_id]
+        assert len(archive.find(personality="Flirty")) == 2
+        today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        assert len(archive.find(user_id="alice", date=today)) == 2
+        assert len(list(Path(archive_dir).glob("*.seg"))) > 1
+        print("  ✓ Transcripts fetched by id and found by user, date and personality")
+        
+        segments = len(list(Path(archive_dir).glob("*.seg")))
+        second_id = archive.archive([("user", "back again")], user_id="bob",
+                                    personality="Romantic", started_at=0, ended_at=86400)
+        assert archive.flush(timeout=5)
+        assert [e["id"] for e in archive.find(user_id="bob", personality="Romantic")] == [first_id, second_id]
+        assert archive.find(user_id="nobody") == [] and archive.find(user_id="bob", date="2000-01-01") == []
+        assert len(list(Path(archive_dir).glob("*.seg"))) in (segments, segments + 1)
+        assert archive.get(second_id)["messages"] == [["user", "back again"]]
+        print("  ✓ Reopened archive keeps appending to its last segment and indexes new entries")
+        archive.close()
+    
+    print("✓ Transcript archive successful\n")
+
+
+def test_personality_registry():
+    """Test indexed personality lookup, file overrides and custom personalities"""
+    print("Testing Personality Registry...")
+    
+    import json
+    import tempfile
+    from personalities import PersonalityRegistry
+    from messages import system_message
+    from user_manager import User
+    from payments import SubscriptionTier
+    
+    with tempfile.TemporaryDirectory() as personality_dir:
+        registry = PersonalityRegistry(personality_dir, reload_interval=0)
+        assert registry.get("Romantic") is PersonalityPresets.ROMANTIC
+        assert registry.get("Nobody") is None
+        assert registry.list() is registry.list()
+        assert registry.default() is PersonalityPresets.FLIRTY
+        assert system_message(PersonalityPresets.FLIRTY["system_prompt"]).tokens is not None
+        print("  ✓ Presets indexed by name with system prompts pre-counted")
+        
+        path = Path(personality_dir) / "operators.json"
+        path.write_text(json.dumps([
+            {"name": "Romantic", "system_prompt": "You are a poet."},
+            {"name": "Sporty", "system_prompt": "You are a personal trainer.", "icon": "🏋️"},
+        ]))
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        assert registry.get("Romantic")["system_prompt"] == "You are a poet."
+        assert [p["name"] for p in registry.list()][-1] == "Sporty"
+        path.write_text("{ half written")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 2 * 10 ** 9))
+        assert registry.get("Sporty") is not None
+        path.unlink()
+        assert registry.get("Romantic") is PersonalityPresets.ROMANTIC
+        print("  ✓ Operator files hot-reloaded, half-written files ignored")
+        
+        vip = User("vip-user", "vip@example.com", SubscriptionTier.VIP)
+        free = User("free-user", "free@example.com", SubscriptionTier.FREE)
+        custom = registry.add_custom(vip, "Nurse Nina", "You are a caring night nurse.")
+        assert custom["owner"] == "vip-user"
+        assert registry.get("Nurse Nina", "vip-user") is custom
+        assert registry.get("Nurse Nina") is None
+        assert registry.get("Nurse Nina", "free-user") is None
+        for args in ((free, "Mine", "prompt"), (vip, "Flirty", "prompt"), (vip, "", "prompt")):
+            try:
+                registry.add_custom(*args)
+                assert False, "Should have refused"
+            except ValueError:
+                pass
+        registry.add_custom(vip, "Two", "Second.")
+        registry.add_custom(vip, "Three", "Third.")
+        try:
+            registry.add_custom(vip, "Four", "Fourth.")
+            assert False, "Should have run out of slots"
+        except ValueError:
+            pass
+        print("  ✓ Custom personalities gated by plan and slots")
+        
+        reopened = PersonalityRegistry(personality_dir, reload_interval=0)
+        assert [p["name"] for p in reopened.list("vip-user")][-3:] == ["Nurse Nina", "Two", "Three"]
+        chatline = AdultChatline(user=vip, sinks=[], personalities=reopened)
+        chatline.change_personality(reopened.get("Nurse Nina", "vip-user"))
+        assert chatline.current_personality["name"] == "Nurse Nina"
+        state = chatline.get_state()
+        assert "system_prompt" not in state
+        restored = AdultChatline(user=vip, sinks=[], personalities=reopened)
+        restored.load_state(state)
+        assert restored.conversation_history[0]["content"] == "You are a caring night nurse."
+        other = AdultChatline(user=free, sinks=[], personalities=reopened)
+        other.change_personality(reopened.get("Nurse Nina", "vip-user"))
+        assert other.current_personality is PersonalityPresets.FLIRTY
+        assert reopened.remove_custom("vip-user", "Two")
+        assert not reopened.remove_custom("vip-user", "Two")
+        print("  ✓ Custom personalities persisted and usable only by their owner")
+        
+        bounded = PersonalityRegistry(personality_dir, reload_interval=60, max_users=2)
+        for i in range(50):
+            assert bounded.get("Nurse Nina", f"caller-{i}") is None
+        assert len(bounded._users) == 2, "Custom personality cache not bounded"
+        stats = []
+        original_stat = Path.stat
+        def counting_stat(path, *args, **kwargs):
+            stats.append(path)
+            return original_stat(path, *args, **kwargs)
+        Path.stat = counting_stat
+        try:
+            for _ in range(10):
+                assert bounded.get("Nurse Nina", "caller-49") is None
+        finally:
+            Path.stat = original_stat
+        assert not stats, "Caller without custom personalities re-checked on every message"
+        for i in range(3):
+            bounded.add_custom(User(f"vip-{i}", f"vip{i}@example.com", SubscriptionTier.VIP),
+                               f"Nurse {i}", "You are a nurse.")
+            assert bounded.get(f"Nurse {i}", f"vip-{i}")["owner"] == f"vip-{i}"
+        assert list(bounded._users) == ["vip-1", "vip-2"], "Custom personality cache not bounded"
+        assert bounded.get("Nurse 0", "vip-0") is not None
+        print("  ✓ Custom personality cache bounded, callers without any cached too")
+    
+    print("✓ Personality registry successful\n")
+
+
+def test_cold_start():
+    """Test that entry points import fast and defer heavy modules"""
+    print("Testing Cold Start...")
+    
+    import subprocess
+    import tempfile
+    
+    here = os.path.dirname(os.path.abspath(__file__))
+    budget_ms = float(os.getenv("IMPORT_TIME_BUDGET_MS", "100"))
+    env = dict(os.environ, GROQ_API_KEY="test_key_for_structure_testing", RESPONSE_CACHE="false",
+               CONVERSATION_LOG="false", TRANSCRIPT_ARCHIVE="false")
+    
+    def import_ms(module):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=here, env=env, capture_output=True, text=True, check=True)
+        # Lines look like "import time: self [us] | cumulative | module",
+        # with nested imports indented under the module name
+        cumulative = [int(line.split("|")[1]) for line in result.stderr.splitlines()
+                      if line.split("|")[-1] == f" {module}"]
+        assert cumulative, f"No import time reported for {module}"
+        return cumulative[0] / 1000
+    
+    for module in ("chatline", "admin_dashboard"):
+        # Best of several runs, so a busy machine doesn't fail the budget
+        best = min(import_ms(module) for _ in range(5))
+        assert best < budget_ms, f"import {module} took {best:.0f} ms"
+        print(f"  ✓ import {module} in {best:.0f} ms (best of 5, budget {budget_ms:.0f} ms)")
+    
+    probe = (
+        "import sys, chatline\n"
+        "deferred = ('dotenv', 'admission', 'compaction', 'conversation_log', 'transcript_archive')\n"
+        "print(','.join(m for m in deferred if m in sys.modules))\n"
+        "chatline.AdultChatline(sinks=[])\n"
+        "lazy = ('groq', 'httpx', 'asyncio', 'payments', 'user_manager', 'conversation_log', 'transcript_archive')\n"
+        "print(','.join(m for m in lazy if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, "-c", probe], cwd=here, env=env,
+                            capture_output=True, text=True, check=True)
+    on_import, on_session = result.stdout.split("\n")[:2]
+    assert on_import == "", f"Loaded by import chatline: {on_import}"
+    assert on_session == "", f"Loaded eagerly: {on_session}"
+    print("  ✓ SDK, asyncio, payments and disabled features stay unloaded until first used")
+    
+    from admin_dashboard import AdminDashboard
+    from user_manager import UserManager
+    
+    with tempfile.TemporaryDirectory() as data_dir:
+        manager = UserManager(data_dir=data_dir)
+        manager.create_user("cold@example.com")
+        reopened = UserManager(data_dir=data_dir)
+        assert reopened._users is None and reopened._sessions is None
+        assert reopened.get_user_by_email("cold@example.com") is not None
+        dashboard = AdminDashboard(data_dir=data_dir)
+        assert dashboard._user_manager is None
+        assert dashboard.get_user_stats()["total_users"] == 1
+    print("  ✓ User data and admin services load on first use")
+    
+    print("✓ Cold start successful\n")
+
+
+def test_admission_control():
+    """Test tier-priority admission, timeouts and load shedding"""
+    print("Testing Admission Control...")
+    
+    from admission import AdmissionController, AdmissionTimeout, LoadShed
+    from chatline import LINE_FULL_MESSAGE
+    from metrics import MetricsRegistry
+    from rate_limit import UpstreamLimiter
+    from stream_sinks import StreamSink
+    
+    def wait_for_queue(controller, depth):
+        deadline = time.monotonic() + 5
+        while sum(controller.get_stats()["queued"].values()) < depth:
+            assert time.monotonic() < deadline, "Waiters never queued"
+            time.sleep(0.005)
+    
+    registry = MetricsRegistry()
+    controller = AdmissionController(max_concurrent=1, shed_depth=0, metrics=registry)
+    holder = controller.acquire("vip")
+    order = []
+    
+    def caller(tier):
+        admission = controller.acquire(tier)
+        order.append(tier)
+        admission.release()
+    
+    threads = []
+    for tier in ["free", "free", "free", "premium", "premium", "premium", "vip", "vip", "vip"]:
+        threads.append(threading.Thread(target=caller, args=(tier,)))
+        threads[-1].start()
+        wait_for_queue(controller, len(threads))
+    assert registry.gauge("chat_admission_queue_depth", tier="free").value == 3
+    holder.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert len(order) == 9
+    assert order[0] == "vip" and order[1] == "premium"
+    assert order.index("free") > order.index("vip")
+    assert order.index("free") < 9 - 1, "FREE callers should not wait for every VIP"
+    assert registry.histogram("chat_admission_wait_seconds", tier="free").count == 3
+    assert controller.get_stats()["in_flight"] == 0
+    print(f"  ✓ Weighted fair dequeue: {' > '.join(order)}")
+    
+    holder = controller.acquire("premium")
+    try:
+        controller.acquire("free", timeout=0.05)
+        assert False, "Should have timed out"
+    except AdmissionTimeout:
+        pass
+    assert registry.counter("chat_admission_rejected_total", tier="free", reason="timeout").value == 1
+    
+    async def wait_async():
+        return await controller.acquire_async("vip", timeout=5)
+    
+    threading.Timer(0.05, holder.release).start()
+    asyncio.run(wait_async()).release()
+    assert controller.get_stats()["in_flight"] == 0
+    print("  ✓ Per-tier max wait, async waiters woken on release")
+    
+    controller = AdmissionController(max_concurrent=1, shed_depth=1, metrics=registry)
+    holder = controller.acquire("vip")
+    queued = threading.Thread(target=lambda: controller.acquire("premium", timeout=5).release())
+    queued.start()
+    wait_for_queue(controller, 1)
+    try:
+        controller.acquire("free")
+        assert False, "Should have been shed"
+    except LoadShed:
+        pass
+    
+    chatline = AdultChatline(sinks=[], metrics=registry, admission=controller)
+    chatline.client = None
+    assert chatline.send_message("hello?", stream=False) == LINE_FULL_MESSAGE
+    assert chatline.get_conversation_length() == 0
+    assert registry.counter("chat_admission_rejected_total", tier="free", reason="shed").value == 2
+    holder.release()
+    queued.join(timeout=5)
+    assert controller.get_stats()["in_flight"] == 0
+    assert "chat_admission_queue_depth" in registry.render_prometheus()
+    print("  ✓ FREE callers shed with a friendly message when queues are deep")
+
+    from types import SimpleNamespace
+    
+    class SlowStream(FakeStream):
+        def __iter__(self):
+            for chunk in super().__iter__():
+                time.sleep(0.01)
+                yield chunk
+    
+    def create(**kwargs):
+        return SlowStream(["word "] * 100)
+    
+    controller = AdmissionController(max_concurrent=1, metrics=registry)
+    limiter = UpstreamLimiter(requests_per_minute=0, tokens_per_minute=6000)
+    chatline = AdultChatline(sinks=[], metrics=registry, admission=controller, limiter=limiter)
+    chatline.client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    first_delta = threading.Event()
+    
+    class Started(StreamSink):
+        def on_delta(self, text):
+            first_delta.set()
+    
+    first = threading.Thread(target=chatline.send_message, args=("one",), kwargs={"sinks": [Started()]})
+    first.start()
+    assert first_delta.wait(5)
+    second = chatline.stream_message("two")
+    next(second)
+    first.join(timeout=5)
+    assert controller.get_stats()["in_flight"] == 1
+    try:
+        controller.acquire("vip", timeout=0.05)
+        assert False, "The interrupted turn freed the slot of the turn replacing it"
+    except AdmissionTimeout:
+        pass
+    second.close()
+    assert controller.get_stats()["in_flight"] == 0
+    assert limiter.tokens.level > 6000 - chatline.max_tokens
+    print("  ✓ An interrupted turn releases only its own slot and quota")
+
+    print("✓ Admission control successful\n")
+
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -137,6 +1491,25 @@ def main():
         test_personality_change(chatline)
         test_conversation_management(chatline)
         test_configuration()
+        test_async_chatline()
+        test_context_window()
+        test_compaction()
+        test_response_cache()
+        test_stream_sinks()
+        test_latency_metrics()
+        test_shared_client()
+        test_resilience()
+        test_model_router()
+        test_rate_limiter()
+        test_fake_groq_server()
+        test_message_storage()
+        test_session_manager()
+        test_cancellation()
+        test_conversation_log()
+        test_transcript_archive()
+        test_personality_registry()
+        test_cold_start()
+        test_admission_control()
         
         print("=" * 60)
         print("✅ ALL TESTS PASSED!")
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Transcript Archive for 1-800-PHONESEX
+Keeps finished call transcripts for support and compliance. Transcripts are
+compressed one by one (zstd when installed, zlib otherwise) into append-only
+segment files, with a small index by user, date and personality, so fetching
+one transcript is a single seek and decompress. Compression runs on a
+background worker; the chat path only enqueues.
+"""
+
+import os
+import json
+import zlib
+import time
+import uuid
+import queue
+import atexit
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+from metrics import MetricsRegistry, REGISTRY
+
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return zlib.compress(data, min(level, 9))
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == CODEC_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Transcript was archived with zstd; install the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class TranscriptArchive:
+    """Compressed, indexed store of finished transcripts"""
+
+    _shared: Optional['TranscriptArchive'] = None
+
+    def __init__(self, directory: Optional[str] = None, segment_bytes: Optional[int] = None,
+                 level: int = 6, codec: Optional[str] = None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Open (or create) an archive
+
+        Args:
+            directory: Archive directory (TRANSCRIPT_ARCHIVE_DIR, default ./transcripts)
+            segment_bytes: Size at which a new segment file starts
+                (TRANSCRIPT_SEGMENT_MB, default 256 MB)
+            level: Compression level
+            codec: "zstd" or "zlib" (defaults to zstd when installed)
+            metrics: Registry for compression time and ratio
+        """
+        self.directory = Path(directory or os.getenv("TRANSCRIPT_ARCHIVE_DIR", "./transcripts"))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if segment_bytes is None:
+            segment_bytes = int(float(os.getenv("TRANSCRIPT_SEGMENT_MB", "256")) * 1024 * 1024)
+        self.segment_bytes = segment_bytes
+        self.level = level
+        self.codec = codec or (CODEC_ZSTD if ZSTD_AVAILABLE else CODEC_ZLIB)
+        self.metrics = metrics or REGISTRY
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        # Transcript ids by user, date and personality, oldest first
+        self._by_user: Dict[Optional[str], List[str]] = {}
+        self._by_date: Dict[str, List[str]] = {}
+        self._by_personality: Dict[Optional[str], List[str]] = {}
+        # Segment being appended to and its size; only the worker changes them
+        self._segment = 1
+        self._segment_size = 0
+        self._load_index()
+
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, daemon=True, name="transcript-archive")
+        self._worker.start()
+
+    @classmethod
+    def shared(cls) -> Optional['TranscriptArchive']:
+        """Get the process-wide archive, or None unless TRANSCRIPT_ARCHIVE is enabled"""
+        if os.getenv("TRANSCRIPT_ARCHIVE", "false").lower() != "true":
+            return None
+        if cls._shared is None:
+            cls._shared = cls()
+            atexit.register(cls._shared.close)
+        return cls._shared
+
+    def archive(self, messages: Sequence[Tuple[str, str]], user_id: Optional[str] = None,
+                personality: Optional[str] = None, started_at: Optional[float] = None,
+                ended_at: Optional[float] = None) -> str:
+        """
+        Queue a finished transcript (returns without compressing or writing)
+
+        Args:
+            messages: (role, content) pairs, without the system prompt
+            user_id: Caller's user id
+            personality: Operator the caller talked to
+            started_at: Call start as a Unix timestamp
+            ended_at: Call end as a Unix timestamp (defaults to now)
+
+        Returns:
+            Transcript id
+        """
+        transcript_id = uuid.uuid4().hex
+        ended_at = ended_at if ended_at is not None else time.time()
+        self._queue.put({
+            "id": transcript_id,
+            "user_id": user_id,
+            "personality": personality,
+            "started_at": started_at,
+            "ended_at": ended_at,
+            "messages": [[role, content] for role, content in messages],
+        })
+        return transcript_id
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far is archived"""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """Archive what is queued and stop the worker"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        """Worker thread: compress and append queued transcripts"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+            try:
+                self._write(item)
+            except Exception as e:
+                # Never take the worker down; the next transcript may succeed
+                print(f"⚠️  Could not archive transcript {item['id']}: {e}")
+
+    def _write(self, transcript: Dict):
+        """Compress one transcript, append it to the segment and index it"""
+        started = time.perf_counter()
+        raw = json.dumps(transcript, separators=(",", ":")).encode("utf-8")
+        data = _compress(raw, self.codec, self.level)
+
+        segment = self._current_segment(len(data))
+        path = self._segment_path(segment)
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._segment_size = offset + len(data)
+
+        ended = datetime.fromtimestamp(transcript["ended_at"], tz=timezone.utc)
+        entry = {
+            "id": transcript["id"],
+            "user_id": transcript["user_id"],
+            "date": ended.strftime("%Y-%m-%d"),
+            "personality": transcript["personality"],
+            "messages": len(transcript["messages"]),
+            "segment": segment,
+            "offset": offset,
+            "length": len(data),
+            "codec": self.codec,
+        }
+        with open(self._index_path(), "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        with self._lock:
+            self._add_entry(entry)
+
+        self.metrics.observe("chat_archive_seconds", time.perf_counter() - started)
+        self.metrics.increment("chat_archive_bytes_total", len(data), stage="compressed")
+        self.metrics.increment("chat_archive_bytes_total", len(raw), stage="raw")
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"transcripts-{segment:06d}.seg"
+
+    def _index_path(self) -> Path:
+        return self.directory / "index.jsonl"
+
+    def _current_segment(self, incoming: int) -> int:
+        """Segment that the next transcript goes into, starting a new one when full"""
+        if self._segment_size > 0 and self._segment_size + incoming > self.segment_bytes:
+            self._segment += 1
+            self._segment_size = 0
+        return self._segment
+
+    def _add_entry(self, entry: Dict):
+        """Index an entry by id, user, date and personality (caller holds the lock)"""
+        self._entries[entry["id"]] = entry
+        self._by_user.setdefault(entry["user_id"], []).append(entry["id"])
+        self._by_date.setdefault(entry["date"], []).append(entry["id"])
+        self._by_personality.setdefault(entry["personality"], []).append(entry["id"])
+
+    def _load_index(self):
+        """Load the index, skipping a line torn by a crash, and find the open segment"""
+        path = self._index_path()
+        if path.exists():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._add_entry(entry)
+        self._segment = max((e["segment"] for e in self._entries.values()), default=1)
+        try:
+            self._segment_size = self._segment_path(self._segment).stat().st_size
+        except OSError:
+            self._segment_size = 0
+
+    def get(self, transcript_id: str) -> Optional[Dict]:
+        """
+        Fetch one transcript
+
+        Args:
+            transcript_id: Id returned by archive()
+
+        Returns:
+            Transcript with id, user_id, personality, started_at, ended_at
+            and messages, or None if there is no such transcript
+        """
+        with self._lock:
+            entry = self._entries.get(transcript_id)
+        if entry is None:
+            return None
+        with open(self._segment_path(entry["segment"]), "rb") as f:
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+        return json.loads(_decompress(data, entry["codec"]))
+
+    def find(self, user_id: Optional[str] = None, date: Optional[str] = None,
+             personality: Optional[str] = None) -> List[Dict]:
+        """
+        Look up transcripts in the index (no segment is read)
+
+        Args:
+            user_id: Only this caller's transcripts
+            date: Only transcripts ended on this UTC date (YYYY-MM-DD)
+            personality: Only transcripts with this operator
+
+        Returns:
+            Matching index entries, oldest first
+        """
+        with self._lock:
+            # Start from the narrowest index that applies, then check the rest
+            candidates = [
+                index.get(value, [])
+                for index, value in ((self._by_user, user_id), (self._by_date, date),
+                                     (self._by_personality, personality))
+                if value is not None
+            ]
+            if candidates:
+                entries = [self._entries[i] for i in min(candidates, key=len)]
+            else:
+                entries = list(self._entries.values())
+        return [
+            e for e in entries
+            if (user_id is None or e["user_id"] == user_id)
+            and (date is None or e["date"] == date)
+            and (personality is None or e["personality"] == personality)
+        ]
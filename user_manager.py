@@ -73,6 +73,11 @@ class User:
         available = features.get("personalities_available", [])
         return personality_name in available
     
+    def can_create_custom_personality(self) -> bool:
+        """Check if user's plan includes custom personalities"""
+        features = self.get_features()
+        return features.get("custom_personalities", False)
+    
     def get_daily_message_limit(self) -> int:
         """Get user's daily message limit"""
         features = self.get_features()
@@ -103,20 +108,35 @@ class UserManager:
         self.users_file = self.data_dir / "users.json"
         self.sessions_file = self.data_dir / "sessions.json"
         
-        self._load_users()
-        self._load_sessions()
+        # Each file is parsed the first time it is needed
+        self._users: Optional[Dict[str, User]] = None
+        self._sessions: Optional[Dict] = None
+    
+    @property
+    def users(self) -> Dict[str, User]:
+        """Users by id, loaded from storage on first use"""
+        if self._users is None:
+            self._load_users()
+        return self._users
+    
+    @property
+    def sessions(self) -> Dict:
+        """Active sessions by token, loaded from storage on first use"""
+        if self._sessions is None:
+            self._load_sessions()
+        return self._sessions
     
     def _load_users(self):
         """Load users from storage"""
         if self.users_file.exists():
             with open(self.users_file, 'r') as f:
                 data = json.load(f)
-                self.users = {
+                self._users = {
                     user_id: User.from_dict(user_data)
                     for user_id, user_data in data.items()
                 }
         else:
-            self.users = {}
+            self._users = {}
     
     def _save_users(self):
         """Save users to storage"""
@@ -131,9 +151,9 @@ class UserManager:
         """Load active sessions"""
         if self.sessions_file.exists():
             with open(self.sessions_file, 'r') as f:
-                self.sessions = json.load(f)
+                self._sessions = json.load(f)
         else:
-            self.sessions = {}
+            self._sessions = {}
     
     def _save_sessions(self):
         """Save sessions to storage"""
@@ -323,6 +343,19 @@ class FeatureGate:
         """
         return user.can_access_personality(personality_name)
     
+    @staticmethod
+    def check_custom_personality_access(user: User) -> bool:
+        """
+        Check if user can create and talk to custom personalities
+        
+        Args:
+            user: User object
+        
+        Returns:
+            True if user has access, False otherwise
+        """
+        return user.can_create_custom_personality()
+    
     @staticmethod
     def check_streaming_access(user: User) -> bool:
         """
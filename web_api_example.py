@@ -27,6 +27,11 @@ user_manager = UserManager()
 payment_processor = PaymentProcessor()
 usage_tracker = UsageTracker()
 
+# Chat sessions stay in memory while active and are hibernated to disk when idle
+from session_manager import ChatSessionManager
+session_manager = ChatSessionManager()
+session_manager.start_reaper()
+
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -242,6 +247,110 @@ def send_message():
     })
 
 
+@app.route('/api/chat/stream', methods=['POST'])
+def stream_message():
+    '''Stream a chat reply as Server-Sent Events'''
+    from flask import Response
+    from stream_sinks import SSESink
+    
+    session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    user_id = user_manager.validate_session(session_token) if session_token else None
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user = user_manager.get_user(user_id)
+    message = request.json.get('message', '')
+    
+    def events():
+        # SSESink encodes each delta; the generator hands them to Flask
+        pending = []
+        sink = SSESink(pending.append)
+        with session_manager.session(user_id, user=user) as chatline:
+            replies = chatline.stream_message(message, sinks=[sink])
+            try:
+                for _ in replies:
+                    yield from pending
+                    pending.clear()
+            finally:
+                # Runs when the client disconnects too: stops generation and
+                # keeps the partial reply in the history
+                replies.close()
+        yield from pending
+    
+    return Response(events(), mimetype='text/event-stream')
+
+
+@app.route('/api/chat/cancel', methods=['POST'])
+def cancel_message():
+    '''Stop the reply currently streaming for this user'''
+    session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    user_id = user_manager.validate_session(session_token) if session_token else None
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    with session_manager.session(user_id) as chatline:
+        cancelled = chatline.cancel()
+    return jsonify({'cancelled': cancelled})
+
+
+@app.route('/api/personalities', methods=['GET'])
+def list_personalities():
+    '''List the operators, including the caller's custom ones'''
+    from personalities import PersonalityRegistry
+    
+    session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    user_id = user_manager.validate_session(session_token) if session_token else None
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user = user_manager.get_user(user_id)
+    return jsonify({'personalities': [
+        {
+            'name': p['name'],
+            'description': p.get('description', ''),
+            'custom': p.get('owner') is not None,
+            'locked': p.get('owner') is None and not user.can_access_personality(p['name']),
+        }
+        for p in PersonalityRegistry.shared().list(user_id)
+    ]})
+
+
+@app.route('/api/personalities/custom', methods=['POST'])
+def create_custom_personality():
+    '''Create or replace a custom operator (VIP)'''
+    from personalities import PersonalityRegistry
+    
+    session_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    user_id = user_manager.validate_session(session_token) if session_token else None
+    if not user_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    user = user_manager.get_user(user_id)
+    if not FeatureGate.check_custom_personality_access(user):
+        return jsonify({
+            'error': FeatureGate.get_upgrade_prompt(user, 'custom'),
+            'upgrade_url': '/upgrade'
+        }), 403
+    
+    data = request.json
+    try:
+        personality = PersonalityRegistry.shared().add_custom(
+            user, data.get('name', ''), data.get('system_prompt', ''), data.get('description', '')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'name': personality['name']}), 201
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    '''Chat latency histograms in Prometheus text format'''
+    from flask import Response
+    from metrics import REGISTRY
+    
+    return Response(REGISTRY.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/webhook/stripe', methods=['POST'])
 def stripe_webhook():
     '''Handle Stripe webhook events'''
@@ -307,5 +416,10 @@ print("  GET  /api/subscription/plans - List subscription plans")
 print("  POST /api/subscription/create - Create subscription")
 print("  POST /api/subscription/cancel - Cancel subscription")
 print("  POST /api/chat/message - Send chat message")
+print("  POST /api/chat/stream - Stream chat reply (Server-Sent Events)")
+print("  POST /api/chat/cancel - Stop the reply being streamed")
+print("  GET  /api/personalities - List operators, including custom ones")
+print("  POST /api/personalities/custom - Create a custom operator (VIP)")
 print("  POST /api/webhook/stripe - Stripe webhook handler")
 print("  GET  /api/admin/stats - Admin statistics")
+print("  GET  /metrics - Chat latency metrics (Prometheus)")
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Voice Worker Load for 1-800-PHONESEX
+Tells LiveKit how busy a voice worker is so calls are routed to workers
+with room to spare. Load is the highest of CPU use, the worker's event-loop
+lag and its share of the per-worker call limit. A full or draining worker
+turns job requests away so they are dispatched to another worker, while
+calls already in progress run to completion.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from metrics import MetricsRegistry, REGISTRY
+
+
+# How often LiveKit asks for the load, and how often event-loop lag is sampled, in seconds
+LOAD_INTERVAL = 0.5
+
+# Seconds an accepted call counts toward the limit before its job shows up
+STARTING_GRACE = 10.0
+
+# CPU samples averaged (one per LOAD_INTERVAL)
+CPU_SAMPLES = 5
+
+
+class WorkerLoad:
+    """
+    Load function and job request handler for the voice worker
+
+    Pass the instance as WorkerOptions.load_fnc and its request() method as
+    WorkerOptions.request_fnc, and bind() it to the AgentServer built from
+    those options so calls are counted and loop lag sampled from the start.
+    """
+
+    _shared: Optional['WorkerLoad'] = None
+
+    def __init__(self, max_calls: Optional[int] = None, threshold: Optional[float] = None,
+                 max_loop_lag: Optional[float] = None, cpu_monitor=None,
+                 metrics: Optional[MetricsRegistry] = None):
+        """
+        Initialize load tracking
+
+        Args:
+            max_calls: Concurrent calls per worker (VOICE_MAX_CALLS,
+                default 0 = no limit)
+            threshold: Load at which the worker stops taking calls
+                (VOICE_LOAD_THRESHOLD, default 0.75); CPU use is compared to
+                it directly
+            max_loop_lag: Event-loop lag in seconds at which the worker
+                counts as full (VOICE_MAX_LOOP_LAG_MS, default 200 ms)
+            cpu_monitor: Object with cpu_percent(interval) returning 0-1
+                (defaults to LiveKit's cgroup-aware monitor)
+            metrics: Registry for load gauges and rejection counters
+        """
+        if max_calls is None:
+            max_calls = int(os.getenv("VOICE_MAX_CALLS", "0"))
+        if threshold is None:
+            threshold = float(os.getenv("VOICE_LOAD_THRESHOLD", "0.75"))
+        if max_loop_lag is None:
+            max_loop_lag = float(os.getenv("VOICE_MAX_LOOP_LAG_MS", "200")) / 1000
+        self.max_calls = max_calls
+        self.threshold = threshold
+        self.max_loop_lag = max_loop_lag
+        self.metrics = metrics or REGISTRY
+        self.server = None
+
+        self._lag_monitor = None
+        self._cpu_monitor = cpu_monitor
+        self._cpu = deque(maxlen=CPU_SAMPLES)
+        self._sampler: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._lag = deque(maxlen=CPU_SAMPLES)
+        # Calls accepted but not yet running, by job id
+        self._starting: Dict[str, float] = {}
+
+    @classmethod
+    def shared(cls) -> 'WorkerLoad':
+        """Get the process-wide load tracker configured from the environment"""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def _sample_cpu(self):
+        """Sampler thread: keep a moving average of CPU use"""
+        while True:
+            value = self._cpu_monitor.cpu_percent(interval=LOAD_INTERVAL)
+            with self._lock:
+                self._cpu.append(value)
+
+    def _start_sampler(self):
+        if self._cpu_monitor is None:
+            from livekit.agents.utils.hw import get_cpu_monitor
+            self._cpu_monitor = get_cpu_monitor()
+        self._sampler = threading.Thread(target=self._sample_cpu, daemon=True, name="voice-worker-load")
+        self._sampler.start()
+
+    def bind(self, server):
+        """
+        Attach to the agent server before it starts
+
+        Calls are counted from the server's jobs, and event-loop lag is
+        sampled on the server's loop once the worker has started.
+
+        Args:
+            server: The LiveKit AgentServer
+        """
+        self.server = server
+        server.on("worker_started", self._start_lag_monitor)
+
+    def _start_lag_monitor(self):
+        """Start sampling lag on the running loop (the worker's), once"""
+        import asyncio
+        if self._lag_monitor is None or self._lag_monitor.done():
+            self._lag_monitor = asyncio.get_running_loop().create_task(self.watch_loop_lag())
+
+    async def watch_loop_lag(self):
+        """Sample how late a LOAD_INTERVAL sleep wakes up on this event loop"""
+        import asyncio
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOAD_INTERVAL)
+            self._record_lag(time.monotonic() - started - LOAD_INTERVAL)
+
+    def _record_lag(self, lag: float):
+        """Keep a lag sample; the loop spent that long busy past a wake-up"""
+        with self._lock:
+            self._lag.append(max(lag, 0.0))
+
+    def active_calls(self) -> int:
+        """
+        Calls running on the worker, plus accepted ones still starting
+
+        Until the server is known only accepted calls can be counted, so
+        they are kept until its job list can confirm them.
+        """
+        running = {info.job.id for info in self.server.active_jobs} if self.server is not None else set()
+        now = time.monotonic()
+        with self._lock:
+            if self.server is not None:
+                for job_id, accepted in list(self._starting.items()):
+                    if job_id in running or now - accepted > STARTING_GRACE:
+                        del self._starting[job_id]
+            return len(running) + len(self._starting)
+
+    def components(self) -> Dict[str, float]:
+        """Get each part of the load, scaled so the threshold means full"""
+        calls = self.active_calls()
+        with self._lock:
+            cpu = sum(self._cpu) / len(self._cpu) if self._cpu else 0.0
+            lag = max(self._lag, default=0.0)
+        if not self.max_calls:
+            call_load = 0.0
+        elif calls >= self.max_calls:
+            call_load = 1.0
+        else:
+            call_load = self.threshold * calls / self.max_calls
+        lag_load = min(self.threshold * lag / self.max_loop_lag, 1.0) if self.max_loop_lag > 0 else 0.0
+        return {"calls": call_load, "cpu": cpu, "loop_lag": lag_load,
+                "active_calls": calls, "loop_lag_seconds": lag}
+
+    def __call__(self, server) -> float:
+        """
+        Load function for WorkerOptions.load_fnc
+
+        Args:
+            server: The LiveKit agent server
+
+        Returns:
+            Load from 0 to 1; at or above the threshold the worker takes no calls
+        """
+        if self.server is None:
+            self.server = server
+        if self._sampler is None:
+            self._start_sampler()
+
+        parts = self.components()
+        load = max(parts["calls"], parts["cpu"], parts["loop_lag"])
+        self.metrics.gauge("voice_worker_load").set(load)
+        self.metrics.gauge("voice_worker_active_calls").set(parts["active_calls"])
+        self.metrics.gauge("voice_worker_loop_lag_seconds").set(parts["loop_lag_seconds"])
+        return load
+
+    def has_capacity(self) -> bool:
+        """Whether the worker is below its call limit"""
+        return not self.max_calls or self.active_calls() < self.max_calls
+
+    async def request(self, job_request):
+        """
+        Job request handler for WorkerOptions.request_fnc
+
+        Turns the call away (so LiveKit offers it to another worker) when this
+        worker is draining or at its call limit, and accepts it otherwise.
+
+        Args:
+            job_request: LiveKit job request
+        """
+        # Also runs on the worker's loop, in case bind() was not used
+        self._start_lag_monitor()
+        reason = None
+        if self.server is not None and self.server.draining:
+            reason = "draining"
+        elif not self.has_capacity():
+            reason = "full"
+
+        if reason is not None:
+            self.metrics.increment("voice_jobs_rejected_total", reason=reason)
+            await job_request.reject(terminate=False)
+            return
+
+        with self._lock:
+            self._starting[job_request.id] = time.monotonic()
+        await job_request.accept()